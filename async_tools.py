@@ -0,0 +1,438 @@
+import asyncio, weakref
+from functools import partial
+from pathlib import Path
+
+import httpx
+from google.adk.tools.tool_context import ToolContext
+from google.genai import types
+
+from . import audio_codec, tools
+from .clients import genai_client
+from .engine_router import NoEngineAvailable
+from .local_tts import local_tts
+from .persona_profile import Profile, StyleSet
+from .profile_store import style_store, accent_store
+from .metrics import inc, span, timed
+from .upstream import LIMITS, flight, limited_async
+from .persona_common import (
+    ACCENT_CONFIG, DETAILS_CONFIG, DETAILS_SYSTEM, PERSONA_DEADLINE, STYLE_CONFIG, STYLE_SYSTEM, accent_prompt,
+    active_persona, cached_profile, collect_bundle, details_prompt, flight_name, remember_persona, store_profile,
+    store_text, style_prompt,
+)
+from .tts_common import (
+    AUDIO_DIR, ELEVEN_RETRIES, ELEVEN_RETRY_STATUS, GEMINI_TTS_MODEL, LOCAL_TTS_DRAFT_AFTER, TTS_ROUTER, TTS_STREAMING,
+    append_clip, audio_result, auto_candidates, cache_key, cached_head, clip_cache, eleven_call, finish_stream,
+    gemini_key, gemini_tts_config, label_fallback, local_key, local_voice, no_engine, pin_clip, publish_clip,
+    retry_after, retry_delay, save_head, split_sentences, stitch, stream_target, strip_id3, wav_bytes, wav_frames,
+    write_atomic,
+)
+
+
+# --- ASYNC TOOLS ---------------------------------------------------------------
+# Same contracts, caches and session state as tools.py, but built on the genai
+# async client and httpx, so a waiting conversation holds no thread. These are
+# the versions registered on root_agent; tools.py keeps the sync ones for
+# scripts and the CLI. Both build on persona_common and tts_common; their
+# disk, SQLite and encoder steps run here through asyncio.to_thread, so an
+# fsync, a busy shared db or an MP3 encode never stalls the other sessions
+# on the loop.
+
+_TTS_CONCURRENCY = 8          # upstream TTS requests in flight per event loop
+_ELEVEN_TIMEOUT = httpx.Timeout(30.0, connect=3.05)
+_ELEVEN_LIMITS = httpx.Limits(max_connections=64, max_keepalive_connections=32)
+
+_BACKGROUND: set = set()      # producers / late persona parts that outlive the tool call
+
+
+class _LoopState:
+    # httpx pools and asyncio primitives belong to one event loop
+    def __init__(self):
+        self.http = httpx.AsyncClient(timeout=_ELEVEN_TIMEOUT, limits=_ELEVEN_LIMITS)
+        self.tts_slots = asyncio.Semaphore(_TTS_CONCURRENCY)
+
+
+_PER_LOOP: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _LoopState]" = weakref.WeakKeyDictionary()
+
+
+def _loop_state() -> _LoopState:
+    loop = asyncio.get_running_loop()
+    state = _PER_LOOP.get(loop)
+    if state is None:
+        state = _PER_LOOP[loop] = _LoopState()
+    return state
+
+
+def _spawn(coro) -> asyncio.Task:
+    task = asyncio.ensure_future(coro)
+    _BACKGROUND.add(task)
+    task.add_done_callback(_BACKGROUND.discard)
+    return task
+
+
+# --- PROFILE / STYLE ----------------------------------------------------------
+
+@timed()
+async def get_details(person_name: str, question: str = ""):
+    profile = await asyncio.to_thread(cached_profile, person_name)
+    if profile is None:
+        profile = await flight.do_async(f"details:{flight_name(person_name)}", partial(_fetch_details, person_name))
+    return profile.project(question) if isinstance(profile, Profile) else profile
+
+
+@timed()
+async def get_voice_style(person_name: str, question: str = ""):
+    text = await _cached_text(style_store, "style", person_name, style_prompt, STYLE_SYSTEM, STYLE_CONFIG)
+    styles = StyleSet.parse(text)
+    return styles.project(question) if styles is not None else text
+
+
+@timed()
+async def get_voice_accent(person_name: str):
+    return await _cached_text(accent_store, "accent", person_name, accent_prompt, config=ACCENT_CONFIG)
+
+
+async def _fetch_details(person_name: str) -> "Profile | str":
+    cached = await asyncio.to_thread(cached_profile, person_name)
+    if cached is not None:
+        return cached
+    text = await _generate_text(details_prompt(person_name), DETAILS_SYSTEM, DETAILS_CONFIG)
+    return await asyncio.to_thread(store_profile, person_name, text)
+
+
+async def _cached_text(store, kind: str, person_name: str, prompt_fn, system: str | None = None,
+                       config: dict | None = None) -> str:
+    cached = await asyncio.to_thread(store.get, person_name)
+    if cached is not None:
+        return cached
+    return await flight.do_async(f"{kind}:{flight_name(person_name)}",
+                                 partial(_fetch_text, store, person_name, prompt_fn, system, config))
+
+
+async def _fetch_text(store, person_name: str, prompt_fn, system: str | None = None,
+                      config: dict | None = None) -> str:
+    cached = await asyncio.to_thread(store.get, person_name)
+    if cached is not None:
+        return cached
+    final_response = await _generate_text(prompt_fn(person_name), system, config)
+    if final_response:
+        await asyncio.to_thread(store_text, store, person_name, final_response)
+    return final_response
+
+
+async def _generate_text(prompt: str, system: str | None = None, config: dict | None = None) -> str:
+    async with limited_async("gemini"):
+        response = await genai_client().aio.models.generate_content(
+            model="gemini-2.5-flash", contents=prompt,
+            config=types.GenerateContentConfig(system_instruction=system, **(config or {})))
+    return response.text.strip()
+
+
+@timed()
+async def get_persona(person_name: str, question: str = "", tool_context: ToolContext = None) -> dict:
+    active = active_persona(tool_context, person_name)
+    if active is not None:
+        if question:
+            active["profile"] = await get_details(person_name, question)  # cached: no model call
+            active["voice_style"] = await get_voice_style(person_name, question)
+        return active
+
+    parts = {
+        "profile": _spawn(get_details(person_name, question)),
+        "voice_style": _spawn(get_voice_style(person_name, question)),
+        "voice_accent": _spawn(get_voice_accent(person_name)),
+    }
+    await asyncio.wait(parts.values(), timeout=PERSONA_DEADLINE)
+    bundle = collect_bundle(person_name, parts)
+    remember_persona(tool_context, person_name, bundle)
+    return bundle
+
+
+get_persona.__doc__ = tools.get_persona.__doc__   # the contract the model reads; written once, in tools.py
+
+
+# --- ELEVENLABS (httpx) -------------------------------------------------------
+
+async def _eleven_request(text: str, voice_id: str, model_id: str, previous_text: str = "",
+                          next_text: str = "", stream: bool = False) -> httpx.Response:
+    url_endpoint, headers, payload = eleven_call(text, voice_id, model_id, previous_text, next_text, stream)
+    http = _loop_state().http
+    bucket = LIMITS["elevenlabs"]
+    for attempt in range(ELEVEN_RETRIES + 1):
+        with span("upstream_wait", provider="elevenlabs"):
+            await bucket.acquire_async()
+        try:
+            with span("upstream", provider="elevenlabs") as s:
+                r = await http.send(http.build_request("POST", url_endpoint, headers=headers, json=payload),
+                                    stream=stream)
+                s["outcome"] = str(r.status_code)
+        except (httpx.ConnectError, httpx.TimeoutException):
+            if attempt == ELEVEN_RETRIES:
+                raise
+            inc("upstream_retries_total", provider="elevenlabs")
+            await asyncio.sleep(retry_delay(None, attempt))
+            continue
+        if r.status_code == 429:
+            bucket.backoff(retry_after(r))
+        if r.status_code in ELEVEN_RETRY_STATUS and attempt < ELEVEN_RETRIES:
+            inc("upstream_retries_total", provider="elevenlabs")
+            delay = retry_delay(r, attempt)
+            await r.aclose()
+            await asyncio.sleep(delay)
+            continue
+        break
+    if r.status_code != 200:
+        body = (await r.aread())[:200].decode("utf-8", "replace")
+        await r.aclose()
+        raise RuntimeError(f"ElevenLabs error {r.status_code}: {body}")
+    return r
+
+
+async def _eleven_clip(text: str, voice_id: str, model_id: str = "eleven_multilingual_v2",
+                       previous_text: str = "", next_text: str = ""):
+    if not voice_id:
+        raise RuntimeError("Missing ELEVENLABS_API_KEY or voice_id")
+    fpath = AUDIO_DIR / f"{cache_key(voice_id, text)}.mp3"
+    if await asyncio.to_thread(clip_cache.lookup, fpath):
+        return fpath, True
+    await _fill(fpath, partial(_eleven_bytes, text, voice_id, model_id, previous_text, next_text), "elevenlabs")
+    return fpath, False
+
+
+async def _eleven_bytes(text, voice_id, model_id, previous_text, next_text) -> bytes:
+    async with _loop_state().tts_slots:
+        return (await _eleven_request(text, voice_id, model_id, previous_text, next_text)).content
+
+
+async def _eleven_sentence(voice_id: str, model_id: str, sentences: list[str], i: int):
+    return await _eleven_clip(sentences[i], voice_id, model_id,
+                              previous_text=sentences[i - 1] if i else "",
+                              next_text=sentences[i + 1] if i + 1 < len(sentences) else "")
+
+
+# --- GEMINI TTS (genai aio) ---------------------------------------------------
+
+async def _gemini_pcm(text: str, voice: str) -> bytes:
+    async with limited_async("gemini-tts"):
+        resp = await genai_client("GEMINI_API_KEY", "GOOGLE_API_KEY").aio.models.generate_content(
+            model=GEMINI_TTS_MODEL,
+            contents=text,  # IMPORTANT: only the reply text you want spoken
+            config=gemini_tts_config(voice),
+        )
+    return resp.candidates[0].content.parts[0].inline_data.data
+
+
+async def _gemini_pcm_stream(text: str, voice: str):
+    async with limited_async("gemini-tts"):
+        stream = await genai_client("GEMINI_API_KEY", "GOOGLE_API_KEY").aio.models.generate_content_stream(
+            model=GEMINI_TTS_MODEL,
+            contents=text,
+            config=gemini_tts_config(voice),
+        )
+        async for chunk in stream:
+            for part in (chunk.candidates[0].content.parts if chunk.candidates and chunk.candidates[0].content else []):
+                if part.inline_data and part.inline_data.data:
+                    yield part.inline_data.data
+
+
+async def _gemini_clip(text: str, voice: str):
+    fpath = AUDIO_DIR / f"{gemini_key(voice, text)}.wav"
+    if await asyncio.to_thread(clip_cache.lookup, fpath):
+        return fpath, True
+    await _fill(fpath, partial(_gemini_wav, text, voice), "gemini")
+    return fpath, False
+
+
+async def _gemini_wav(text: str, voice: str) -> bytes:
+    async with _loop_state().tts_slots:
+        return wav_bytes(await _gemini_pcm(text, voice))
+
+
+async def _fill(fpath, make, engine: str, publish: bool = False) -> None:
+    # same-clip requests from concurrent sessions share one synthesis
+    async def run():
+        if not fpath.exists():
+            await asyncio.to_thread(publish_clip if publish else write_atomic, fpath, await make(), engine)
+    await flight.do_async(fpath.name, run)
+
+
+async def _result(fname: str, voice: str, engine: str) -> dict:
+    # audio_result may start the audio host (or, multi-worker, re-try the bind): keep that off the loop too
+    return await asyncio.to_thread(audio_result, fname, voice, engine)
+
+
+async def _gemini_sentence(voice: str, sentences: list[str], i: int):
+    return await _gemini_clip(sentences[i], voice)
+
+
+# --- PIPELINES ----------------------------------------------------------------
+
+async def _speak_sentences(text: str, voice: str, ext: str, clip_fn, engine: str, key: str) -> dict:
+    fname = f"{key}.{ext}"
+    out = AUDIO_DIR / fname
+    if await asyncio.to_thread(clip_cache.lookup, out):
+        return await _result(fname, voice, f"{engine}(cache)")
+
+    sentences = split_sentences(text) or [text]
+    clips = await asyncio.gather(*(clip_fn(sentences, i) for i in range(len(sentences))))
+    await asyncio.to_thread(stitch, [p for p, _ in clips], out, engine)
+
+    res = await _result(fname, voice, engine)
+    res["sentences"] = len(clips)
+    res["sentence_cache_hits"] = sum(1 for _, hit in clips if hit)
+    return res
+
+
+async def speak_elevenlabs_sentences(text: str, voice_id: str, model_id: str = "eleven_multilingual_v2") -> dict:
+    return await _speak_sentences(text, voice_id, "mp3", partial(_eleven_sentence, voice_id, model_id),
+                                  "elevenlabs", cache_key(voice_id, text))
+
+
+async def speak_sentences(text: str, voice: str = "Kore") -> dict:
+    return await _speak_sentences(text, voice, audio_codec.EXT, partial(_gemini_sentence, voice), "gemini",
+                                  gemini_key(voice, text))
+
+
+async def _once(data: bytes):
+    yield data
+
+
+async def _opened(chunks, engine: str):
+    """Start a lazy chunk stream now (request errors raise in the caller); the first chunk is yielded again."""
+    first = await anext(chunks, None)
+    if first is None:
+        raise RuntimeError(f"{engine}: stream ended before any audio")
+    return _prepend(first, chunks)
+
+
+async def _prepend(first: bytes, chunks):
+    yield first
+    async for chunk in chunks:
+        yield chunk
+
+
+async def _response_body(r: httpx.Response):
+    try:
+        async for chunk in r.aiter_bytes(4096):
+            yield chunk
+    finally:
+        await r.aclose()
+
+
+async def _produce_stream(live, sentences, head_path, head_chunks, head_file, clip_fn, body_of,
+                          transform=None, engine=""):
+    rest = [asyncio.ensure_future(clip_fn(sentences, i)) for i in range(1, len(sentences))]
+    try:
+        head = bytearray()
+        async for chunk in head_chunks:
+            head += chunk
+            await asyncio.to_thread(live.write, chunk)   # may encode, and spools to disk in multi-worker mode
+        await asyncio.to_thread(save_head, head_path, bytes(head), head_file, engine)
+        for fut in rest:
+            await asyncio.to_thread(append_clip, live, body_of, (await fut)[0])
+        await asyncio.to_thread(finish_stream, live, transform, engine)
+    except Exception as e:
+        for fut in rest:
+            fut.cancel()
+        live.fail(e)
+
+
+async def speak_elevenlabs_stream(text: str, voice_id: str, model_id: str = "eleven_multilingual_v2") -> dict:
+    fname = f"{cache_key(voice_id, text)}.mp3"
+    res, live = await asyncio.to_thread(stream_target, fname, "audio/mpeg", voice_id, "elevenlabs")
+    if res is not None:
+        return res
+
+    sentences = split_sentences(text) or [text]
+    head_path = AUDIO_DIR / f"{cache_key(voice_id, sentences[0])}.mp3"
+    try:
+        head = await asyncio.to_thread(cached_head, head_path, Path.read_bytes)
+        if head is not None:
+            head = _once(head)
+        else:
+            # opened here, not in the producer, so HTTP errors still reach the router's fallback
+            head = _response_body(await _eleven_request(sentences[0], voice_id, model_id,
+                                                        next_text=sentences[1] if len(sentences) > 1 else "",
+                                                        stream=True))
+    except Exception as e:
+        live.fail(e)
+        raise
+    _spawn(_produce_stream(live, sentences, head_path, head, bytes, partial(_eleven_sentence, voice_id, model_id),
+                           lambda p: strip_id3(p.read_bytes()), engine="elevenlabs"))
+    return await _result(fname, voice_id, "elevenlabs(stream)")
+
+
+async def speak_stream(text: str, voice: str = "Kore") -> dict:
+    fname = f"{gemini_key(voice, text)}.{audio_codec.EXT}"
+    res, live = await asyncio.to_thread(stream_target, fname, audio_codec.CONTENT_TYPE, voice, "gemini")
+    if res is not None:
+        return res
+
+    sentences = split_sentences(text) or [text]
+    head_path = AUDIO_DIR / f"{gemini_key(voice, sentences[0])}.wav"
+    try:
+        head = await asyncio.to_thread(cached_head, head_path, wav_frames)
+        if head is not None:
+            head = _once(head)
+        else:
+            head = await _opened(_gemini_pcm_stream(sentences[0], voice), "gemini")
+    except Exception as e:
+        live.fail(e)
+        raise
+    _spawn(_produce_stream(await asyncio.to_thread(audio_codec.stream_to, live), sentences, head_path, head,
+                           wav_bytes, partial(_gemini_sentence, voice), wav_frames, audio_codec.finish_transform(),
+                           engine="gemini"))
+    return await _result(fname, voice, "gemini(stream)")
+
+
+# --- LOCAL TTS (subprocess, no thread) ------------------------------------------
+
+@timed()
+async def speak_local(text: str, nationality: str = "", gender: str = "") -> dict:
+    voice = local_voice(nationality, gender)
+    fname = f"{local_key(voice, text)}.{audio_codec.EXT}"
+    fpath = AUDIO_DIR / fname
+    if await asyncio.to_thread(clip_cache.lookup, fpath):
+        return await _result(fname, f"{local_tts.name}:{voice}", "local(cache)")
+    await _fill(fpath, partial(_local_clip, text, voice), "local", publish=True)
+    return await _result(fname, f"{local_tts.name}:{voice}", "local")
+
+
+async def _local_clip(text: str, voice: str) -> bytes:
+    pcm, rate = await local_tts.synthesize_async(text, voice)
+    return await asyncio.to_thread(audio_codec.encode, [pcm], rate)
+
+
+async def _route_or_draft(candidates: list, local) -> tuple[str, dict, list[str]]:
+    routed = _spawn(TTS_ROUTER.run_async(candidates))
+    done, _ = await asyncio.wait({routed}, timeout=LOCAL_TTS_DRAFT_AFTER)
+    if done:
+        return routed.result()
+    try:
+        res = await local()
+    except Exception:
+        return await routed
+    # the routed clip finishes into the cache; nobody awaits it now
+    routed.add_done_callback(lambda t: t.cancelled() or t.exception())
+    inc("tts_drafts_total")
+    return "local-draft", res, [f"no clip after {LOCAL_TTS_DRAFT_AFTER:g}s; the full voice is still rendering"]
+
+
+@timed()
+async def speak_elevenlabs_auto(text: str, nationality: str, gender: str, tool_context: ToolContext = None) -> dict:
+    candidates, notes = auto_candidates(
+        text, nationality, gender, tool_context,
+        speak_elevenlabs_stream if TTS_STREAMING else speak_elevenlabs_sentences,
+        speak_stream if TTS_STREAMING else speak_sentences, speak_local)
+    eleven, _, local = (fn for _, fn in candidates)
+    try:
+        if local and LOCAL_TTS_DRAFT_AFTER > 0:
+            engine, res, route_notes = await _route_or_draft(candidates, local)
+        else:
+            engine, res, route_notes = await TTS_ROUTER.run_async(candidates)
+    except NoEngineAvailable as e:
+        return no_engine(notes, e)
+    notes += route_notes
+    return await asyncio.to_thread(pin_clip, tool_context, label_fallback(engine, eleven, res, notes))
+
+
+speak_elevenlabs_auto.__doc__ = tools.speak_elevenlabs_auto.__doc__
@@ -0,0 +1,270 @@
+import os, sqlite3, threading, time
+from pathlib import Path
+
+from . import audio_stream
+from .metrics import inc, span
+
+
+# --- CLIP CACHE MANAGER (size/age bounded, LRU, session-pinned) --------------
+# Keeps a small in-memory index of every clip in the audio dir (size, last
+# access, engine), counts hits/misses, and evicts least-recently-used clips on
+# a background thread once the directory is over budget or a clip has aged out.
+# Clips handed to a session are pinned while that session is active, so a
+# user never gets a dead audio URL from the conversation they're in.
+
+AUDIO_CACHE_MAX_BYTES = int(os.getenv("AUDIO_CACHE_MAX_MB", "512")) * 1024 * 1024
+AUDIO_CACHE_MAX_AGE = float(os.getenv("AUDIO_CACHE_MAX_AGE_H", "72")) * 3600
+SESSION_PIN_TTL = 2 * 3600     # a session with no new clip for this long is considered closed
+SWEEP_INTERVAL = 60.0
+_LOW_WATERMARK = 0.9           # evict down to 90% of the budget so we don't sweep on every write
+_STALE_TMP_AGE = 3600          # leftovers from interrupted atomic writes
+_MIN_RESIDENCY = 60            # just-used clips may still be mid-stitch/mid-serve
+
+
+class ClipCache:
+    def __init__(self, root: Path, max_bytes: int = AUDIO_CACHE_MAX_BYTES, max_age: float = AUDIO_CACHE_MAX_AGE):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._index: dict[str, dict] = {}                 # name -> {"size", "atime", "engine"}
+        self._total = 0
+        self._pins: dict[str, tuple[float, set]] = {}     # session_id -> (last_seen, {names})
+        self._wake = threading.Event()
+        self._thread = None
+
+    # -- bookkeeping -------------------------------------------------------
+    def record(self, name: str, size: int, engine: str = "") -> None:
+        """A clip was written."""
+        with self._lock:
+            old = self._index.get(name)
+            self._total += size - (old["size"] if old else 0)
+            self._index[name] = {"size": size, "atime": time.time(), "engine": engine or (old or {}).get("engine", "")}
+            over = self._total > self.max_bytes
+        if over:
+            self._wake.set()
+
+    def lookup(self, fpath: Path) -> bool:
+        """exists() with hit/miss accounting and an LRU touch."""
+        with span("cache_lookup", cache="clip") as s:
+            hit = self._lookup(fpath)
+            s["outcome"] = "hit" if hit else "miss"
+        inc("cache_hits_total" if hit else "cache_misses_total", cache="clip")
+        return hit
+
+    def _lookup(self, fpath: Path) -> bool:
+        if fpath.exists():
+            with self._lock:
+                self.hits += 1
+                entry = self._index.get(fpath.name)
+                if entry is not None:
+                    entry["atime"] = time.time()
+            if entry is None:
+                self._index_file(fpath)
+            return True
+        with self._lock:
+            self.misses += 1
+        return False
+
+    def touch(self, *names: str) -> None:
+        now = time.time()
+        with self._lock:
+            for name in names:
+                entry = self._index.get(name)
+                if entry is not None:
+                    entry["atime"] = now
+
+    def pin(self, session_id: str, name: str) -> None:
+        if not session_id or not name:
+            return
+        with self._lock:
+            _, names = self._pins.get(session_id, (0.0, set()))
+            names.add(name)
+            self._pins[session_id] = (time.time(), names)
+
+    def release_session(self, session_id: str) -> None:
+        with self._lock:
+            self._pins.pop(session_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"clips": len(self._index), "bytes": self._total, "hits": self.hits,
+                    "misses": self.misses, "evictions": self.evictions, "sessions": len(self._pins)}
+
+    # -- eviction ----------------------------------------------------------
+    def start(self) -> None:
+        """Index what is already on disk and start the background sweeper."""
+        if self._thread is None:
+            self._scan()
+            self._thread = threading.Thread(target=self._run, name="audio-cache-sweeper", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(SWEEP_INTERVAL)
+            self._wake.clear()
+            try:
+                self.sweep()
+            except Exception:
+                pass  # never let the sweeper die; try again next interval
+
+    def sweep(self) -> int:
+        """Evict aged-out clips, then LRU clips until under the low watermark. Returns clips removed."""
+        now = time.time()
+        victims = self._select_victims(now)
+        for name in victims:
+            audio_stream.forget(name)
+            try:
+                (self.root / name).unlink()
+            except OSError:
+                pass
+        self._remove_stale_tmp(now)
+        return len(victims)
+
+    def _select_victims(self, now: float) -> list[str]:
+        """Pick and unindex the clips to delete."""
+        with self._lock:
+            for sid in [s for s, (seen, _) in self._pins.items() if now - seen > SESSION_PIN_TTL]:
+                del self._pins[sid]
+            pinned = set().union(*(names for _, names in self._pins.values())) if self._pins else set()
+            victims, total = [], self._total
+            for name, entry in sorted(self._index.items(), key=lambda kv: kv[1]["atime"]):
+                if name in pinned or now - entry["atime"] < _MIN_RESIDENCY:
+                    continue
+                if now - entry["atime"] > self.max_age or total > self.max_bytes * _LOW_WATERMARK:
+                    victims.append(name)
+                    total -= entry["size"]
+            for name in victims:
+                self._total -= self._index.pop(name)["size"]
+                self.evictions += 1
+        return victims
+
+    # -- index -------------------------------------------------------------
+    def _scan(self) -> None:
+        try:
+            entries = list(os.scandir(self.root))
+        except OSError:
+            return
+        with self._lock:
+            for e in entries:
+                if e.is_file() and not e.name.startswith(".") and e.name not in self._index:
+                    st = e.stat()
+                    self._index[e.name] = {"size": st.st_size, "atime": max(st.st_atime, st.st_mtime), "engine": ""}
+                    self._total += st.st_size
+
+    def _index_file(self, fpath: Path) -> None:
+        try:
+            size = fpath.stat().st_size
+        except OSError:
+            return
+        self.record(fpath.name, size)
+
+    def _remove_stale_tmp(self, now: float) -> None:
+        for p in [*self.root.glob(".*.tmp"), *self.root.glob(".*.live")]:
+            try:
+                if now - p.stat().st_mtime > _STALE_TMP_AGE:
+                    p.unlink()
+            except OSError:
+                pass
+
+
+class SharedClipCache(ClipCache):
+    """
+    ClipCache for multi-worker mode: the index and session pins live in the
+    shared SQLite db, so one worker's sweep sees every worker's clips and
+    never deletes a clip pinned by a session another worker is serving. Only
+    the audio host calls start(); the others just record, touch and pin.
+    Hit/miss counters stay per process.
+    """
+
+    def __init__(self, root: Path, db, max_bytes: int = AUDIO_CACHE_MAX_BYTES, max_age: float = AUDIO_CACHE_MAX_AGE):
+        super().__init__(root, max_bytes, max_age)
+        self.db = db
+
+    def record(self, name: str, size: int, engine: str = "") -> None:
+        # no early wake-up: the sweeper may be in another process, and runs every SWEEP_INTERVAL anyway
+        self._write("INSERT INTO clips VALUES (?, ?, ?, ?) ON CONFLICT (name) DO UPDATE SET size = excluded.size,"
+                    " atime = excluded.atime, engine = CASE WHEN excluded.engine = '' THEN engine"
+                    " ELSE excluded.engine END", (name, size, time.time(), engine))
+
+    def _lookup(self, fpath: Path) -> bool:
+        if not fpath.exists():
+            with self._lock:
+                self.misses += 1
+            return False
+        with self._lock:
+            self.hits += 1
+        try:
+            size = fpath.stat().st_size
+        except OSError:
+            size = 0
+        self._write("INSERT INTO clips VALUES (?, ?, ?, '') ON CONFLICT (name) DO UPDATE SET atime = excluded.atime",
+                    (fpath.name, size, time.time()))
+        return True
+
+    def touch(self, *names: str) -> None:
+        now = time.time()
+        if names:
+            self._write(*(s for name in names for s in ("UPDATE clips SET atime = ? WHERE name = ?", (now, name))))
+
+    def pin(self, session_id: str, name: str) -> None:
+        if session_id and name:
+            now = time.time()
+            self._write("INSERT OR REPLACE INTO pins VALUES (?, ?, ?)", (session_id, name, now),
+                        "UPDATE pins SET seen = ? WHERE session = ?", (now, session_id))
+
+    def release_session(self, session_id: str) -> None:
+        self._write("DELETE FROM pins WHERE session = ?", (session_id,))
+
+    def stats(self) -> dict:
+        try:
+            (clips, total), = self.db.query("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM clips")
+            (sessions,), = self.db.query("SELECT COUNT(DISTINCT session) FROM pins")
+        except sqlite3.Error:
+            clips = total = sessions = 0
+        with self._lock:
+            return {"clips": clips, "bytes": total, "hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions, "sessions": sessions}
+
+    def _select_victims(self, now: float) -> list[str]:
+        try:
+            with self.db.tx() as c:
+                c.execute("DELETE FROM pins WHERE seen < ?", (now - SESSION_PIN_TTL,))
+                total = c.execute("SELECT COALESCE(SUM(size), 0) FROM clips").fetchone()[0]
+                victims = []
+                for name, size, atime in c.execute(
+                        "SELECT name, size, atime FROM clips WHERE atime < ? AND name NOT IN (SELECT name FROM pins)"
+                        " ORDER BY atime", (now - _MIN_RESIDENCY,)).fetchall():
+                    if now - atime > self.max_age or total > self.max_bytes * _LOW_WATERMARK:
+                        victims.append(name)
+                        total -= size
+                c.executemany("DELETE FROM clips WHERE name = ?", [(n,) for n in victims])
+        except sqlite3.Error:
+            return []
+        with self._lock:
+            self.evictions += len(victims)
+        return victims
+
+    def _scan(self) -> None:
+        try:
+            files = [(e.name, e.stat()) for e in os.scandir(self.root) if e.is_file() and not e.name.startswith(".")]
+        except OSError:
+            return
+        try:
+            with self.db.tx() as c:
+                c.executemany("INSERT OR IGNORE INTO clips VALUES (?, ?, ?, '')",
+                              [(n, st.st_size, max(st.st_atime, st.st_mtime)) for n, st in files])
+        except sqlite3.Error:
+            pass
+
+    def _write(self, *statements) -> None:
+        """Run (sql, args) pairs in one transaction; a busy or broken db costs accuracy, never a request."""
+        try:
+            with self.db.tx() as c:
+                for sql, args in zip(statements[::2], statements[1::2]):
+                    c.execute(sql, args)
+        except sqlite3.Error:
+            pass
@@ -0,0 +1,164 @@
+import io, os, warnings
+
+from . import audio_stream
+
+
+# --- GEMINI AUDIO FORMAT (WAV, or MP3 / Opus from an in-process encoder) -----
+# Gemini TTS returns 24 kHz 16-bit mono PCM: ~48 KB per second of speech as
+# WAV, roughly ten times ElevenLabs' MP3. GEMINI_AUDIO_FORMAT=mp3 (lameenc) or
+# opus (PyAV, Ogg/Opus) encodes the clips we hand out incrementally, chunk by
+# chunk as PCM arrives, so a streamed reply is compressed on the wire too and
+# the finished file is just the encoder output. Sentence clips stay PCM WAV:
+# they are stitched into replies, and Ogg streams can't be concatenated. If
+# the encoder package is missing, WAV is used with a warning.
+
+GEMINI_AUDIO_FORMAT = os.getenv("GEMINI_AUDIO_FORMAT", "wav").strip().lower()
+MP3_KBPS = int(os.getenv("GEMINI_MP3_KBPS", "48"))     # mono speech; 48 kbit/s is ~1/8 of the PCM
+OPUS_KBPS = int(os.getenv("GEMINI_OPUS_KBPS", "24"))
+PCM_RATE = 24000
+
+_OPUS_RATES = (8000, 12000, 16000, 24000, 48000)   # anything else is resampled to 48 kHz first
+_FORMATS = {"wav": ("wav", "audio/wav"), "mp3": ("mp3", "audio/mpeg"), "opus": ("opus", "audio/ogg")}
+
+
+class _Encoder:
+    """feed() PCM as it arrives (any chunking), get encoded bytes back; close() returns the tail."""
+
+    _odd = b""   # a chunk can end mid-sample
+
+    def feed(self, pcm: bytes) -> bytes:
+        pcm, self._odd = self._odd + pcm, b""
+        if len(pcm) % 2:
+            pcm, self._odd = pcm[:-1], pcm[-1:]
+        return self._encode(pcm) if pcm else b""
+
+
+class Mp3Encoder(_Encoder):
+    def __init__(self, rate: int = PCM_RATE, kbps: int = MP3_KBPS):
+        import lameenc
+        self._enc = lameenc.Encoder()
+        self._enc.set_in_sample_rate(rate)
+        self._enc.set_channels(1)
+        self._enc.set_bit_rate(kbps)
+        self._enc.set_quality(5)   # 2 = best, 7 = fastest; 5 keeps encoding far below real time
+        self._started = False      # lameenc refuses to flush before the first encode
+
+    def _encode(self, pcm: bytes) -> bytes:
+        self._started = True
+        return bytes(self._enc.encode(pcm))
+
+    def close(self) -> bytes:
+        return bytes(self._enc.flush()) if self._started else b""
+
+
+class OpusEncoder(_Encoder):
+    def __init__(self, rate: int = PCM_RATE, kbps: int = OPUS_KBPS):
+        import av
+        self._av = av
+        self._rate = rate
+        self._sink = _Sink()
+        # short Ogg pages + a small IO buffer so encoded audio comes out while the reply is still streaming
+        self._out = av.open(self._sink, mode="w", format="ogg", options={"page_duration": "100000"},
+                            buffer_size=4096)
+        self._resampler = None if rate in _OPUS_RATES else av.AudioResampler(format="s16", layout="mono", rate=48000)
+        self._stream = self._out.add_stream("libopus", rate=48000 if self._resampler else rate, layout="mono")
+        self._stream.bit_rate = kbps * 1000
+
+    def _encode(self, pcm: bytes) -> bytes:
+        frame = self._av.AudioFrame(format="s16", layout="mono", samples=len(pcm) // 2)
+        frame.planes[0].update(pcm)
+        frame.sample_rate = self._rate
+        for f in self._resampler.resample(frame) if self._resampler else (frame,):
+            self._mux(f)
+        return self._sink.drain()
+
+    def close(self) -> bytes:
+        for f in self._resampler.resample(None) if self._resampler else ():
+            self._mux(f)
+        self._mux(None)
+        self._out.close()
+        return self._sink.drain()
+
+    def _mux(self, frame) -> None:
+        for packet in self._stream.encode(frame):
+            self._out.mux(packet)
+
+
+class _Sink(io.RawIOBase):
+    """Write-only file the muxer writes into; drain() hands back what arrived since the last call."""
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self) -> bytes:
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+
+_ENCODERS = {"mp3": Mp3Encoder, "opus": OpusEncoder}
+
+
+def _resolve(fmt: str) -> str:
+    if fmt not in _FORMATS:
+        warnings.warn(f"GEMINI_AUDIO_FORMAT={fmt!r} is not one of {sorted(_FORMATS)}; using wav")
+        return "wav"
+    if fmt != "wav":
+        try:
+            enc = _ENCODERS[fmt]()
+            enc.feed(bytes(960))   # 20 ms of silence through the whole chain
+            enc.close()
+        except Exception as e:   # ImportError, or a PyAV build without libopus
+            warnings.warn(f"GEMINI_AUDIO_FORMAT={fmt} needs {'lameenc' if fmt == 'mp3' else 'av'} ({e}); using wav")
+            return "wav"
+    return fmt
+
+
+FORMAT = _resolve(GEMINI_AUDIO_FORMAT)
+EXT, CONTENT_TYPE = _FORMATS[FORMAT]
+
+
+def encode(pcm_chunks, rate: int = PCM_RATE) -> bytes:
+    """One finished clip in FORMAT from an iterable of 16-bit mono PCM chunks (consumed one at a time)."""
+    if FORMAT == "wav":
+        pcm = b"".join(pcm_chunks)
+        return audio_stream.wav_header(len(pcm), rate) + pcm
+    enc = _ENCODERS[FORMAT](rate)
+    return b"".join(enc.feed(chunk) for chunk in pcm_chunks) + enc.close()
+
+
+def stream_to(live):
+    """Writer with the LiveClip interface that takes PCM and streams FORMAT into `live`; opens a WAV stream as is."""
+    if FORMAT == "wav":
+        live.write(audio_stream.wav_header(None))
+        return live
+    return _EncodingClip(live, _ENCODERS[FORMAT]())
+
+
+def finish_transform():
+    """The LiveClip.finish transform for a stream opened with stream_to()."""
+    # WAV: swap the open-ended streaming header for the real one; encoded formats are final as written
+    return (lambda data: audio_stream.wav_header(len(data) - 44) + data[44:]) if FORMAT == "wav" else None
+
+
+class _EncodingClip:
+    def __init__(self, live, encoder):
+        self._live = live
+        self._enc = encoder
+        self.fpath = live.fpath
+
+    def write(self, pcm: bytes) -> None:
+        self._live.write(self._enc.feed(pcm))
+
+    def finish(self, transform=None) -> int:
+        self._live.write(self._enc.close())
+        return self._live.finish(transform)
+
+    def fail(self, exc: BaseException) -> None:
+        self._live.fail(exc)
@@ -0,0 +1,303 @@
+import asyncio, contextlib, mimetypes, os, re, threading
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from urllib.parse import unquote
+
+from . import audio_stream
+from .metrics import REGISTRY
+
+
+# --- AUDIO HOST (asyncio, Range + conditional GET + sendfile) ----------------
+# One event loop on a daemon thread serves every connection. Clips are
+# content-addressed and written atomically, so they never change once they
+# exist: they get long immutable cache headers and strong ETags. Lookup order
+# per request: live clip (chunked stream; this worker's or another's spool)
+# -> hot set (memory) -> disk (sendfile). GET /metrics is the Prometheus scrape.
+# Nothing on the loop touches the clip index (SQLite in multi-worker mode):
+# LRU touches are batched and written from a thread, and so is the metrics
+# render, whose collectors read it.
+
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+IDLE_TIMEOUT = 30.0          # seconds a keep-alive connection may sit idle
+MAX_HEADER_BYTES = 16 * 1024
+TOUCH_DELAY = 1.0            # seconds LRU touches are collected before one batched write
+
+_NAME_RE = re.compile(r"^[A-Za-z0-9_-][A-Za-z0-9_.-]*$")  # flat names only; dot-files (tmp) hidden
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+_REASONS = {200: "OK", 206: "Partial Content", 204: "No Content", 304: "Not Modified",
+            400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+            416: "Range Not Satisfiable", 500: "Internal Server Error"}
+
+mimetypes.add_type("audio/mpeg", ".mp3")
+mimetypes.add_type("audio/wav", ".wav")
+mimetypes.add_type("audio/ogg", ".opus")
+
+
+class AudioServer:
+    def __init__(self, root: Path, host: str = "127.0.0.1", port: int = 8765, cache=None):
+        self.root = Path(root)
+        self.host = host
+        self.port = port
+        self.cache = cache  # optional ClipCache: served clips count as accesses for LRU
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self._server = None
+        self._touched: set = set()   # clip names served since the last touch write
+        self._flush = None           # the pending/running touch write
+
+    # -- lifecycle ---------------------------------------------------------
+    def start(self, timeout: float = 5.0) -> None:
+        """Bind and serve on a daemon thread; returns once listening, raises if the bind failed."""
+        ready, errors = threading.Event(), []
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            try:
+                self._server = self.loop.run_until_complete(
+                    asyncio.start_server(self._handle, self.host, self.port, limit=MAX_HEADER_BYTES))
+            except Exception as e:
+                errors.append(e)
+                ready.set()
+                return
+            ready.set()
+            self.loop.run_forever()
+
+        threading.Thread(target=run, name=f"audio-server:{self.port}", daemon=True).start()
+        if not ready.wait(timeout):
+            raise TimeoutError("audio server did not start")
+        if errors:
+            raise errors[0]
+
+    def stop(self) -> None:
+        if self.loop and self._server:
+            self.loop.call_soon_threadsafe(self._server.close)
+            self.loop.call_soon_threadsafe(self.loop.stop)
+
+    # -- connection loop ---------------------------------------------------
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), IDLE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self._simple(writer, 400, close=True)
+                    break
+                method, path, version, headers = self._parse(head)
+                if method is None:
+                    await self._simple(writer, 400, close=True)
+                    break
+                keep_alive = (version == "HTTP/1.1" and headers.get("connection", "").lower() != "close") or \
+                             headers.get("connection", "").lower() == "keep-alive"
+                keep_alive = await self._respond(writer, method, path, headers, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            try:
+                writer.close()
+            except Exception:
+                pass
+
+    @staticmethod
+    def _parse(head: bytes):
+        try:
+            lines = head.decode("latin-1").split("\r\n")
+            method, path, version = lines[0].split(" ", 2)
+        except ValueError:
+            return None, None, None, None
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                k, v = line.split(":", 1)
+                headers[k.strip().lower()] = v.strip()
+        return method.upper(), path, version.strip(), headers
+
+    # -- responses ---------------------------------------------------------
+    async def _respond(self, writer, method, path, headers, keep_alive) -> bool:
+        if method == "OPTIONS":
+            await self._simple(writer, 204, {"Access-Control-Allow-Methods": "GET, HEAD, OPTIONS",
+                                             "Access-Control-Allow-Headers": "Range, If-None-Match, If-Modified-Since"},
+                               close=not keep_alive)
+            return keep_alive
+        if method not in ("GET", "HEAD"):
+            await self._simple(writer, 405, {"Allow": "GET, HEAD, OPTIONS"}, close=not keep_alive)
+            return keep_alive
+
+        name = unquote(path.split("?", 1)[0]).lstrip("/")
+        if name == "metrics":
+            return await self._send_metrics(writer, method, keep_alive)
+        if not _NAME_RE.match(name):
+            await self._simple(writer, 404, close=not keep_alive)
+            return keep_alive
+
+        live = audio_stream.get(name) or audio_stream.spooled(self.root / name)
+        if live is not None:
+            return await self._stream_live(writer, method, live, keep_alive)
+
+        fpath = self.root / name
+        try:
+            st = os.stat(fpath)
+        except OSError:
+            await self._simple(writer, 404, close=not keep_alive)
+            return keep_alive
+        return await self._send_file(writer, method, headers, name, fpath, st, keep_alive)
+
+    async def _send_file(self, writer, method, headers, name, fpath, st, keep_alive) -> bool:
+        size = st.st_size
+        etag = f'"{Path(name).stem}-{size:x}"'
+        common = {
+            "Content-Type": mimetypes.guess_type(name)[0] or "application/octet-stream",
+            "Accept-Ranges": "bytes",
+            "ETag": etag,
+            "Last-Modified": formatdate(st.st_mtime, usegmt=True),
+            "Cache-Control": CACHE_CONTROL,
+        }
+        if _not_modified(headers, etag, st.st_mtime):
+            await self._write_head(writer, 304, common, keep_alive)
+            return keep_alive
+
+        start, end, status = 0, size - 1, 200
+        rng = headers.get("range")
+        if rng and headers.get("if-range", etag) == etag:
+            parsed = _parse_range(rng, size)
+            if parsed is None:
+                await self._simple(writer, 416, {"Content-Range": f"bytes */{size}"}, close=not keep_alive)
+                return keep_alive
+            if parsed != ():
+                start, end, status = parsed[0], parsed[1], 206
+                common["Content-Range"] = f"bytes {start}-{end}/{size}"
+        if self.cache is not None:
+            self._touch(name)
+        count = end - start + 1 if size else 0
+        common["Content-Length"] = str(count)
+        await self._write_head(writer, status, common, keep_alive)
+        if method == "HEAD" or count == 0:
+            return keep_alive
+
+        data = audio_stream.recall(name)
+        if data is not None and len(data) == size:
+            writer.write(data[start:end + 1])
+            await writer.drain()
+            return keep_alive
+        with open(fpath, "rb") as f:
+            # zero-copy on Linux; asyncio falls back to read/write where sendfile is unavailable
+            await asyncio.get_running_loop().sendfile(writer.transport, f, start, count)
+        return keep_alive
+
+    async def _send_metrics(self, writer, method, keep_alive) -> bool:
+        body = (await asyncio.to_thread(REGISTRY.render)).encode("utf-8")
+        await self._write_head(writer, 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8",
+                                             "Content-Length": str(len(body)), "Cache-Control": "no-store"}, keep_alive)
+        if method == "GET":
+            writer.write(body)
+            await writer.drain()
+        return keep_alive
+
+    async def _stream_live(self, writer, method, live, keep_alive) -> bool:
+        await self._write_head(writer, 200, {"Content-Type": live.content_type, "Transfer-Encoding": "chunked",
+                                             "Cache-Control": "no-store"}, keep_alive)
+        if method == "HEAD":
+            return keep_alive   # headers only: a HEAD response has no body, not even the last chunk
+        # the reader waits on the loop (no executor thread per listener, however long the clip takes)
+        try:
+            async with contextlib.aclosing(live.aiter_chunks()) as chunks:
+                async for chunk in chunks:
+                    writer.write(b"%X\r\n%s\r\n" % (len(chunk), chunk))
+                    await writer.drain()
+        except Exception:
+            return False  # no terminating chunk: the client sees a truncated (failed) stream
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+        return keep_alive
+
+    def _touch(self, name: str) -> None:
+        self._touched.add(name)
+        if self._flush is None:
+            self._flush = asyncio.ensure_future(self._flush_touches())
+
+    async def _flush_touches(self) -> None:
+        try:
+            while self._touched:
+                await asyncio.sleep(TOUCH_DELAY)
+                names, self._touched = self._touched, set()
+                await asyncio.to_thread(self.cache.touch, *names)
+        finally:
+            self._flush = None
+
+    async def _write_head(self, writer, status, headers, keep_alive) -> None:
+        lines = [f"HTTP/1.1 {status} {_REASONS.get(status, '')}",
+                 f"Date: {formatdate(usegmt=True)}",
+                 "Access-Control-Allow-Origin: *",
+                 f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        lines += [f"{k}: {v}" for k, v in headers.items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        await writer.drain()
+
+    async def _simple(self, writer, status, headers=None, close=False) -> None:
+        body = b"" if status in (204, 304) else _REASONS.get(status, "").encode()
+        hdrs = dict(headers or {})
+        if status not in (204, 304):
+            hdrs.update({"Content-Type": "text/plain", "Content-Length": str(len(body))})
+        await self._write_head(writer, status, hdrs, not close)
+        if body:
+            writer.write(body)
+            await writer.drain()
+
+
+def _not_modified(headers: dict, etag: str, mtime: float) -> bool:
+    inm = headers.get("if-none-match")
+    if inm is not None:
+        return inm.strip() == "*" or etag in [t.strip().removeprefix("W/") for t in inm.split(",")]
+    ims = headers.get("if-modified-since")
+    if ims:
+        try:
+            return int(mtime) <= parsedate_to_datetime(ims).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _parse_range(value: str, size: int):
+    """(start, end) for one satisfiable byte range, () to ignore the header, None if unsatisfiable."""
+    m = _RANGE_RE.match(value.strip())
+    if not m:
+        return ()  # multi-range or other units: serve the full body
+    first, last = m.groups()
+    if first == "" and last == "":
+        return ()
+    if first == "":
+        n = int(last)
+        if n == 0 or size == 0:
+            return None
+        return max(size - n, 0), size - 1
+    start = int(first)
+    if start >= size:
+        return None
+    end = min(int(last), size - 1) if last else size - 1
+    return (start, end) if start <= end else None
+
+
+def main(argv=None) -> int:
+    """Standalone audio host for multi-worker deployments (run one per node; AUDIO_HOST_EXTERNAL=1 in the workers)."""
+    import argparse
+    from .tts_common import AUDIO_DIR, AUDIO_PORT, clip_cache   # same folder / port / shared clip index as the workers
+
+    ap = argparse.ArgumentParser(description="Serve the shared audio folder for every worker on this node.")
+    ap.add_argument("--host", default="127.0.0.1", help="bind address (default 127.0.0.1)")
+    args = ap.parse_args(argv)
+    server = AudioServer(AUDIO_DIR, args.host, AUDIO_PORT, cache=clip_cache)
+    server.start()   # raises if AUDIO_PORT is taken
+    clip_cache.start()
+    print(f"serving {AUDIO_DIR} on http://{args.host}:{AUDIO_PORT}/")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,298 @@
+import asyncio, os, struct, threading, time, uuid
+from collections import OrderedDict
+from pathlib import Path
+
+from .metrics import inc, span
+from .shared_db import MULTI_WORKER
+
+
+# --- LIVE CLIPS (audio still being synthesized) ------------------------------
+# A tool registers a LiveClip under the clip's file name and hands the URL out
+# straight away. The producer thread appends bytes as the vendor sends them;
+# the audio server streams them to every reader with chunked encoding. When
+# the producer finishes, the bytes are written to the cache file and the clip
+# is unregistered, so later requests are plain file hits.
+#
+# With several workers the one serving audio may not be the one synthesizing.
+# Then the producer also appends to a spool file next to the clip
+# (".<name>.live", created exclusively, so the first worker to start a clip
+# owns it) and the audio host tails that file until the finished clip has
+# replaced it.
+
+SPOOL = MULTI_WORKER
+_CONTENT_TYPES = {".mp3": "audio/mpeg", ".wav": "audio/wav", ".opus": "audio/ogg"}
+
+_LIVE: dict[str, "LiveClip"] = {}
+_LIVE_LOCK = threading.Lock()
+
+
+class LiveClip:
+    def __init__(self, fpath: Path, content_type: str, spool=None):
+        self.fpath = Path(fpath)
+        self.content_type = content_type
+        self._spool = spool            # unbuffered file other workers' audio host tails
+        self._buf = bytearray()
+        self._cond = threading.Condition()
+        self._waiters: set = set()     # (loop, asyncio.Event) per async reader
+        self.done = False
+        self.error: BaseException | None = None
+
+    def write(self, data: bytes) -> None:
+        if data:
+            with self._cond:
+                self._buf += data
+                if self._spool is not None:
+                    self._spool.write(data)
+                self._notify()
+
+    def finish(self, transform=None) -> int:
+        """Tee the streamed bytes to the cache file (optionally rewritten, e.g. a final WAV header); returns its size."""
+        with self._cond:
+            data = bytes(self._buf)
+        try:
+            data = transform(data) if transform else data
+            write_atomic(self.fpath, data)
+            remember(self.fpath.name, data)
+        finally:
+            self._close(None)
+        return len(data)
+
+    def fail(self, exc: BaseException) -> None:
+        self._close(exc)
+
+    def iter_chunks(self, idle_timeout: float = 60.0):
+        """Yield bytes from the start of the clip until the producer is done."""
+        pos = 0
+        while True:
+            with self._cond:
+                while pos >= len(self._buf) and not self.done:
+                    if not self._cond.wait(idle_timeout):
+                        raise TimeoutError(f"no audio for {idle_timeout}s on {self.fpath.name}")
+                chunk, done, error = bytes(self._buf[pos:]), self.done, self.error
+            if chunk:
+                pos += len(chunk)
+                yield chunk
+            elif error is not None:
+                raise RuntimeError(f"synthesis failed: {error}") from error
+            elif done:
+                return
+
+    async def aiter_chunks(self, idle_timeout: float = 60.0):
+        """iter_chunks() for an event loop: waits on an asyncio.Event the producer sets, holding no thread."""
+        loop = asyncio.get_running_loop()
+        waiter = (loop, asyncio.Event())
+        pos = 0
+        with self._cond:
+            self._waiters.add(waiter)
+        try:
+            while True:
+                with self._cond:
+                    chunk, done, error = bytes(self._buf[pos:]), self.done, self.error
+                    if not chunk and not done:
+                        waiter[1].clear()   # a write after this point sets it again
+                if chunk:
+                    pos += len(chunk)
+                    yield chunk
+                elif error is not None:
+                    raise RuntimeError(f"synthesis failed: {error}") from error
+                elif done:
+                    return
+                else:
+                    try:
+                        await asyncio.wait_for(waiter[1].wait(), idle_timeout)
+                    except asyncio.TimeoutError:
+                        raise TimeoutError(f"no audio for {idle_timeout}s on {self.fpath.name}") from None
+        finally:
+            with self._cond:
+                self._waiters.discard(waiter)
+
+    def _notify(self) -> None:
+        # lock held
+        self._cond.notify_all()
+        for loop, event in self._waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def _close(self, error) -> None:
+        with self._cond:
+            self.error = error
+            self.done = True
+            self._notify()
+            if self._spool is not None:
+                # after the final clip is in place: a tailing reader that sees the spool gone checks for it
+                self._spool.close()
+                _unlink(_spool_path(self.fpath))
+        with _LIVE_LOCK:
+            if _LIVE.get(self.fpath.name) is self:
+                del _LIVE[self.fpath.name]
+
+
+def open_clip(fpath: Path, content_type: str) -> tuple[LiveClip | None, bool]:
+    """
+    Return (clip, created). An identical clip already in flight is shared, not re-synthesized;
+    if another worker is producing it the clip is None (its spool is served instead).
+    """
+    with _LIVE_LOCK:
+        clip = _LIVE.get(Path(fpath).name)
+        if clip is not None:
+            return clip, False
+        spool = None
+        if SPOOL:
+            try:
+                spool = _claim_spool(Path(fpath))
+            except FileExistsError:
+                return None, False
+        clip = _LIVE[Path(fpath).name] = LiveClip(fpath, content_type, spool)
+        return clip, True
+
+
+def get(name: str) -> LiveClip | None:
+    with _LIVE_LOCK:
+        return _LIVE.get(name)
+
+
+def write_atomic(fpath: Path, data: bytes) -> None:
+    """Write via a hidden temp file + rename: no reader, in any process, sees a partial clip under its name."""
+    tmp = fpath.with_name(f".{fpath.name}.{uuid.uuid4().hex}.tmp")
+    with span("file_write"):
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())  # a crash can't leave a truncated file that every worker then trusts as a hit
+        os.replace(tmp, fpath)
+    inc("bytes_written_total", len(data))
+
+
+# --- SPOOLS (live clips produced by another worker) --------------------------
+
+SPOOL_IDLE_TIMEOUT = 60.0   # a spool that stopped growing this long ago belongs to a dead worker
+_SPOOL_POLL = 0.05
+
+
+class SpooledClip:
+    """Read side of another worker's LiveClip; same interface the audio server uses for local ones."""
+
+    def __init__(self, fpath: Path):
+        self.fpath = Path(fpath)
+        self.spool = _spool_path(self.fpath)
+        self.content_type = _CONTENT_TYPES.get(self.fpath.suffix, "application/octet-stream")
+
+    def iter_chunks(self, idle_timeout: float = SPOOL_IDLE_TIMEOUT):
+        for chunk in self._tail(idle_timeout):
+            if chunk is None:
+                time.sleep(_SPOOL_POLL)
+            else:
+                yield chunk
+
+    async def aiter_chunks(self, idle_timeout: float = SPOOL_IDLE_TIMEOUT):
+        for chunk in self._tail(idle_timeout):
+            if chunk is None:
+                await asyncio.sleep(_SPOOL_POLL)
+            else:
+                yield chunk
+
+    def _tail(self, idle_timeout: float):
+        """Chunks from the spool, or None whenever nothing new has arrived yet (the caller sleeps one poll)."""
+        with open(self.spool, "rb") as f:
+            idle = 0.0
+            while True:
+                chunk = f.read(64 * 1024)
+                if chunk:
+                    idle = 0.0
+                    yield chunk
+                    continue
+                if not self.spool.exists():
+                    rest = f.read()   # the open handle still sees bytes written before the unlink
+                    if rest:
+                        yield rest
+                    if not self.fpath.exists():
+                        raise RuntimeError(f"synthesis of {self.fpath.name} failed in another worker")
+                    return
+                if idle >= idle_timeout:
+                    raise TimeoutError(f"no audio for {idle_timeout}s on {self.fpath.name}")
+                yield None
+                idle += _SPOOL_POLL
+
+
+def spooled(fpath: Path) -> SpooledClip | None:
+    """The clip another worker is still producing at fpath, if any."""
+    return SpooledClip(fpath) if SPOOL and _spool_path(Path(fpath)).exists() else None
+
+
+def _spool_path(fpath: Path) -> Path:
+    return fpath.with_name(f".{fpath.name}.live")
+
+
+def _claim_spool(fpath: Path):
+    """Exclusively create the spool; FileExistsError if another worker is producing this clip, None if unspoolable."""
+    path = _spool_path(fpath)
+    for _ in range(2):
+        try:
+            return os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644), "wb", buffering=0)
+        except FileExistsError:
+            try:
+                age = time.time() - path.stat().st_mtime
+            except OSError:
+                continue          # it just finished; try again
+            if age < SPOOL_IDLE_TIMEOUT:
+                raise
+            _unlink(path)         # abandoned by a worker that died mid-clip
+        except OSError:
+            return None           # stream from this process only, as in single-worker mode
+    return None
+
+
+def _unlink(path: Path) -> None:
+    try:
+        path.unlink()
+    except OSError:
+        pass
+
+
+# --- HOT SET (recently generated clips kept in memory) ----------------------
+# Browsers fetch a fresh clip with several Range requests right after the tool
+# returns; serving those from memory avoids re-reading the file each time.
+
+HOT_MAX_BYTES = 64 * 1024 * 1024
+HOT_MAX_CLIP = 8 * 1024 * 1024
+_HOT: "OrderedDict[str, bytes]" = OrderedDict()
+_HOT_SIZE = 0
+_HOT_LOCK = threading.Lock()
+
+
+def remember(name: str, data: bytes) -> None:
+    global _HOT_SIZE
+    if len(data) > HOT_MAX_CLIP:
+        return
+    with _HOT_LOCK:
+        old = _HOT.pop(name, None)
+        _HOT_SIZE -= len(old) if old is not None else 0
+        _HOT[name] = data
+        _HOT_SIZE += len(data)
+        while _HOT_SIZE > HOT_MAX_BYTES:
+            _, evicted = _HOT.popitem(last=False)
+            _HOT_SIZE -= len(evicted)
+
+
+def recall(name: str) -> bytes | None:
+    with _HOT_LOCK:
+        data = _HOT.get(name)
+        if data is not None:
+            _HOT.move_to_end(name)
+        return data
+
+
+def forget(name: str) -> None:
+    global _HOT_SIZE
+    with _HOT_LOCK:
+        old = _HOT.pop(name, None)
+        _HOT_SIZE -= len(old) if old is not None else 0
+
+
+def wav_header(data_len: int | None, rate: int = 24000, channels: int = 1, width: int = 2) -> bytes:
+    """44-byte PCM WAV header. data_len=None gives the open-ended header used while streaming."""
+    n = 0x7FFFFFFF - 36 if data_len is None else data_len
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + n, b"WAVE", b"fmt ", 16, 1, channels, rate,
+        rate * channels * width, channels * width, width * 8, b"data", n,
+    )
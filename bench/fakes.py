@@ -0,0 +1,212 @@
+import base64, hashlib, json, math, random, re, threading, time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+
+# --- FAKE UPSTREAMS (Gemini REST + ElevenLabs TTS on one local port) ---------
+# Enough of both APIs for the tools to run unmodified: point the genai SDK at
+# it with GOOGLE_GEMINI_BASE_URL and ElevenLabs with ELEVENLABS_BASE_URL.
+# Latency is log-normal around the configured median; a share of requests can
+# be failed with 500 or rejected with 429 + Retry-After. Response sizes follow
+# the text length roughly like the real services (MP3 ~128 kbit/s, PCM 24 kHz).
+
+_NATIONALITIES = ["Polish-French", "Persian", "Egyptian (Ptolemaic)", "British", "Greek (Alexandrian)",
+                  "Italian (Florentine)", "American", "Chinese", "Indian", "Nigerian", "Mexican", "Japanese"]
+_PERSON_RE = re.compile(r'Target person: "([^"]+)"|person name: ([^.\n]+)')
+_MP3_BYTES_PER_CHAR = 1100
+_PCM_BYTES_PER_CHAR = 3200
+_STREAM_CHUNKS = 8
+
+
+class FakeConfig:
+    def __init__(self, text_ms=800.0, tts_ms=1200.0, jitter=0.35, error_rate=0.0, rate_limit_rate=0.0, seed=None):
+        self.text_ms = text_ms                # median Gemini text latency
+        self.tts_ms = tts_ms                  # median TTS latency (ElevenLabs and Gemini TTS)
+        self.jitter = jitter                  # log-normal sigma
+        self.error_rate = error_rate          # share of calls answered 500
+        self.rate_limit_rate = rate_limit_rate  # share answered 429
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def latency(self, median_ms: float) -> float:
+        with self.lock:
+            return median_ms / 1000.0 * math.exp(self.rng.gauss(0.0, self.jitter))
+
+    def fault(self) -> int:
+        with self.lock:
+            r = self.rng.random()
+        if r < self.error_rate:
+            return 500
+        if r < self.error_rate + self.rate_limit_rate:
+            return 429
+        return 0
+
+
+class FakeUpstream(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256   # the default backlog of 5 resets connections under a cold-start burst
+
+    def __init__(self, config: FakeConfig, port: int = 0):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.config = config
+        self.calls = Counter()        # endpoint -> requests
+        self.faults = Counter()       # status -> injected failures
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self) -> "FakeUpstream":
+        threading.Thread(target=self.serve_forever, name="fake-upstream", daemon=True).start()
+        return self
+
+    def count(self, endpoint: str) -> None:
+        with self.lock:
+            self.calls[endpoint] += 1
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive, like the real APIs
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        path = urlparse(self.path).path
+        if path.startswith("/v1/text-to-speech/"):
+            return self._eleven(body, stream=path.endswith("/stream"))
+        if ":generateContent" in path or ":streamGenerateContent" in path:
+            return self._generate(body, stream=":streamGenerateContent" in path)
+        self._send(404, b"{}")
+
+    # -- ElevenLabs --------------------------------------------------------
+    def _eleven(self, body: dict, stream: bool):
+        self.server.count("elevenlabs.stream" if stream else "elevenlabs")
+        if self._fault(self.server.config.tts_ms):
+            return
+        size = max(2000, len(body.get("text", "")) * _MP3_BYTES_PER_CHAR)
+        frame = b"\xff\xfb\x90\x64" + bytes(413)   # one 128 kbit/s MPEG-1 layer III frame
+        data = (frame * (size // len(frame) + 1))[:size]
+        self._body(200, "audio/mpeg", data, self.server.config.latency(self.server.config.tts_ms), stream)
+
+    # -- Gemini ------------------------------------------------------------
+    def _generate(self, body: dict, stream: bool):
+        gen = body.get("generationConfig") or {}
+        tts = "AUDIO" in (gen.get("responseModalities") or [])
+        cfg = self.server.config
+        self.server.count(("gemini-tts" if tts else "gemini") + (".stream" if stream else ""))
+        if self._fault(cfg.tts_ms if tts else cfg.text_ms):
+            return
+        prompt = _text_of({"parts": [p for c in body.get("contents") or [] for p in c.get("parts") or []]})
+        if tts:
+            pcm = bytes(max(4800, len(prompt) * _PCM_BYTES_PER_CHAR))
+            seconds = cfg.latency(cfg.tts_ms)
+            if not stream:
+                return self._sleep_json(seconds, _candidate({"inlineData": {"mimeType": "audio/L16;rate=24000",
+                                                                            "data": base64.b64encode(pcm).decode()}}))
+            step = -(-len(pcm) // _STREAM_CHUNKS)
+            events = [_candidate({"inlineData": {"mimeType": "audio/L16;rate=24000",
+                                                 "data": base64.b64encode(pcm[i:i + step]).decode()}})
+                      for i in range(0, len(pcm), step)]
+            return self._sse(events, seconds)
+        system = _text_of(body.get("systemInstruction"))
+        text = _answer(system, prompt, gen)
+        seconds = cfg.latency(cfg.text_ms)
+        if stream:
+            return self._sse([_candidate({"text": text})], seconds)
+        self._sleep_json(seconds, _candidate({"text": text}))
+
+    # -- plumbing ----------------------------------------------------------
+    def _fault(self, median_ms: float) -> bool:
+        status = self.server.config.fault()
+        if not status:
+            return False
+        with self.server.lock:
+            self.server.faults[status] += 1
+        time.sleep(self.server.config.latency(median_ms) / 4)   # failures come back faster than answers
+        err = json.dumps({"error": {"code": status, "message": "injected by the offline bench",
+                                    "status": "RESOURCE_EXHAUSTED" if status == 429 else "INTERNAL"}}).encode()
+        self._send(status, err, {"Retry-After": "1"} if status == 429 else None)
+        return True
+
+    def _sleep_json(self, seconds: float, payload: dict):
+        time.sleep(seconds)
+        self._json(payload)
+
+    def _sse(self, events: list, seconds: float):
+        # first event after ~30% of the latency, the rest spread over the remainder
+        chunks = [b"data: " + json.dumps(e).encode() + b"\n\n" for e in events]
+        self._body(200, "text/event-stream", chunks, seconds, stream=True)
+
+    def _body(self, status, ctype, data, seconds, stream):
+        chunks = data
+        if not isinstance(data, list):
+            step = max(1, -(-len(data) // _STREAM_CHUNKS)) if stream else max(1, len(data))
+            chunks = [data[i:i + step] for i in range(0, len(data), step)]
+        if not stream:
+            time.sleep(seconds)
+        self.send_response(status)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(sum(len(c) for c in chunks)))
+        self.end_headers()
+        if stream:
+            time.sleep(seconds * 0.3)
+        for i, chunk in enumerate(chunks):
+            if stream and i:
+                time.sleep(seconds * 0.7 / max(1, len(chunks) - 1))
+            self.wfile.write(chunk)
+            self.wfile.flush()
+
+    def _json(self, payload: dict):
+        self._send(200, json.dumps(payload).encode())
+
+    def _send(self, status: int, data: bytes, headers: dict | None = None):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def _text_of(content) -> str:
+    if isinstance(content, str):
+        return content
+    return "".join(p.get("text", "") for p in (content or {}).get("parts") or [] if isinstance(p, dict))
+
+
+def _candidate(part: dict) -> dict:
+    return {"candidates": [{"content": {"role": "model", "parts": [part]}, "finishReason": "STOP"}],
+            "usageMetadata": {"promptTokenCount": 1, "candidatesTokenCount": 1, "totalTokenCount": 2}}
+
+
+def _answer(system: str, prompt: str, gen: dict) -> str:
+    m = _PERSON_RE.search(prompt)
+    name = (m.group(1) or m.group(2)).strip() if m else "Unknown Figure"
+    # with a response_schema the shape is in the request, not the system text, and the answer is JSON
+    schema = (gen.get("responseSchema") or {}).get("properties") or {}
+    dump = json.dumps if gen.get("responseMimeType") == "application/json" else repr
+    if "samples" in schema or "'samples'" in system:
+        sample = f"I am {name}, and I have spent my life at work that others called stubborn. " * 6
+        return dump({"samples": [{"label": label, "purpose": "bench", "sample": sample}
+                                 for label in ("formal-lecture", "personal-letter", "maxim", "polite-decline")]})
+    if "canonical_name" in schema or "canonical_name" in system:
+        h = int(hashlib.sha256(name.encode()).hexdigest(), 16)
+        born = 1000 + h % 900
+        return dump({
+            "canonical_name": name, "aliases": [name.split()[-1]], "birth_year": born, "death_year": born + 60,
+            "age_at_death": 60, "nationality": _NATIONALITIES[h % len(_NATIONALITIES)], "era": "bench era",
+            "roles": ["scientist", "writer"], "fields": ["physics", "letters"],
+            "summary": f"{name} is a stand-in figure generated by the offline bench. " * 2,
+            "major_breakthroughs": [{"title": f"Discovery {i}", "year": born + 20 + i, "summary": "A result."}
+                                    for i in range(4)],
+            "notable_works": [{"title": f"Work {i}", "year": born + 30 + i, "type": "book"} for i in range(4)],
+            "key_quotes": ["Nothing in life is to be feared, it is only to be understood."],
+            "speaking_style": ["measured", "precise"], "controversies": ["A dispute with a rival."],
+            "disambiguation": None,
+        })
+    return f"Speak in a measured, formal register with precise enunciation, as {name} might have."
@@ -0,0 +1,107 @@
+import argparse, os, random, time
+from concurrent.futures import ThreadPoolExecutor
+
+from .offline import _percentiles
+
+
+# --- MICRO-BENCHMARK: per-tool generation profiles (needs GOOGLE_API_KEY) ----
+#   python -m <agent_package>.bench.generation [-n 5] [-c 4] [--tools details,style]
+# Sends each text tool's request for a few figures to gemini-2.5-flash twice,
+# interleaved: once with the SDK defaults and the prose format rules, once
+# with the tool's generation profile (no thinking, output cap, temperature,
+# response_schema). Requests go straight to the API, with no caches or
+# single-flight in between. Prints p50 / p95 latency, output and
+# thinking tokens, and how many answers failed to parse, per tool and variant.
+# --fake sends the same requests to the offline fake upstream: a plumbing
+# check, its latencies say nothing about the model.
+
+FIGURES = ["Marie Curie", "Ibn Sīnā", "Cleopatra", "Alan Turing", "Hypatia", "Leonardo da Vinci", "Ada Lovelace",
+           "Confucius", "Frida Kahlo", "Mansa Musa"]
+VARIANTS = ("default", "profile")
+
+
+def _tools():
+    # imported late: --fake must point the SDK at the fake upstream before the client exists
+    from .. import persona_common as pc
+    from ..persona_profile import Profile, StyleSet
+    one_line = lambda text: text if text and "\n" not in text else None
+    # tool -> (prompt fn, system without a schema, system with one, profile config, parser)
+    return {
+        "details": (pc.details_prompt, pc.DETAILS_RULES + pc.DETAILS_FORMAT, pc.DETAILS_RULES,
+                    pc.DETAILS_CONFIG, Profile.parse),
+        "style": (pc.style_prompt, pc.STYLE_RULES + pc.STYLE_FORMAT, pc.STYLE_RULES, pc.STYLE_CONFIG, StyleSet.parse),
+        "accent": (pc.accent_prompt, None, None, pc.ACCENT_CONFIG, one_line),
+    }
+
+
+def _call(client, spec, variant: str, name: str) -> dict:
+    from google.genai import types
+    prompt_fn, plain_system, schema_system, config, parse = spec
+    system, config = (plain_system, {}) if variant == "default" else (schema_system, config)
+    t0 = time.perf_counter()
+    try:
+        r = client.models.generate_content(model="gemini-2.5-flash", contents=prompt_fn(name),
+                                           config=types.GenerateContentConfig(system_instruction=system, **config))
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}"}
+    usage = r.usage_metadata
+    return {"seconds": time.perf_counter() - t0,
+            "out": (usage.candidates_token_count or 0) if usage else 0,
+            "think": (usage.thoughts_token_count or 0) if usage else 0,
+            "unparsed": parse((r.text or "").strip()) is None}
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Compare default vs per-tool generation configs for the text tools.")
+    ap.add_argument("-n", type=int, default=5, help="figures per tool (each sent once per variant)")
+    ap.add_argument("-c", "--concurrency", type=int, default=4)
+    ap.add_argument("--tools", default="details,style,accent")
+    ap.add_argument("--fake", action="store_true", help="send the requests to the offline fake upstream")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args(argv)
+
+    fake = None
+    if args.fake:
+        from .fakes import FakeConfig, FakeUpstream
+        fake = FakeUpstream(FakeConfig(text_ms=200.0, seed=args.seed)).start()
+        os.environ.update(GOOGLE_API_KEY="bench", GOOGLE_GEMINI_BASE_URL=fake.url)
+    elif not os.getenv("GOOGLE_API_KEY"):
+        ap.error("set GOOGLE_API_KEY (or use --fake)")
+    from ..clients import genai_client
+    from ..persona_common import GEN_PROFILES
+    if not GEN_PROFILES:
+        ap.error("GEN_PROFILES=0 leaves the profiles empty; unset it to compare")
+    specs = _tools()
+    chosen = [t for t in args.tools.split(",") if t in specs]
+
+    rng = random.Random(args.seed)
+    jobs = [(tool, variant, name) for tool in chosen for name in rng.sample(FIGURES, min(args.n, len(FIGURES)))
+            for variant in VARIANTS]
+    rng.shuffle(jobs)   # interleave variants so drift in API latency hits both alike
+    client = genai_client()
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            results = list(pool.map(lambda job: (job, _call(client, specs[job[0]], job[1], job[2])), jobs))
+    finally:
+        if fake is not None:
+            fake.shutdown()
+
+    print(f"{'tool':8} {'variant':8} {'n':>3} {'p50 ms':>8} {'p95 ms':>8} {'out tok':>8} {'think tok':>9} "
+          f"{'unparsed':>8} {'errors':>6}")
+    for tool in chosen:
+        for variant in VARIANTS:
+            rows = [r for (t, v, _), r in results if t == tool and v == variant]
+            ok = [r for r in rows if "error" not in r]
+            lat = _percentiles([r["seconds"] for r in ok])
+            mean = lambda key: sum(r[key] for r in ok) / len(ok) if ok else 0
+            print(f"{tool:8} {variant:8} {len(rows):3d} {lat.get('p50', 0):8.0f} {lat.get('p95', 0):8.0f} "
+                  f"{mean('out'):8.0f} {mean('think'):9.0f} {sum(r['unparsed'] for r in ok):8d} "
+                  f"{len(rows) - len(ok):6d}")
+    for (tool, variant, name), r in results:
+        if "error" in r:
+            print(f"  {tool}/{variant} {name}: {r['error'][:160]}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,274 @@
+import argparse, asyncio, json, os, random, socket, subprocess, sys, tempfile, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+from .fakes import FakeConfig, FakeUpstream
+
+
+# --- OFFLINE BENCHMARK (no API keys, no network) -----------------------------
+#   python -m <agent_package>.bench.offline                      # 200 sessions, 20 at a time, async tools
+#   python -m <agent_package>.bench.offline -n 500 -c 50 --mode sync --error-rate 0.05 --json
+#
+# Fake Gemini / ElevenLabs endpoints run in this process; the agent code runs
+# in a child process whose env points the genai SDK and the ElevenLabs client
+# at them, with its own temp dir (cold caches, private audio folder) and a
+# free audio port. Each simulated session does one turn: get_details +
+# get_voice_style together, then speak_elevenlabs_auto, then downloads the
+# clip from the audio server. The child reports per-step latency percentiles,
+# throughput and memory; this process adds the upstream call counts.
+# --local-tts speaks with speak_local instead (needs Piper or eSpeak NG), so
+# the TTS step costs CPU here rather than a vendor call.
+
+FIGURES = [("Marie Curie", "female"), ("Ibn Sīnā", "male"), ("Cleopatra", "female"), ("Alan Turing", "male"),
+           ("Hypatia", "female"), ("Leonardo da Vinci", "male"), ("Ada Lovelace", "female"), ("Nikola Tesla", "male"),
+           ("Confucius", "male"), ("Frida Kahlo", "female"), ("Mansa Musa", "male"), ("Murasaki Shikibu", "female")]
+QUESTIONS = ["What was your greatest discovery?", "Which of your works are you proudest of?",
+             "What advice would you give a young student?", "Did you ever regret a decision?", "Tell me about your era."]
+SENTENCES = [f"{opening} {topic}." for opening in ("I remember well how", "Few believed that", "It was my conviction that",
+                                                   "In those years I learned that", "Let me tell you plainly that")
+             for topic in ("patience outlasts every rival", "the work itself was the reward",
+                           "a question well posed is half answered", "my teachers were often wrong",
+                           "courage matters more than talent", "the evidence must lead, not my hopes",
+                           "every failure taught me something", "the world changes slower than we wish")]
+STEPS = ("details", "style", "speak", "audio", "turn")
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Offline load test of the tools and audio server against fake upstreams.")
+    ap.add_argument("-n", "--sessions", type=int, default=200)
+    ap.add_argument("-c", "--concurrency", type=int, default=20)
+    ap.add_argument("--mode", choices=("async", "sync"), default="async", help="async_tools on one loop, or tools in threads")
+    ap.add_argument("--figures", type=int, default=len(FIGURES), help="distinct figures sessions pick from")
+    ap.add_argument("--text-ms", type=float, default=800.0, help="median Gemini text latency")
+    ap.add_argument("--tts-ms", type=float, default=1200.0, help="median TTS latency")
+    ap.add_argument("--jitter", type=float, default=0.35, help="log-normal sigma of upstream latency")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="share of upstream calls failed with 500")
+    ap.add_argument("--rate-limit-rate", type=float, default=0.0, help="share of upstream calls rejected with 429")
+    ap.add_argument("--no-streaming", action="store_true", help="TTS_STREAMING=0 (wait for whole clips)")
+    ap.add_argument("--no-rate-limit", action="store_true", help="disable the per-provider token buckets")
+    ap.add_argument("--local-tts", action="store_true", help="speak with speak_local (Piper / eSpeak NG), no TTS vendor")
+    ap.add_argument("--tracemalloc", action="store_true", help="also report the Python heap peak (slower)")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--json", action="store_true", help="print one JSON report instead of the table")
+    args = ap.parse_args(argv)
+    if os.getenv("BENCH_CHILD"):
+        return _child(args)
+
+    fake = FakeUpstream(FakeConfig(args.text_ms, args.tts_ms, args.jitter, args.error_rate, args.rate_limit_rate,
+                                   args.seed)).start()
+    with tempfile.TemporaryDirectory(prefix="history-agent-bench-") as tmp:
+        env = dict(os.environ, BENCH_CHILD="1", TMPDIR=tmp, TEMP=tmp, TMP=tmp,
+                   GOOGLE_API_KEY="bench", GEMINI_API_KEY="bench", ELEVENLABS_API_KEY="bench",
+                   GOOGLE_GEMINI_BASE_URL=fake.url, ELEVENLABS_BASE_URL=fake.url,
+                   AUDIO_DIR=os.path.join(tmp, "audio"), AUDIO_PORT=str(_free_port()),
+                   WARMUP_ON_START="0", WARMUP_FIGURES="", TTS_STREAMING="0" if args.no_streaming else "1")
+        env.pop("AUDIO_HOST_EXTERNAL", None)
+        if args.no_rate_limit:
+            env.update(GEMINI_RPS="0", GEMINI_TTS_RPS="0", ELEVEN_RPS="0")
+        child = subprocess.run([sys.executable, "-m", __spec__.name, *(argv if argv is not None else sys.argv[1:])],
+                               env=env, stdout=subprocess.PIPE, text=True)
+    fake.shutdown()
+    upstream = {"calls": dict(sorted(fake.calls.items())), "injected": {str(k): v for k, v in fake.faults.items()}}
+    if args.json:
+        report = json.loads(child.stdout or "{}")
+        report["upstream"] = upstream
+        print(json.dumps(report, indent=2))
+    else:
+        sys.stdout.write(child.stdout)
+        print("upstream calls: " + (", ".join(f"{k} {v}" for k, v in upstream["calls"].items()) or "none")
+              + ("; injected " + ", ".join(f"{k}x{v}" for k, v in upstream["injected"].items())
+                 if upstream["injected"] else ""))
+    return child.returncode
+
+
+# --- child: the measured process ---------------------------------------------
+
+def _child(args) -> int:
+    from .. import async_tools, tools   # already loaded with the package; env above applied at import
+    from ..tts_common import ensure_audio_server
+    if args.tracemalloc:
+        import tracemalloc
+        tracemalloc.start()
+    rss0 = _rss_mb()
+    ensure_audio_server()
+
+    rng = random.Random(args.seed)
+    figures = FIGURES[:max(1, min(args.figures, len(FIGURES)))]
+    plans = [(*rng.choice(figures), rng.choice(QUESTIONS), " ".join(rng.sample(SENTENCES, 3)))
+             for _ in range(args.sessions)]
+    samples = {s: [] for s in STEPS}
+    errors: dict[str, int] = {}
+    lock = threading.Lock()
+
+    def record(step, seconds=None, error=None):
+        with lock:
+            if error is not None:
+                key = f"{step}: {type(error).__name__}"
+                errors[key] = errors.get(key, 0) + 1
+            else:
+                samples[step].append(seconds)
+
+    t0 = time.perf_counter()
+    if args.mode == "async":
+        speak = async_tools.speak_local if args.local_tts else async_tools.speak_elevenlabs_auto
+        asyncio.run(_run_async(async_tools, speak, plans, args.concurrency, record))
+    else:
+        speak = tools.speak_local if args.local_tts else tools.speak_elevenlabs_auto
+        _run_sync(tools, speak, plans, args.concurrency, record)
+    wall = time.perf_counter() - t0
+
+    report = {
+        "mode": args.mode, "sessions": args.sessions, "concurrency": args.concurrency,
+        "tts": "local" if args.local_tts else "vendor",
+        "upstream_ms": {"text": args.text_ms, "tts": args.tts_ms, "jitter": args.jitter},
+        "fault_rates": {"500": args.error_rate, "429": args.rate_limit_rate},
+        "wall_s": round(wall, 3), "turns_per_s": round(len(samples["turn"]) / wall, 2) if wall else 0.0,
+        "latency_ms": {s: _percentiles(v) for s, v in samples.items()},
+        "errors": errors,
+        "memory_mb": {"rss_start": rss0, "rss_end": _rss_mb(), "rss_peak": _peak_rss_mb()},
+    }
+    if args.tracemalloc:
+        report["memory_mb"]["python_heap_peak"] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+    print(json.dumps(report) if args.json else _table(report))
+    return 0
+
+
+async def _run_async(async_tools, speak, plans, concurrency, record):
+    import httpx
+    slots = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(timeout=120.0) as http:
+
+        async def step(name, coro):
+            t = time.perf_counter()
+            try:
+                result = await coro
+            except Exception as e:
+                record(name, error=e)
+                raise
+            record(name, time.perf_counter() - t)
+            return result
+
+        async def turn(name, gender, question, reply):
+            async with slots:
+                t = time.perf_counter()
+                try:
+                    details, _ = await asyncio.gather(step("details", async_tools.get_details(name, question)),
+                                                      step("style", async_tools.get_voice_style(name)))
+                    nationality = details.get("nationality", "") if isinstance(details, dict) else ""
+                    res = await step("speak", speak(reply, nationality, gender))
+                    await step("audio", _fetch_async(http, res))
+                except Exception:
+                    return
+                record("turn", time.perf_counter() - t)
+
+        await asyncio.gather(*(turn(*p) for p in plans))
+
+
+async def _fetch_async(http, res: dict) -> int:
+    r = await http.get(_audio_url(res))
+    r.raise_for_status()
+    return len(r.content)
+
+
+def _run_sync(tools, speak, plans, concurrency, record):
+    import requests
+    local = threading.local()
+    side = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bench-style")
+
+    def step(name, fn, *a):
+        t = time.perf_counter()
+        try:
+            result = fn(*a)
+        except Exception as e:
+            record(name, error=e)
+            raise
+        record(name, time.perf_counter() - t)
+        return result
+
+    def fetch(res):
+        if not hasattr(local, "http"):
+            local.http = requests.Session()   # keep-alive per session thread, like a browser tab
+        r = local.http.get(_audio_url(res), timeout=120)
+        r.raise_for_status()
+        return len(r.content)
+
+    def turn(plan):
+        name, gender, question, reply = plan
+        t = time.perf_counter()
+        try:
+            style = side.submit(step, "style", tools.get_voice_style, name)
+            details = step("details", tools.get_details, name, question)
+            style.result()
+            nationality = details.get("nationality", "") if isinstance(details, dict) else ""
+            res = step("speak", speak, reply, nationality, gender)
+            step("audio", fetch, res)
+        except Exception:
+            return
+        record("turn", time.perf_counter() - t)
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bench-session") as pool:
+        list(pool.map(turn, plans))
+    side.shutdown()
+
+
+def _audio_url(res: dict) -> str:
+    url = res.get("audio_url") or ""
+    if not url:
+        raise RuntimeError(res.get("error") or "no audio_url")
+    return url
+
+
+# --- reporting ---------------------------------------------------------------
+
+def _percentiles(values: list) -> dict:
+    if not values:
+        return {"n": 0}
+    v = sorted(values)
+    pick = lambda q: round(v[min(len(v) - 1, int(q * len(v)))] * 1000, 1)
+    return {"n": len(v), "p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99), "max": round(v[-1] * 1000, 1)}
+
+
+def _table(r: dict) -> str:
+    lines = [f"offline bench: {r['sessions']} sessions, concurrency {r['concurrency']}, {r['mode']} tools, "
+             f"{r['tts']} TTS; "
+             f"upstream median text {r['upstream_ms']['text']:.0f} ms / tts {r['upstream_ms']['tts']:.0f} ms, "
+             f"faults 500={r['fault_rates']['500']:.0%} 429={r['fault_rates']['429']:.0%}",
+             f"wall {r['wall_s']:.2f} s   throughput {r['turns_per_s']:.2f} turns/s",
+             f"{'step':<8} {'n':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}"]
+    for step, p in r["latency_ms"].items():
+        if p["n"]:
+            lines.append(f"{step:<8} {p['n']:>6} {p['p50']:>9.1f} {p['p95']:>9.1f} {p['p99']:>9.1f} {p['max']:>9.1f}")
+        else:
+            lines.append(f"{step:<8} {0:>6}")
+    if r["errors"]:
+        lines.append("errors: " + ", ".join(f"{k} x{v}" for k, v in sorted(r["errors"].items())))
+    m = r["memory_mb"]
+    lines.append(f"memory: rss {m['rss_start']} -> {m['rss_end']} MB, peak {m['rss_peak']} MB"
+                 + (f", python heap peak {m['python_heap_peak']} MB" if "python_heap_peak" in m else ""))
+    return "\n".join(lines)
+
+
+def _rss_mb() -> float | None:
+    try:
+        with open("/proc/self/statm") as f:
+            return round(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20, 1)
+    except (OSError, ValueError, AttributeError):
+        return _peak_rss_mb()
+
+
+def _peak_rss_mb() -> float | None:
+    try:
+        import resource
+    except ImportError:
+        return None   # Windows
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (2 ** 20 if sys.platform == "darwin" else 2 ** 10), 1)   # bytes on macOS, KiB on Linux
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,85 @@
+import random, time
+
+from ..voice_routing import VOICE_CONFIG, VoiceTable
+
+
+# --- MICRO-BENCHMARK: nationality -> voice routing ----------------------------
+#   python -m <agent_package>.bench.voice_routing [-n 200000]
+# Times a cold table load, uncached lookups and memoized lookups over a mix of
+# realistic profile nationalities, against the old substring-scan chain, and
+# prints the cases where the two disagree.
+
+SAMPLES = [
+    "Polish-French", "British", "English", "Ukrainian", "Russian", "Persian", "Egyptian (Ptolemaic, Macedonian Greek)",
+    "Greek (Alexandrian)", "Italian (Florentine)", "American", "Latin American", "South African", "Nigerian",
+    "Chinese", "Japanese", "Korean", "Indian", "Pakistani", "Swedish", "Danish", "Austrian", "German-American",
+    "Ottoman Turkish", "Côte d'Ivoire", "Mexican", "Brazilian", "Australian", "New Zealander", "Irish", "Scottish",
+    "Uzbek", "Roman", "Babylonian", "Inca", "North African (Berber)", "",
+]
+
+
+def _legacy_region(nationality: str) -> str:
+    # the pre-table implementation, kept only as a baseline
+    n = (nationality or "").lower()
+    chain = [
+        ("en_in", ["india","indian","pakistan","pakistani","bangladesh","bangladeshi","sri lanka","sri-lanka","lankan",
+                   "nepal","nepali"]),
+        ("en_gb", ["england","english","britain","british","uk","united kingdom","wales","scotland","ireland","irish"]),
+        ("en_us", ["united states","usa","american","canada","canadian"]),
+        ("en_au", ["australia","australian","new zealand","nz","kiwi","aotearoa"]),
+        ("en_cn", ["china","chinese","prc"]),
+        ("en_eastasia", ["japan","japanese","korea","korean"]),
+        ("en_mena", ["uae","saudi","arabia","egypt","morocco","algeria","tunisia","iraq","syria","jordan","lebanon",
+                     "arab","iran","persian","iranian","turkey","turkish","israel","israeli","hebrew"]),
+        ("en_eu_cont", ["germany","german","france","french","italy","italian","spain","spanish","portugal",
+                        "portuguese","poland","polish","netherlands","dutch","belgium","austria","switzerland","czech",
+                        "hungary","romania","bulgaria","serbia","croatia","bosnia","albania","slovenia","slovakia",
+                        "greece","ukraine","belarus","baltic","estonia","latvia","lithuania"]),
+        ("en_latam", ["mexico","mexican","brazil","brazilian","argentina","chile","colombia","peru","ecuador",
+                      "bolivia","paraguay","uruguay","venezuela","latin america","latam","hispanic"]),
+        ("en_af", ["south africa","nigeria","ghana","kenya","uganda","tanzania","ethiopia","rwanda","burundi",
+                   "somalia","zambia","zimbabwe","botswana","namibia","angola","cameroon","senegal","mali",
+                   "ivory coast","côte d'ivoire"]),
+    ]
+    for region, keys in chain:
+        if any(k in n for k in keys):
+            return region
+    return "en_gb"
+
+
+def _time(fn, inputs) -> float:
+    t0 = time.perf_counter()
+    for x in inputs:
+        fn(x)
+    return (time.perf_counter() - t0) / len(inputs) * 1e9
+
+
+def main(argv=None) -> int:
+    import argparse
+    ap = argparse.ArgumentParser(description="Time nationality -> voice routing.")
+    ap.add_argument("-n", type=int, default=200_000, help="lookups per measurement")
+    args = ap.parse_args(argv)
+
+    t0 = time.perf_counter()
+    table = VoiceTable.load(VOICE_CONFIG)
+    load_ms = (time.perf_counter() - t0) * 1e3
+    inputs = [random.choice(SAMPLES) for _ in range(args.n)]
+    # uncached: a fresh suffix per call defeats the memo but not the matcher
+    unique = [f"{s} #{i}" for i, s in enumerate(inputs)]
+
+    print(f"table load + compile     {load_ms:8.2f} ms  ({len(table._term_region)} terms, {len(table.regions)} regions)")
+    print(f"legacy substring chain   {_time(_legacy_region, inputs):8.0f} ns/lookup")
+    print(f"compiled, uncached       {_time(table._region, unique):8.0f} ns/lookup")
+    print(f"compiled, memoized       {_time(table.region, inputs):8.0f} ns/lookup")
+    print(f"gemini voice, memoized   {_time(lambda s: table.gemini_voice(s, 'female'), inputs):8.0f} ns/lookup")
+
+    print("\nrouting changes vs legacy:")
+    for s in SAMPLES:
+        old, new = _legacy_region(s), table.region(s)
+        if old != new:
+            print(f"  {s!r:45} {old:>11} -> {new}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
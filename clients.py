@@ -0,0 +1,41 @@
+import os, threading
+
+from dotenv import load_dotenv
+from google import genai
+
+
+# --- CLIENT REGISTRY (lazy, process-wide) ------------------------------------
+# .env is read once and each genai.Client is built once per API key, on first
+# use, then shared by every tool call and thread. Keying on the resolved key
+# means a rotated key simply gets a fresh client.
+
+_LOCK = threading.Lock()
+_ENV_LOADED = False
+_GENAI: dict = {}
+
+
+def getenv(*names: str) -> str | None:
+    """First non-empty env var among `names` (loading .env on first call)."""
+    global _ENV_LOADED
+    if not _ENV_LOADED:
+        with _LOCK:
+            if not _ENV_LOADED:
+                load_dotenv()
+                _ENV_LOADED = True
+    for name in names:
+        value = os.getenv(name)
+        if value:
+            return value
+    return None
+
+
+def genai_client(*key_names: str):
+    """Shared google-genai client for the first API key found among `key_names` (default GOOGLE_API_KEY)."""
+    key = getenv(*(key_names or ("GOOGLE_API_KEY",)))
+    client = _GENAI.get(key)
+    if client is None:
+        with _LOCK:
+            client = _GENAI.get(key)
+            if client is None:
+                client = _GENAI[key] = genai.Client(api_key=key)
+    return client
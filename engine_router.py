@@ -0,0 +1,261 @@
+import asyncio, contextvars, threading, time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .metrics import span
+from .upstream import QueueClock
+
+
+# --- TTS ENGINE ROUTER (rolling health, circuit breaker, hedged requests) ----
+# Engines are tried in preference order. Each keeps a rolling window of
+# latencies/outcomes; an engine that keeps failing trips its breaker and is
+# skipped outright until a cool-down probe succeeds. While the preferred engine
+# is slower than its own p95, a hedge request goes to the next engine and the
+# first success wins, so a degraded vendor costs one p95, not one timeout.
+# Last-resort engines (the local CPU voice) are never hedge targets: racing
+# them against a merely slow vendor would trade quality for a few seconds.
+# Latency means the engine's own time: waits for our rate-limiter tokens are
+# left out of both the recorded latency and the hedge timer, so queueing
+# behind our own traffic doesn't read as a slow vendor.
+
+WINDOW = 50                 # calls remembered per engine
+WINDOW_SECONDS = 300.0      # ...and only from the last 5 minutes
+MIN_SAMPLES = 5             # before error-rate / percentile decisions kick in
+ERROR_RATE_OPEN = 0.5       # open the breaker above this rolling error rate
+CONSECUTIVE_OPEN = 3        # ...or after this many failures in a row
+COOL_DOWN = 30.0            # seconds an open breaker waits before a half-open probe
+HEDGE_PERCENTILE = 0.95
+HEDGE_FLOOR = 1.5           # never hedge earlier than this (seconds)
+
+
+class EngineHealth:
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: deque = deque(maxlen=WINDOW)   # (finished_at, latency, ok)
+        self._fail_streak = 0
+        self._opened_at = 0.0
+        self._state = "closed"                        # closed | open | half-open
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._state == "closed":
+                return True
+            if self._state == "open" and time.time() - self._opened_at >= COOL_DOWN:
+                self._state = "half-open"             # let exactly one probe through
+                return True
+            return False
+
+    def record(self, latency: float, ok: bool) -> None:
+        with self._lock:
+            self._calls.append((time.time(), latency, ok))
+            self._fail_streak = 0 if ok else self._fail_streak + 1
+            if self._state == "half-open":
+                self._set_open(not ok)
+            elif not ok and (self._fail_streak >= CONSECUTIVE_OPEN or self._error_rate() > ERROR_RATE_OPEN):
+                self._set_open(True)
+
+    def is_closed(self) -> bool:
+        # hedging must not consume a half-open probe slot; only closed engines are hedge targets
+        with self._lock:
+            return self._state == "closed"
+
+    def hedge_after(self) -> float | None:
+        """Seconds to wait before hedging, or None while there is too little history."""
+        with self._lock:
+            lat = sorted(l for _, l, ok in self._recent() if ok)
+        if len(lat) < MIN_SAMPLES:
+            return None
+        return max(HEDGE_FLOOR, lat[min(len(lat) - 1, int(HEDGE_PERCENTILE * len(lat)))])
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            recent = self._recent()
+            lat = sorted(l for _, l, ok in recent if ok)
+            return {
+                "state": self._state,
+                "calls": len(recent),
+                "error_rate": round(self._error_rate(), 3),
+                "p50": lat[len(lat) // 2] if lat else None,
+                "p95": lat[min(len(lat) - 1, int(0.95 * len(lat)))] if lat else None,
+            }
+
+    # -- internals (lock held) ---------------------------------------------
+    def _recent(self) -> list:
+        cutoff = time.time() - WINDOW_SECONDS
+        return [c for c in self._calls if c[0] >= cutoff]
+
+    def _error_rate(self) -> float:
+        recent = self._recent()
+        if len(recent) < MIN_SAMPLES:
+            return 0.0
+        return sum(1 for _, _, ok in recent if not ok) / len(recent)
+
+    def _set_open(self, is_open: bool) -> None:
+        self._state = "open" if is_open else "closed"
+        if is_open:
+            self._opened_at = time.time()
+
+
+class NoEngineAvailable(RuntimeError):
+    pass
+
+
+class EngineRouter:
+    def __init__(self, hedge: bool = True, max_workers: int = 16, last_resort=()):
+        self.hedge = hedge
+        self.last_resort = frozenset(last_resort)   # engines only tried once everything before them failed
+        self.health: dict[str, EngineHealth] = {}
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tts-route")
+        self._lock = threading.Lock()
+        self._background: set = set()   # async hedge losers still running
+
+    def engine(self, name: str) -> EngineHealth:
+        with self._lock:
+            if name not in self.health:
+                self.health[name] = EngineHealth(name)
+            return self.health[name]
+
+    def run(self, candidates: list) -> tuple[str, object, list[str]]:
+        """
+        candidates: [(name, zero-arg callable or None), ...] in preference order.
+        Returns (engine_name, result, notes). Raises NoEngineAvailable with every reason if all fail.
+        """
+        notes, tried = [], set()
+        live = [(n, fn) for n, fn in candidates if fn is not None]
+        for i, (name, fn) in enumerate(live):
+            if name in tried:
+                continue
+            if not self.engine(name).allow():
+                notes.append(f"{name}: circuit open")
+                continue
+            backup = None
+            if self.hedge:
+                backup = next(((n, f) for n, f in live[i + 1:]
+                               if n not in self.last_resort and self.engine(n).is_closed()), None)
+            try:
+                winner, result = self._attempt(name, fn, backup, notes, tried)
+                return winner, result, notes
+            except Exception as e:
+                notes.append(f"{name}: {e}")
+        raise NoEngineAvailable("; ".join(notes) or "no TTS engine configured")
+
+    async def run_async(self, candidates: list) -> tuple[str, object, list[str]]:
+        """run() for coroutine functions: same health, breaker and hedging, no threads."""
+        notes, tried = [], set()
+        live = [(n, fn) for n, fn in candidates if fn is not None]
+        for i, (name, fn) in enumerate(live):
+            if name in tried:
+                continue
+            if not self.engine(name).allow():
+                notes.append(f"{name}: circuit open")
+                continue
+            backup = None
+            if self.hedge:
+                backup = next(((n, f) for n, f in live[i + 1:]
+                               if n not in self.last_resort and self.engine(n).is_closed()), None)
+            try:
+                winner, result = await self._attempt_async(name, fn, backup, notes, tried)
+                return winner, result, notes
+            except Exception as e:
+                notes.append(f"{name}: {e}")
+        raise NoEngineAvailable("; ".join(notes) or "no TTS engine configured")
+
+    # -- internals ---------------------------------------------------------
+    def metrics(self):
+        """Gauge samples for metrics.REGISTRY.collect."""
+        for name, h in list(self.health.items()):
+            snap = h.snapshot()
+            yield "tts_breaker_open", {"engine": name}, snap["state"] != "closed"
+            yield "tts_error_rate", {"engine": name}, snap["error_rate"]
+
+    def _timed(self, name: str, fn, clock: QueueClock | None = None):
+        clock = clock or QueueClock()
+        t0 = time.perf_counter()
+        try:
+            with span("tts_engine", engine=name), clock:
+                result = fn()
+        except Exception:
+            self.engine(name).record(_net(t0, clock), False)
+            raise
+        self.engine(name).record(_net(t0, clock), True)
+        return result
+
+    def _attempt(self, name, fn, backup, notes, tried):
+        delay = self.engine(name).hedge_after() if backup else None
+        if delay is None:
+            return name, self._timed(name, fn)
+
+        clock, t0 = QueueClock(), time.perf_counter()
+        primary = self._pool.submit(contextvars.copy_context().run, self._timed, name, fn, clock)
+        while not primary.done() and (left := delay - _net(t0, clock)) > 0:
+            wait([primary], timeout=left)
+        if primary.done():
+            return name, primary.result()
+
+        # primary is past its p95: race the backup; the loser still finishes and warms the cache
+        bname, bfn = backup
+        tried.add(bname)
+        notes.append(f"{name}: slower than p{int(HEDGE_PERCENTILE * 100)} ({delay:.1f}s), hedged to {bname}")
+        hedge = self._pool.submit(contextvars.copy_context().run, self._timed, bname, bfn)
+        pending = {primary: name, hedge: bname}
+        errors = []
+        while pending:
+            done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+            for fut in done:
+                engine = pending.pop(fut)
+                if fut.exception() is None:
+                    return engine, fut.result()
+                errors.append(f"{engine}: {fut.exception()}")
+        raise RuntimeError("; ".join(errors))
+
+    async def _timed_async(self, name: str, fn, clock: QueueClock | None = None):
+        clock = clock or QueueClock()
+        t0 = time.perf_counter()
+        try:
+            with span("tts_engine", engine=name), clock:
+                result = await fn()
+        except Exception:
+            self.engine(name).record(_net(t0, clock), False)
+            raise
+        self.engine(name).record(_net(t0, clock), True)
+        return result
+
+    async def _attempt_async(self, name, fn, backup, notes, tried):
+        delay = self.engine(name).hedge_after() if backup else None
+        if delay is None:
+            return name, await self._timed_async(name, fn)
+
+        clock, t0 = QueueClock(), time.perf_counter()
+        primary = asyncio.ensure_future(self._timed_async(name, fn, clock))
+        while not primary.done() and (left := delay - _net(t0, clock)) > 0:
+            await asyncio.wait({primary}, timeout=left)
+        if primary.done():
+            return name, primary.result()
+
+        bname, bfn = backup
+        tried.add(bname)
+        notes.append(f"{name}: slower than p{int(HEDGE_PERCENTILE * 100)} ({delay:.1f}s), hedged to {bname}")
+        hedge = asyncio.ensure_future(self._timed_async(bname, bfn))
+        pending = {primary: name, hedge: bname}
+        errors = []
+        try:
+            while pending:
+                done, _ = await asyncio.wait(set(pending), return_when=asyncio.FIRST_COMPLETED)
+                for fut in done:
+                    engine = pending.pop(fut)
+                    if fut.exception() is None:
+                        return engine, fut.result()
+                    errors.append(f"{engine}: {fut.exception()}")
+            raise RuntimeError("; ".join(errors))
+        finally:
+            for fut in pending:
+                # the loser still finishes (and warms the cache); keep it referenced, swallow its error
+                self._background.add(fut)
+                fut.add_done_callback(self._background.discard)
+                fut.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+
+def _net(t0: float, clock: QueueClock) -> float:
+    """Seconds since t0 that the engine itself took: wall time minus our own rate-limiter queueing."""
+    return time.perf_counter() - t0 - clock.queued()
@@ -0,0 +1,139 @@
+import asyncio, json, os, shutil, struct, subprocess, threading, weakref
+from pathlib import Path
+
+
+# --- LOCAL TTS (CPU, no network: Piper or eSpeak NG) -------------------------
+# The last engine behind ElevenLabs and Gemini, so a reply still gets audio
+# when both vendors are down, and a free engine for load tests. Both backends
+# are command-line programs fed the text on stdin: Piper (neural, needs .onnx
+# voices in PIPER_VOICES) sounds far better, eSpeak NG (formant) is tiny and
+# near-instant. Voices come from the "local" entry of each region in
+# voices.json; neither ships non-English accents worth using on English text,
+# so regions map to the nearest English voice. LOCAL_TTS=auto picks Piper when
+# it has voices, else eSpeak NG; LOCAL_TTS=0 disables the engine.
+
+LOCAL_TTS = os.getenv("LOCAL_TTS", "auto").strip().lower()        # auto | piper | espeak | 0
+PIPER_BIN = os.getenv("PIPER_BIN") or "piper"
+PIPER_VOICES = Path(os.getenv("PIPER_VOICES") or Path.home() / ".local" / "share" / "piper")
+ESPEAK_BIN = os.getenv("ESPEAK_BIN") or ("espeak-ng" if shutil.which("espeak-ng") else "espeak")
+ESPEAK_WPM = int(os.getenv("ESPEAK_WPM", "165"))
+TIMEOUT = 30.0                       # seconds per clip; a local engine that hangs is broken
+SLOTS = max(1, (os.cpu_count() or 2) // 2)   # concurrent synthesis processes (CPU-bound)
+
+
+class PiperBackend:
+    name = "piper"
+
+    def __init__(self, binary: str = PIPER_BIN, voices: Path = PIPER_VOICES):
+        self.binary = binary
+        self.voices = Path(voices)
+
+    def available(self) -> bool:
+        return bool(shutil.which(self.binary)) and any(self.voices.glob("*.onnx"))
+
+    def voice(self, local: dict, female: bool) -> str:
+        # the configured model if it is installed, else any installed one
+        wanted = (local.get("piper") or {}).get("female" if female else "male")
+        if wanted and (self.voices / f"{wanted}.onnx").exists():
+            return wanted
+        return sorted(self.voices.glob("*.onnx"))[0].stem
+
+    def command(self, text: str, voice: str) -> tuple[list[str], bytes]:
+        # Piper speaks one utterance per input line
+        return [self.binary, "--model", str(self.voices / f"{voice}.onnx"), "--output-raw"], \
+            " ".join(text.split()).encode("utf-8") + b"\n"
+
+    def decode(self, out: bytes, voice: str) -> tuple[bytes, int]:
+        with open(self.voices / f"{voice}.onnx.json", encoding="utf-8") as f:
+            rate = json.load(f)["audio"]["sample_rate"]
+        return out, rate
+
+
+class EspeakBackend:
+    name = "espeak"
+
+    def __init__(self, binary: str = ESPEAK_BIN, wpm: int = ESPEAK_WPM):
+        self.binary = binary
+        self.wpm = wpm
+
+    def available(self) -> bool:
+        return bool(shutil.which(self.binary))
+
+    def voice(self, local: dict, female: bool) -> str:
+        return f"{local.get('espeak') or 'en'}+{'f3' if female else 'm3'}"
+
+    def command(self, text: str, voice: str) -> tuple[list[str], bytes]:
+        return [self.binary, "--stdout", "-b", "1", "-v", voice, "-s", str(self.wpm)], text.encode("utf-8")
+
+    def decode(self, out: bytes, voice: str) -> tuple[bytes, int]:
+        # a WAV on stdout; its sizes are placeholders (a pipe can't seek back), so find the data chunk ourselves
+        if out[:4] != b"RIFF" or out[12:16] != b"fmt ":
+            raise RuntimeError("espeak: no WAV on stdout")
+        rate = struct.unpack_from("<I", out, 24)[0]
+        data = out.find(b"data", 36)
+        if data < 0:
+            raise RuntimeError("espeak: WAV without a data chunk")
+        pcm = out[data + 8:]
+        return pcm[:len(pcm) - len(pcm) % 2], rate
+
+
+_BACKENDS = {"piper": PiperBackend, "espeak": EspeakBackend}
+
+
+def _pick(choice: str):
+    if choice in ("0", "off", "none", ""):
+        return None
+    if choice != "auto":
+        return _BACKENDS[choice]() if choice in _BACKENDS else None
+    return next((b for b in (PiperBackend(), EspeakBackend()) if b.available()), None)
+
+
+class LocalTTS:
+    """Runs one backend's program per clip; returns (16-bit mono PCM, sample rate)."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._slots = threading.BoundedSemaphore(SLOTS)
+        self._async_slots: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = \
+            weakref.WeakKeyDictionary()
+
+    @property
+    def name(self) -> str:
+        return self.backend.name
+
+    def voice(self, local: dict, gender: str) -> str:
+        return self.backend.voice(local or {}, (gender or "").strip().lower() in ("female", "f", "woman"))
+
+    def synthesize(self, text: str, voice: str) -> tuple[bytes, int]:
+        argv, stdin = self.backend.command(text, voice)
+        with self._slots:
+            proc = subprocess.run(argv, input=stdin, capture_output=True, timeout=TIMEOUT)
+        return self._result(proc.returncode, proc.stdout, proc.stderr, voice)
+
+    async def synthesize_async(self, text: str, voice: str) -> tuple[bytes, int]:
+        argv, stdin = self.backend.command(text, voice)
+        loop = asyncio.get_running_loop()
+        slots = self._async_slots.get(loop) or self._async_slots.setdefault(loop, asyncio.Semaphore(SLOTS))
+        async with slots:
+            proc = await asyncio.create_subprocess_exec(*argv, stdin=asyncio.subprocess.PIPE,
+                                                        stdout=asyncio.subprocess.PIPE,
+                                                        stderr=asyncio.subprocess.PIPE)
+            try:
+                out, err = await asyncio.wait_for(proc.communicate(stdin), TIMEOUT)
+            except BaseException:
+                proc.kill()
+                await proc.wait()
+                raise
+        return self._result(proc.returncode, out, err, voice)
+
+    def _result(self, code: int, out: bytes, err: bytes, voice: str) -> tuple[bytes, int]:
+        if code != 0:
+            raise RuntimeError(f"{self.name} exited {code}: {err.decode('utf-8', 'replace').strip()[-200:]}")
+        pcm, rate = self.backend.decode(out, voice)
+        if not pcm:
+            raise RuntimeError(f"{self.name} produced no audio")
+        return pcm, rate
+
+
+_backend = _pick(LOCAL_TTS)
+local_tts = LocalTTS(_backend) if _backend is not None else None
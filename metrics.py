@@ -0,0 +1,137 @@
+import functools, inspect, json, logging, os, threading, time
+from contextlib import contextmanager
+
+
+# --- METRICS (timing spans + counters, Prometheus text format) ---------------
+# span("upstream", provider="gemini") times a block into a histogram labelled
+# with its outcome (ok / error, or whatever the block sets, e.g. hit / miss);
+# inc("cache_hits_total", cache="clip") bumps a counter. The audio server
+# serves everything at /metrics; with METRICS_LOG=1 every span is also logged
+# as one JSON line on the "history_agent.metrics" logger. Numbers are per
+# process (in multi-worker mode, scrape the logs for the other workers).
+
+PREFIX = "history_agent_"
+METRICS_LOG = os.getenv("METRICS_LOG", "0") != "0"
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+log = logging.getLogger("history_agent.metrics")
+
+
+class Registry:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._hist: dict[tuple, list] = {}      # (name, labels) -> [count per bucket..., +Inf, sum]
+        self._counters: dict[tuple, float] = {}  # (name, labels) -> value
+        self._collectors: list = []              # fn() -> iterable of (name, labels dict, value), read at scrape
+
+    def observe(self, name: str, seconds: float, labels: dict) -> None:
+        key = (name, _labels(labels))
+        with self._lock:
+            h = self._hist.get(key)
+            if h is None:
+                h = self._hist[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, le in enumerate(self.buckets):
+                if seconds <= le:
+                    h[i] += 1
+                    break
+            else:
+                h[len(self.buckets)] += 1
+            h[-1] += seconds
+
+    def inc(self, name: str, value: float = 1, labels: dict | None = None) -> None:
+        key = (name, _labels(labels or {}))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def collect(self, fn) -> None:
+        """Register a gauge source; exceptions at scrape time just drop its samples."""
+        self._collectors.append(fn)
+
+    def render(self) -> str:
+        """Prometheus text exposition (format 0.0.4)."""
+        with self._lock:
+            hist = {k: list(v) for k, v in self._hist.items()}
+            counters = dict(self._counters)
+        out, typed = [], set()
+
+        def head(name, kind):
+            if name not in typed:
+                typed.add(name)
+                out.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), h in sorted(hist.items()):
+            head(PREFIX + name, "histogram")
+            running = 0
+            for le, n in zip((*self.buckets, "+Inf"), h[:-1]):
+                running += n
+                out.append(f"{PREFIX}{name}_bucket{_fmt(labels + (('le', str(le)),))} {running}")
+            out.append(f"{PREFIX}{name}_sum{_fmt(labels)} {h[-1]:.6f}")
+            out.append(f"{PREFIX}{name}_count{_fmt(labels)} {running}")
+        for (name, labels), value in sorted(counters.items()):
+            head(PREFIX + name, "counter")
+            out.append(f"{PREFIX}{name}{_fmt(labels)} {value:g}")
+        gauges = []
+        for fn in self._collectors:
+            try:
+                gauges += list(fn())
+            except Exception:
+                continue
+        for name, labels, value in sorted(gauges, key=lambda g: g[0]):   # a family's samples must be adjacent
+            head(PREFIX + name, "gauge")
+            out.append(f"{PREFIX}{name}{_fmt(_labels(labels))} {float(value):g}")
+        return "\n".join(out) + "\n"
+
+
+REGISTRY = Registry()
+
+
+@contextmanager
+def span(name: str, **labels):
+    """Time the block into `<name>_seconds`; the yielded dict can set labels (e.g. outcome="hit") before it ends."""
+    t0 = time.perf_counter()
+    try:
+        yield labels
+    except BaseException:
+        labels.setdefault("outcome", "error")
+        raise
+    finally:
+        seconds = time.perf_counter() - t0
+        labels.setdefault("outcome", "ok")
+        REGISTRY.observe(f"{name}_seconds", seconds, labels)
+        if METRICS_LOG:
+            log.info(json.dumps({"span": name, "seconds": round(seconds, 4), **labels}, ensure_ascii=False))
+
+
+def inc(name: str, value: float = 1, **labels) -> None:
+    REGISTRY.inc(name, value, labels)
+
+
+def timed(name: str = "tool", **labels):
+    """Decorator: span(name, tool=<function name>) around every call; keeps coroutine functions async."""
+    def wrap(fn):
+        tags = {"tool": fn.__name__, **labels}
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def run_async(*args, **kwargs):
+                with span(name, **tags):
+                    return await fn(*args, **kwargs)
+            return run_async
+
+        @functools.wraps(fn)
+        def run(*args, **kwargs):
+            with span(name, **tags):
+                return fn(*args, **kwargs)
+        return run
+    return wrap
+
+
+def _labels(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _fmt(labels: tuple) -> str:
+    if not labels:
+        return ""
+    esc = lambda v: v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in labels) + "}"
@@ -0,0 +1,286 @@
+import os
+
+from google.genai import types
+
+from .persona_profile import Profile
+from .profile_store import normalize_name, profile_store
+
+
+# --- PERSONA PLUMBING (shared by tools.py and async_tools.py) -----------------
+# Cache access, generation configs and prompts, and session persona state for
+# the text tools. Nothing here waits on a model: tools.py calls it directly,
+# async_tools.py from the loop (state) or through asyncio.to_thread (stores).
+
+def cached_profile(person_name: str) -> Profile | None:
+    # Repeat lookups (by canonical name or any alias) skip the model round trip
+    cached = profile_store.get(person_name)
+    return Profile.from_dict(cached) if cached is not None else None
+
+
+def store_profile(person_name: str, text: str) -> "Profile | str":
+    """Parse + validate once; only the validated form is cached. Unparseable text is passed through as-is."""
+    profile = Profile.parse(text)
+    if profile is None:
+        return text
+    profile_store.put(person_name, profile.to_dict())
+    return profile
+
+
+def store_text(store, person_name: str, text: str) -> None:
+    store.put(person_name, text, names_of(person_name))
+
+
+def names_of(person_name: str) -> dict:
+    """Canonical name + aliases from the cached profile (when there is one), for keying the side caches."""
+    return profile_store.get(person_name) or {"canonical_name": person_name}
+
+
+def flight_name(person_name: str) -> str:
+    return normalize_name(person_name) or person_name
+
+
+# --- GENERATION PROFILES (per-tool thinking, output cap, temperature, schema) -
+# With default settings gemini-2.5-flash thinks before every answer and has no
+# output cap, which buys nothing for lookups whose answer shape is fixed. Each
+# text tool gets its own config: no thinking, a cap a little above its longest
+# valid answer, a temperature for its job (facts low, writing samples higher),
+# and for the profile and style sets a response_schema, so the model emits
+# JSON that always parses instead of following prose format rules (which are
+# then left out of the system instruction). GEN_PROFILES=0 restores the plain
+# default-config requests.
+
+GEN_PROFILES = os.getenv("GEN_PROFILES", "1") != "0"
+
+_STR = types.Schema(type=types.Type.STRING)
+_STRS = types.Schema(type=types.Type.ARRAY, items=_STR)
+_OPT_STR = types.Schema(type=types.Type.STRING, nullable=True)
+_YEAR = types.Schema(type=types.Type.INTEGER, nullable=True)
+
+
+def _object(required=(), **props) -> types.Schema:
+    return types.Schema(type=types.Type.OBJECT, properties=props, property_ordering=list(props),
+                        required=list(required or props))
+
+
+_PROFILE_SCHEMA = _object(
+    ("canonical_name", "aliases", "roles", "fields", "summary", "major_breakthroughs", "notable_works",
+     "key_quotes", "speaking_style", "controversies"),
+    canonical_name=_STR, aliases=_STRS, birth_year=_YEAR, death_year=_YEAR, age_at_death=_YEAR,
+    nationality=_OPT_STR, roles=_STRS, fields=_STRS, era=_OPT_STR, summary=_STR,
+    major_breakthroughs=types.Schema(type=types.Type.ARRAY, items=_object(("title", "summary"),
+                                                                          title=_STR, year=_YEAR, summary=_STR)),
+    notable_works=types.Schema(type=types.Type.ARRAY, items=_object(("title", "type"),
+                                                                    title=_STR, year=_YEAR, type=_STR)),
+    key_quotes=_STRS, speaking_style=_STRS, controversies=_STRS, disambiguation=_OPT_STR,
+)
+_STYLE_SCHEMA = _object(samples=types.Schema(type=types.Type.ARRAY, min_items=4, max_items=6,
+                                             items=_object(label=_STR, purpose=_STR, sample=_STR)))
+
+
+def _gen_config(temperature: float, max_output_tokens: int, schema: types.Schema | None = None) -> dict:
+    """GenerateContentConfig fields for one tool's requests (empty with GEN_PROFILES=0)."""
+    if not GEN_PROFILES:
+        return {}
+    config = {"temperature": temperature, "max_output_tokens": max_output_tokens,
+              "thinking_config": types.ThinkingConfig(thinking_budget=0)}
+    if schema is not None:
+        config.update(response_mime_type="application/json", response_schema=schema)
+    return config
+
+
+# caps: ~2x the longest answer the rules allow (a truncated JSON answer is a parse failure)
+DETAILS_CONFIG = _gen_config(0.2, 2048, _PROFILE_SCHEMA)
+STYLE_CONFIG = _gen_config(0.8, 2048, _STYLE_SCHEMA)
+ACCENT_CONFIG = _gen_config(0.4, 160)
+
+
+# Fixed rules/schema go in the system instruction, ahead of the short
+# per-figure request below, so the provider's implicit prefix caching can
+# reuse them across calls.
+DETAILS_RULES = """You are a factual profiler for historical figures.
+
+                Your job:
+                - Produce a concise, factual profile about the target person named in the request.
+                - Prefer widely accepted facts. If multiple candidates match, choose the most likely and note that in "disambiguation".
+                - Keep text snippets short and useful for role-play.
+                - Years must be integers when known; otherwise null.
+                - Limits: each text field ≤ 35 words; each quote ≤ 20 words; each summary ≤ 2 sentences.
+                - If unsure about a field, set it to null (or an empty list where appropriate).
+                """
+# how to write the dict when no response_schema constrains the output (GEN_PROFILES=0)
+DETAILS_FORMAT = """
+                STRICT OUTPUT RULES
+                - Return ONLY a valid Python dictionary literal (not JSON). No backticks, no prose, no prefixes/suffixes.
+                - Use single quotes for keys and strings.
+                - Use Python types: int, float, bool, None, list, dict (write null as None).
+
+                Output EXACTLY the following dictionary (keys in this order):
+
+                {
+                'canonical_name': <str>,
+                'aliases': <list[str]>,
+                'birth_year': <int|None>,
+                'death_year': <int|None>,
+                'age_at_death': <int|None>,  
+                'nationality': <str|None>,
+                'roles': <list[str]>,        
+                'fields': <list[str]>,       
+                'era': <str|None>,          
+                'summary': <str>,           
+                'major_breakthroughs': [    
+                    {
+                    'title': <str>,
+                    'year': <int|None>,
+                    'summary': <str>         
+                    }
+                ],
+                'notable_works': [           
+                    {
+                    'title': <str>,
+                    'year': <int|None>,
+                    'type': <str>            
+                    }
+                ],
+                'key_quotes': <list[str]>,   
+                'speaking_style': <list[str]>,  
+                'controversies': <list[str]>,   
+                'disambiguation': <str|None>,          
+                }
+
+                Example of the required return *style* (not the schema):
+                {'canonical_name':'Albert Einstein','age_at_death':76}  # This is only an illustration of Python dict form.
+                """
+DETAILS_SYSTEM = DETAILS_RULES if GEN_PROFILES else DETAILS_RULES + DETAILS_FORMAT
+
+
+def details_prompt(person_name: str) -> str:
+    return (
+        f"""Target person: "{person_name}"
+
+                Return only the profile described above, fully populated for "{person_name}".
+                """
+    )
+
+
+STYLE_RULES = """You create first-person writing samples for historical figures.
+
+    Goal:
+    - Provide 4–6 SHORT first-person samples in DISTINCT styles for the target person named in the request
+    - Be historically plausible; avoid modern slang and caricature.
+    - Do not copy long quotes verbatim; paraphrase if needed.
+    - Include at least one sample labeled 'polite-decline' that models a graceful, in-character refusal
+    with a brief context pivot and an inviting follow-up question.
+    - Each 'sample' must be 70–120 words, written in first person ('I').
+    - 'label' names the style (e.g., 'formal-lecture','personal-letter','public-speech','notebook-entry','interview-q&a','maxim').
+    - 'purpose' briefly states when to use that style.
+    """
+STYLE_FORMAT = """
+    STRICT OUTPUT RULES
+    - Return ONLY a valid Python dictionary literal with a single key 'samples'. No backticks or extra prose.
+    - Use single quotes for keys/strings. Use Python types.
+
+    Required shape:
+
+    {
+    'samples': [  # 4 to 6 first-person samples in distinct styles
+        { 'label': <str>, 'purpose': <str>, 'sample': <str> }
+    ]
+    }
+    """
+STYLE_SYSTEM = STYLE_RULES if GEN_PROFILES else STYLE_RULES + STYLE_FORMAT
+
+
+def style_prompt(person_name: str) -> str:
+    prompt = f"""Target person: "{person_name}"
+
+    Return only the writing samples for "{person_name}".
+    """
+    return prompt
+
+
+def accent_prompt(person_name: str) -> str:
+    prompt = f"""
+    You need to generate a single-line TTS delivery instruction for how this person would have spoke, person name: {person_name}.
+    You can use the person's nationality, region and era to decide what kind of voice this person could have.
+    
+    Rules:
+    - Output EXACTLY ONE LINE, no quotes, no extra text.
+    - Write in English, describing HOW to speak: accent, tone, tempo, pitch, enunciation, pausing, formality, rhetoric cues.
+    - Keep it precise and actionable; avoid modern slang unless era-appropriate.
+    - Do not mention these inputs or that this is an instruction; just give the delivery line.
+
+    Return only one line like:
+    "Speak in gently German-accented English with a measured tempo, slightly lowered pitch, precise enunciation, brief reflective pauses, formal register, and evidence-first phrasing."
+    """
+    return prompt
+
+
+# --- PERSONA BUNDLE (what get_persona collects from its parallel lookups) -----
+PERSONA_DEADLINE = 30.0  # seconds; slower parts are reported missing, not waited on
+
+
+def collect_bundle(person_name: str, parts: dict) -> dict:
+    """Assemble the bundle from finished/unfinished futures (thread futures or asyncio tasks)."""
+    bundle, missing = {"person_name": person_name}, {}
+    for name, fut in parts.items():
+        if not fut.done():
+            # keep running in the background: get_details still fills the profile cache
+            bundle[name] = ""
+            missing[name] = "timed out"
+        elif fut.exception() is not None:
+            bundle[name] = ""
+            missing[name] = f"{type(fut.exception()).__name__}: {fut.exception()}"
+        else:
+            bundle[name] = fut.result()
+    bundle["missing"] = missing
+    return bundle
+
+
+# --- SESSION PERSONA STATE ----------------------------------------------------
+# Once a figure is chosen, its bundle and resolved voice live in ADK session
+# state so follow-up turns reuse them instead of re-profiling:
+#   persona        -> {"names": [normalized name keys], "bundle": {...}}
+#   persona_name   -> canonical name (injected into the agent instruction)
+#   persona_voice  -> {"nationality", "gender", "voice_id", "region"}
+
+def active_persona(tool_context, person_name: str):
+    if tool_context is None:
+        return None
+    persona = tool_context.state.get("persona") or {}
+    if normalize_name(person_name) in (persona.get("names") or []):
+        return dict(persona.get("bundle") or {}, reused=True)
+    return None
+
+
+def remember_persona(tool_context, person_name: str, bundle: dict) -> None:
+    # only a fully fetched persona is pinned; a partial one is retried next turn
+    if tool_context is None or bundle.get("missing"):
+        return
+    profile = bundle.get("profile") if isinstance(bundle.get("profile"), dict) else {}
+    full = names_of(person_name)  # the projection may have dropped aliases; the cached profile has them all
+    canonical = full.get("canonical_name") or profile.get("canonical_name") or person_name
+    names = [person_name, canonical] + [a for a in (full.get("aliases") or []) if isinstance(a, str)]
+    tool_context.state["persona"] = {
+        "names": [k for k in dict.fromkeys(normalize_name(n) for n in names) if k],
+        "bundle": bundle,
+    }
+    tool_context.state["persona_name"] = canonical
+    tool_context.state["persona_voice"] = {"nationality": profile.get("nationality") or "", "gender": ""}
+
+
+def persona_voice(tool_context, nationality: str, gender: str) -> tuple[str, str, str]:
+    """Fill blank nationality/gender from the active persona; return a stored voice_id if it still applies."""
+    if tool_context is None:
+        return nationality, gender, ""
+    voice = tool_context.state.get("persona_voice") or {}
+    nationality = nationality or voice.get("nationality", "")
+    gender = gender or voice.get("gender", "")
+    same = (nationality, gender) == (voice.get("nationality", ""), voice.get("gender", ""))
+    return nationality, gender, (voice.get("voice_id", "") if same else "")
+
+
+def remember_voice(tool_context, nationality: str, gender: str, voice_id: str, region: str) -> None:
+    if tool_context is not None:
+        tool_context.state["persona_voice"] = {
+            "nationality": nationality, "gender": gender, "voice_id": voice_id, "region": region,
+        }
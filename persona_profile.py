@@ -0,0 +1,282 @@
+import json, os, re
+from dataclasses import asdict, dataclass, field, fields
+
+from .profile_store import normalize_name, parse_profile
+
+
+# --- TYPED PROFILE (parsed once, validated, projected per question) ----------
+# The profiler returns a Python-dict literal. It is parsed and checked against
+# the schema exactly once, when it comes back from the model; the cache keeps
+# that validated form. What the agent sees is a projection: identity and
+# speaking cues always, then the breakthroughs / works / quotes / controversies
+# that best match the user's question, until the token budget runs out.
+
+PROFILE_TOKEN_BUDGET = 400   # rough tokens per projected profile (~4 chars/token)
+
+# identity + voice cues every reply needs, in output order
+_CORE = ("canonical_name", "birth_year", "death_year", "age_at_death", "nationality", "era",
+         "roles", "fields", "summary", "speaking_style", "disambiguation")
+# optional sections: (base weight when the question doesn't point anywhere, question words that pull them in)
+_SECTIONS = {
+    "major_breakthroughs": (3.0, ("discover", "breakthrough", "invent", "theor", "research", "experiment", "prove",
+                                 "achiev", "contribut", "famous", "known for", "idea", "science")),
+    "notable_works": (2.0, ("book", "wrote", "writ", "work", "paint", "publi", "treatise", "poem", "compos",
+                            "built", "build", "design", "masterpiece", "art")),
+    "key_quotes": (1.0, ("quote", "say", "said", "saying", "motto", "word", "advice", "believ", "philosoph",
+                         "wisdom", "lesson")),
+    "controversies": (-1.0, ("controvers", "scandal", "critic", "accus", "regret", "mistake", "enem", "rival",
+                             "disput", "trial", "exile", "death", "die", "wrong")),
+}
+_STOPWORDS = frozenset("a an and are as at be but by did do does for from had has have how i in is it me my of on "
+                       "or so that the their them they this to was we were what when where which who why will with "
+                       "you your".split())
+
+
+class ProfileError(ValueError):
+    pass
+
+
+@dataclass(slots=True)
+class Breakthrough:
+    title: str
+    year: int | None = None
+    summary: str = ""
+
+
+@dataclass(slots=True)
+class Work:
+    title: str
+    year: int | None = None
+    type: str = ""
+
+
+@dataclass(slots=True)
+class Profile:
+    canonical_name: str
+    aliases: list[str] = field(default_factory=list)
+    birth_year: int | None = None
+    death_year: int | None = None
+    age_at_death: int | None = None
+    nationality: str | None = None
+    roles: list[str] = field(default_factory=list)
+    fields: list[str] = field(default_factory=list)
+    era: str | None = None
+    summary: str = ""
+    major_breakthroughs: list[Breakthrough] = field(default_factory=list)
+    notable_works: list[Work] = field(default_factory=list)
+    key_quotes: list[str] = field(default_factory=list)
+    speaking_style: list[str] = field(default_factory=list)
+    controversies: list[str] = field(default_factory=list)
+    disambiguation: str | None = None
+
+    @classmethod
+    def from_dict(cls, data) -> "Profile":
+        """Validate/coerce a profile dict; unknown keys are dropped, malformed values emptied."""
+        if not isinstance(data, dict):
+            raise ProfileError(f"profile must be a dict, got {type(data).__name__}")
+        name = _str(data.get("canonical_name"))
+        if not name:
+            raise ProfileError("profile has no canonical_name")
+        return cls(
+            canonical_name=name,
+            aliases=_strs(data.get("aliases")),
+            birth_year=_int(data.get("birth_year")),
+            death_year=_int(data.get("death_year")),
+            age_at_death=_int(data.get("age_at_death")),
+            nationality=_str(data.get("nationality")),
+            roles=_strs(data.get("roles")),
+            fields=_strs(data.get("fields")),
+            era=_str(data.get("era")),
+            summary=_str(data.get("summary")) or "",
+            major_breakthroughs=[Breakthrough(t, _int(d.get("year")), _str(d.get("summary")) or "")
+                                 for d, t in _titled(data.get("major_breakthroughs"))],
+            notable_works=[Work(t, _int(d.get("year")), _str(d.get("type")) or "")
+                           for d, t in _titled(data.get("notable_works"))],
+            key_quotes=_strs(data.get("key_quotes")),
+            speaking_style=_strs(data.get("speaking_style")),
+            controversies=_strs(data.get("controversies")),
+            disambiguation=_str(data.get("disambiguation")),
+        )
+
+    @classmethod
+    def parse(cls, text: str) -> "Profile | None":
+        """The model's dict literal -> Profile, or None if it is unparseable / fails validation."""
+        try:
+            return cls.from_dict(parse_profile(text))
+        except ProfileError:
+            return None
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    def names(self) -> list[str]:
+        return [self.canonical_name] + self.aliases
+
+    def project(self, question: str = "", budget: int = PROFILE_TOKEN_BUDGET) -> dict:
+        """Compact dict for the agent: core fields, then the sections/items most relevant to `question`."""
+        out = {k: v for k in _CORE if (v := getattr(self, k)) not in (None, "", [])}
+        used = _tokens(out)
+        words = _words(question)
+
+        picks = []
+        for section, (base, hints) in _SECTIONS.items():
+            items = getattr(self, section)
+            boost = 4.0 if _asks_about(question, words, hints) else 0.0
+            for rank, item in enumerate(items):
+                overlap = len(words & _words(_text(item)))
+                picks.append((base + boost + 2.0 * overlap - 0.25 * rank, section, rank, item))
+        picks.sort(key=lambda p: -p[0])
+
+        chosen: dict[str, list] = {}
+        for score, section, rank, item in picks:
+            if score <= 0:
+                continue  # controversies only when the question is about them
+            value = asdict(item) if hasattr(item, "__dataclass_fields__") else item
+            cost = _tokens(value) + 1
+            if used + cost > budget:
+                continue
+            chosen.setdefault(section, []).append((rank, value))
+            used += cost
+
+        omitted = []
+        for section in _SECTIONS:
+            if section in chosen:
+                out[section] = [v for _, v in sorted(chosen[section], key=lambda rv: rv[0])]
+            if len(chosen.get(section, ())) < len(getattr(self, section)):
+                omitted.append(section)
+        if omitted:
+            out["omitted"] = omitted  # ask get_persona again with a question to pull these in
+        return out
+
+
+
+# --- STYLE SAMPLES (full set cached, best one handed out per question) -------
+# The style prompt returns 4-6 samples of 70-120 words; passing all of them
+# costs up to ~700 words of input on every turn that carries the bundle. The
+# cache keeps the model's full set; per question a keyword score over each
+# sample's label and purpose picks the one that fits, and the agent gets that
+# plus the 'polite-decline' sample it needs for refusals. STYLE_SAMPLES=all
+# hands out every sample instead (best first).
+
+STYLE_SAMPLES = os.getenv("STYLE_SAMPLES", "top").strip().lower()   # top | all
+_DECLINE = ("decline", "refus")
+# style families: (words in a label / purpose that name the family, question words that call for it)
+_STYLE_FAMILIES = (
+    (("letter", "correspond", "personal", "intimate", "heartfelt"),
+     ("feel", "love", "miss", "family", "friend", "heart", "afraid", "fear", "lonel", "griev", "grief", "wife",
+      "husband", "mother", "father", "sister", "brother", "daughter", "child", "letter", "dear", "thank",
+      "personal")),
+    (("lecture", "explain", "teach", "lesson", "formal", "academ", "treatise"),
+     ("explain", "how", "why", "work", "theor", "science", "method", "teach", "understand", "mean", "differ",
+      "describe", "principle")),
+    (("speech", "address", "oration", "sermon", "rally", "public"),
+     ("inspire", "motivat", "encourag", "courage", "people", "nation", "future", "dream", "fight", "change",
+      "young", "generation", "world", "freedom")),
+    (("notebook", "journal", "diary", "note", "sketch", "log"),
+     ("idea", "experiment", "observ", "invent", "design", "process", "routine", "draft", "sketch", "notebook",
+      "plan", "daily")),
+    (("interview", "q&a", "dialogue", "conversation", "anecdote", "story", "memoir"),
+     ("tell", "story", "childhood", "life", "remember", "favourite", "favorite", "first", "meet", "moment",
+      "young")),
+    (("maxim", "aphorism", "motto", "quote", "proverb", "wisdom"),
+     ("quote", "saying", "motto", "wisdom", "lesson", "advice", "sum", "short", "line", "believ", "philosoph")),
+)
+
+
+@dataclass(slots=True)
+class StyleSample:
+    label: str
+    purpose: str
+    sample: str
+
+    @property
+    def declines(self) -> bool:
+        return any(d in self.label.casefold() for d in _DECLINE)
+
+
+@dataclass(slots=True)
+class StyleSet:
+    samples: list[StyleSample] = field(default_factory=list)
+
+    @classmethod
+    def parse(cls, text: str) -> "StyleSet | None":
+        """The model's {'samples': [...]} literal -> StyleSet, or None if it has no usable sample."""
+        data = parse_profile(text)
+        samples = [StyleSample(label, _str(d.get("purpose")) or "", sample)
+                   for d in (data or {}).get("samples") or ()
+                   if isinstance(d, dict) and (label := _str(d.get("label"))) and (sample := _str(d.get("sample")))]
+        return cls(samples) if samples else None
+
+    def ranked(self, question: str = "") -> list[StyleSample]:
+        """Non-decline samples, best fit for `question` first (the model's order breaks ties)."""
+        tokens = normalize_name(question).split()
+        words = _words(question)
+        asks = [sum(1 for t in tokens if t.startswith(hints)) for _, hints in _STYLE_FAMILIES]
+
+        def score(rank_sample):
+            rank, s = rank_sample
+            label, purpose = s.label.casefold(), s.purpose.casefold()
+            fit = sum((2.0 if any(n in label for n in names) else 1.0 if any(n in purpose for n in names) else 0.0)
+                      * ask for (names, _), ask in zip(_STYLE_FAMILIES, asks))
+            return fit + len(words & _words(s.purpose)) - 0.1 * rank
+
+        candidates = [s for s in self.samples if not s.declines]
+        return [s for _, s in sorted(enumerate(candidates), key=score, reverse=True)]
+
+    def project(self, question: str = "", mode: str = STYLE_SAMPLES) -> dict:
+        """{'samples': [best fit, polite-decline]} for the agent; 'other_labels' lists the styles left out."""
+        ranked = self.ranked(question)
+        decline = [s for s in self.samples if s.declines][:1]
+        if mode == "all":
+            return {"samples": [asdict(s) for s in ranked + decline]}
+        out = {"samples": [asdict(s) for s in ranked[:1] + decline]}
+        if ranked[1:]:
+            out["other_labels"] = [s.label for s in ranked[1:]]   # ask get_persona again with a question for another
+        return out
+
+
+def _str(v) -> str | None:
+    if not isinstance(v, str):
+        return None
+    return " ".join(v.split()) or None
+
+
+def _int(v) -> int | None:
+    if isinstance(v, bool):
+        return None
+    if isinstance(v, int):
+        return v
+    if isinstance(v, float) and v.is_integer():
+        return int(v)
+    if isinstance(v, str) and re.fullmatch(r"-?\d{1,4}", v.strip()):
+        return int(v)
+    return None
+
+
+def _strs(v) -> list[str]:
+    return [s for s in (_str(x) for x in v) if s] if isinstance(v, (list, tuple)) else []
+
+
+def _titled(v):
+    for d in v if isinstance(v, (list, tuple)) else ():
+        if isinstance(d, dict) and (title := _str(d.get("title"))):
+            yield d, title
+
+
+def _asks_about(question: str, words: set[str], hints) -> bool:
+    q = question.casefold()
+    return any((h in q) if " " in h else any(w.startswith(h) for w in words) for h in hints)
+
+
+def _text(item) -> str:
+    if isinstance(item, str):
+        return item
+    return " ".join(str(getattr(item, f.name)) for f in fields(item) if getattr(item, f.name) is not None)
+
+
+def _words(text: str) -> set[str]:
+    return {w for w in normalize_name(text).split() if len(w) > 2 and w not in _STOPWORDS}
+
+
+def _tokens(value) -> int:
+    return len(json.dumps(value, ensure_ascii=False)) // 4 + 1
@@ -0,0 +1,155 @@
+import asyncio, os, re, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import async_tools
+from .clients import getenv
+from .metrics import inc
+from .profile_store import normalize_name, profile_store
+from .upstream import LIMITS, speculative
+from .warmup import DEFAULT_FIGURES
+
+
+# --- SPECULATIVE PERSONA PREFETCH (start lookups from the user's message) ----
+# The agent only calls get_persona after a full model turn spent reading the
+# message. Before that turn starts, a gazetteer scans the message for a figure
+# we know by name and starts the profile, style and delivery-line lookups, so
+# the tool call joins a request already in flight (or finds it cached).
+# Known names are the cached canonical names + aliases, the figures the
+# opening message suggests, and an optional PREFETCH_GAZETTEER file (one name
+# per line). The name index is rebuilt on a background thread (it reads the
+# profile store: a JSON file, or SQLite in multi-worker mode), so a message is
+# matched against the last snapshot and never waits on disk. Speculation only
+# starts while the Gemini bucket has tokens to spare, runs at background
+# priority (raised to interactive once a tool call joins it), and a session's
+# next message cancels whatever its last speculation is still waiting on.
+# PREFETCH=0 disables it.
+
+PREFETCH = os.getenv("PREFETCH", "1") != "0"
+MIN_NAME_CHARS = 4        # shorter aliases ("Ra", "Ali") match too much ordinary text
+MAX_FIGURES = 2           # figures speculated on per message
+CALLS_PER_FIGURE = 3      # profile, style, delivery line: Gemini calls one figure can cost
+HEADROOM = 1              # bucket tokens always left for interactive calls
+REFRESH = 30.0            # seconds between rebuilds when the local name index hasn't changed
+
+_REBUILD = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gazetteer")
+
+
+class Gazetteer:
+    """Known figure names compiled into one word-boundary regex (longest first), rebuilt as the cache grows."""
+
+    def __init__(self, seeds=(), store=profile_store):
+        self.store = store
+        self._seeds = {normalize_name(n): n for n in seeds if normalize_name(n)}
+        self._lock = threading.Lock()
+        self._version = None
+        self._built_at = 0.0
+        self._rebuilding = False
+        self._names, self._pattern = _compile(self._seeds)   # name key -> name to look up; seeds need no I/O
+
+    def find(self, text: str) -> list[str]:
+        """Figures named in `text`, in order of first mention (against the current snapshot; see _refresh)."""
+        self._refresh()
+        with self._lock:
+            pattern, names = self._pattern, self._names
+        if pattern is None:
+            return []
+        found = {}
+        for m in pattern.finditer(normalize_name(text)):
+            name = names[m.group(0)]
+            found.setdefault(normalize_name(name), name)   # "Marie Curie ... Curie" is one figure
+        return list(found.values())
+
+    def _refresh(self) -> None:
+        """Start a background rebuild if the name index changed or the snapshot is old; never waits for it."""
+        with self._lock:
+            if self._rebuilding or (self.store.version == self._version
+                                    and time.monotonic() - self._built_at < REFRESH):
+                return
+            self._rebuilding = True
+        _REBUILD.submit(self._rebuild)
+
+    def _rebuild(self) -> None:
+        try:
+            version = self.store.version
+            names = dict(self._seeds)
+            for alias, ckey in self.store.names().items():
+                names.setdefault(alias, ckey)   # the canonical key: same flight key as the tool's call
+            names, pattern = _compile(names)
+            with self._lock:
+                self._names, self._pattern = names, pattern
+                self._version, self._built_at = version, time.monotonic()
+        finally:
+            with self._lock:
+                self._rebuilding = False
+
+
+def _compile(names: dict) -> tuple[dict, "re.Pattern | None"]:
+    names = {k: v for k, v in names.items() if len(k) >= MIN_NAME_CHARS}
+    terms = sorted(names, key=len, reverse=True)
+    pattern = re.compile(r"(?<!\w)(?:" + "|".join(re.escape(t) for t in terms) + r")(?!\w)") if terms else None
+    return names, pattern
+
+
+class Prefetcher:
+    def __init__(self, gazetteer: Gazetteer):
+        self.gazetteer = gazetteer
+        self._running: dict[str, asyncio.Task] = {}   # session id -> its speculation
+
+    def on_message(self, session_id: str, text: str, active_names=()) -> list[str]:
+        """Speculate on the figures `text` names (other than the active persona); returns the names started."""
+        self.cancel(session_id)
+        active = set(active_names)
+        names = [n for n in self.gazetteer.find(text) if normalize_name(n) not in active][:MAX_FIGURES]
+        if not names:
+            return []
+        if LIMITS["gemini"].spare() < CALLS_PER_FIGURE * len(names) + HEADROOM:
+            inc("prefetch_total", outcome="skipped")
+            return []
+        task = asyncio.ensure_future(self._fetch(names))
+        self._running[session_id] = task
+        task.add_done_callback(lambda t: self._running.pop(session_id, None) if self._running.get(session_id) is t
+                               else None)
+        inc("prefetch_total", value=len(names), outcome="started")
+        return names
+
+    def cancel(self, session_id: str) -> None:
+        """Stop waiting on the session's speculation; lookups nobody else is waiting on are cancelled."""
+        task = self._running.pop(session_id, None)
+        if task is not None and not task.done():
+            task.cancel()
+            inc("prefetch_total", outcome="cancelled")
+
+    @staticmethod
+    async def _fetch(names: list[str]) -> None:
+        # the undecorated tools: speculation stays out of the per-tool latency histograms
+        lookups = (async_tools.get_details.__wrapped__, async_tools.get_voice_style.__wrapped__,
+                   async_tools.get_voice_accent.__wrapped__)
+        with speculative():
+            await asyncio.gather(*(fn(name) for name in names for fn in lookups), return_exceptions=True)
+
+
+def _seeds() -> list[str]:
+    seeds = [spec.partition(":")[0].strip() for spec in DEFAULT_FIGURES]
+    path = getenv("PREFETCH_GAZETTEER")
+    if path:
+        try:
+            with open(path, encoding="utf-8") as fh:
+                seeds += [line.strip() for line in fh if line.strip() and not line.startswith("#")]
+        except OSError:
+            pass
+    return seeds
+
+
+prefetcher = Prefetcher(Gazetteer(_seeds()))
+
+
+def prefetch_persona(callback_context):
+    """before_agent_callback: speculate on the figure the incoming message names; never changes the turn."""
+    content = callback_context.user_content
+    if not PREFETCH or content is None:
+        return None
+    text = " ".join(p.text for p in content.parts or [] if getattr(p, "text", None))
+    if text:
+        persona = callback_context.state.get("persona") or {}
+        prefetcher.on_message(callback_context.session.id, text, persona.get("names") or ())
+    return None
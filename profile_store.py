@@ -0,0 +1,232 @@
+import ast, json, os, re, sqlite3, tempfile, threading, time, unicodedata
+from collections import OrderedDict
+from pathlib import Path
+
+from .metrics import inc, span
+from .shared_db import shared_db
+
+
+# --- PROFILE STORE (disk-backed, TTL + LRU, alias-aware) ---------------------
+# Profiles are keyed on their 'canonical_name'; every alias and every name we
+# were asked for points at that entry, so "Einstein", "albert einstein" and
+# "Albert Einstein" all land on the same cached profile.
+# In multi-worker mode (shared_db) the SQLite file replaces the JSON one, so a
+# figure fetched by one worker is a cache hit in every other.
+
+_CACHE_DIR = Path(tempfile.gettempdir()) / "history_agent_cache"
+PROFILE_TTL = 7 * 24 * 3600   # seconds a profile stays fresh
+PROFILE_MAX_ENTRIES = 500     # LRU bound (our traffic mostly hits ~200 figures)
+
+
+def normalize_name(name: str) -> str:
+    """Case/accent/punctuation-insensitive key: 'Ibn Sīnā' -> 'ibn sina'."""
+    s = unicodedata.normalize("NFKD", name or "")
+    s = "".join(ch for ch in s if not unicodedata.combining(ch))
+    s = re.sub(r"[^\w]+", " ", s.casefold())
+    return " ".join(s.split())
+
+
+def parse_profile(text: str):
+    """Parse the model's JSON object or Python-dict literal (tolerating ``` fences); None if unparseable."""
+    s = (text or "").strip()
+    if s.startswith("```"):
+        s = s.split("\n", 1)[1] if "\n" in s else ""
+        s = s.rsplit("```", 1)[0]
+    try:
+        data = json.loads(s)   # schema-constrained output; entries cached before that are dict literals
+    except (ValueError, RecursionError):
+        try:
+            data = ast.literal_eval(s.strip())
+        except (ValueError, SyntaxError, MemoryError, RecursionError):
+            return None
+    return data if isinstance(data, dict) else None
+
+
+class ProfileStore:
+    """
+    Small LRU map canonical_key -> value (validated profile dict, or plain text
+    for the side caches), with an alias index in front.
+    Reads are served from memory; the JSON file on disk is rewritten atomically
+    on every put/evict so a restarted process starts warm. With a SharedDB
+    the entries are written there instead and memory misses fall through to it.
+    """
+
+    def __init__(self, path: Path, ttl: float = PROFILE_TTL, max_entries: int = PROFILE_MAX_ENTRIES, db=None):
+        self.path = Path(path)
+        self.db = db
+        self.kind = self.path.stem                                # this store's rows in the shared db
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()  # canonical_key -> entry
+        self._aliases: dict[str, str] = {}                        # name_key -> canonical_key
+        self._loaded = False                                      # disk is read on first use, not at import
+        self.version = 0                                          # bumped whenever the name index changes
+
+    # -- public API --------------------------------------------------------
+    def get(self, name: str):
+        with span("cache_lookup", cache=self.kind) as s:
+            value = self._get(name)
+            s["outcome"] = "miss" if value is None else "hit"
+        inc("cache_misses_total" if value is None else "cache_hits_total", cache=self.kind)
+        return value
+
+    def _get(self, name: str):
+        key = normalize_name(name)
+        now = time.time()
+        with self._lock:
+            self._ensure_loaded()
+            ckey = self._aliases.get(key)
+            entry = self._entries.get(ckey) if ckey else None
+            if entry is None and self.db is not None:
+                ckey, entry = self._fetch_shared(key)
+            if entry is None:
+                return None
+            if now - entry["ts"] > self.ttl:
+                self._drop(ckey)
+                return None
+            entry["atime"] = now
+            self._entries.move_to_end(ckey)
+            return entry["value"]
+
+    def put(self, name: str, value, profile: dict | None = None) -> bool:
+        """Cache `value` under the profile's canonical name + aliases (`profile` defaults to the value itself)."""
+        if profile is None:
+            profile = value if isinstance(value, dict) else parse_profile(value)
+        if not profile:
+            return False
+        names = [name, profile.get("canonical_name") or name]
+        names += [a for a in (profile.get("aliases") or []) if isinstance(a, str)]
+        keys = [k for k in dict.fromkeys(normalize_name(n) for n in names) if k]
+        if not keys:
+            return False
+        ckey = normalize_name(profile.get("canonical_name") or "") or keys[0]
+        now = time.time()
+        with self._lock:
+            self._ensure_loaded()
+            self._remember(ckey, {"value": value, "ts": now, "atime": now, "names": keys})
+            if self.db is not None:
+                self._put_shared(ckey, self._entries[ckey])
+            else:
+                self._save()
+        return True
+
+    def names(self) -> dict[str, str]:
+        """Every cached name/alias key -> its canonical key (every worker's, with a shared db)."""
+        with self._lock:
+            self._ensure_loaded()
+            names = dict(self._aliases)
+        if self.db is not None:
+            try:
+                names.update(self.db.query("SELECT name, ckey FROM aliases WHERE store = ?", (self.kind,)))
+            except sqlite3.Error:
+                pass
+        return names
+
+    def clear(self) -> None:
+        with self._lock:
+            self._loaded = True
+            self._entries.clear()
+            self._aliases.clear()
+            self.version += 1
+            if self.db is None:
+                self._save()
+                return
+            try:
+                with self.db.tx() as c:
+                    c.execute("DELETE FROM entries WHERE store = ?", (self.kind,))
+                    c.execute("DELETE FROM aliases WHERE store = ?", (self.kind,))
+            except sqlite3.Error:
+                pass
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    # -- internals (call with lock held) -----------------------------------
+    def _remember(self, ckey: str, entry: dict) -> None:
+        if ckey in self._entries:
+            self._drop(ckey)
+        self._entries[ckey] = entry
+        for k in entry["names"]:
+            self._aliases[k] = ckey
+        self.version += 1
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, ckey: str) -> None:
+        entry = self._entries.pop(ckey, None)
+        for k in (entry or {}).get("names", []):
+            if self._aliases.get(k) == ckey:
+                del self._aliases[k]
+        self.version += 1
+
+    def _ensure_loaded(self) -> None:
+        if not self._loaded:
+            self._loaded = True
+            if self.db is None:
+                self._load()
+
+    def _load(self) -> None:
+        try:
+            raw = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        items = [(k, e) for k, e in (raw.get("entries") or {}).items()
+                 if isinstance(e, dict) and "value" in e and now - e.get("ts", 0) <= self.ttl]
+        for ckey, entry in sorted(items, key=lambda kv: kv[1].get("atime", 0))[-self.max_entries:]:
+            self._entries[ckey] = entry
+            for k in entry.get("names", []):
+                self._aliases[k] = ckey
+
+    def _save(self) -> None:
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(f".{os.getpid()}.tmp")
+            tmp.write_text(json.dumps({"entries": self._entries}, ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp, self.path)
+        except OSError:
+            pass  # the cache is an optimisation; never fail a tool call over it
+
+    # -- shared db (multi-worker) ------------------------------------------
+    def _fetch_shared(self, key: str):
+        """(ckey, entry) another worker stored under this name, now also held in memory; (None, None) if none."""
+        try:
+            rows = self.db.query("SELECT e.ckey, e.value, e.ts, e.names FROM aliases a JOIN entries e"
+                                 " ON e.store = a.store AND e.ckey = a.ckey WHERE a.store = ? AND a.name = ?",
+                                 (self.kind, key))
+            if not rows:
+                return None, None
+            ckey, value, ts, names = rows[0]
+            now = time.time()
+            with self.db.tx() as c:   # keeps the shared LRU order honest
+                c.execute("UPDATE entries SET atime = ? WHERE store = ? AND ckey = ?", (now, self.kind, ckey))
+        except sqlite3.Error:
+            return None, None
+        self._remember(ckey, {"value": json.loads(value), "ts": ts, "atime": now, "names": json.loads(names)})
+        return ckey, self._entries[ckey]
+
+    def _put_shared(self, ckey: str, entry: dict) -> None:
+        try:
+            with self.db.tx() as c:
+                c.execute("DELETE FROM aliases WHERE store = ? AND ckey = ?", (self.kind, ckey))
+                c.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                          (self.kind, ckey, json.dumps(entry["value"], ensure_ascii=False),
+                           entry["ts"], entry["atime"], json.dumps(entry["names"])))
+                c.executemany("INSERT OR REPLACE INTO aliases VALUES (?, ?, ?)",
+                              [(self.kind, k, ckey) for k in entry["names"]])
+                # same LRU bound as in memory, counted across every worker
+                trimmed = c.execute("DELETE FROM entries WHERE store = ? AND ckey IN (SELECT ckey FROM entries"
+                                    " WHERE store = ? ORDER BY atime DESC LIMIT -1 OFFSET ?)",
+                                    (self.kind, self.kind, self.max_entries)).rowcount
+                if trimmed:
+                    c.execute("DELETE FROM aliases WHERE store = ? AND ckey NOT IN"
+                              " (SELECT ckey FROM entries WHERE store = ?)", (self.kind, self.kind))
+        except sqlite3.Error:
+            pass
+
+
+profile_store = ProfileStore(_CACHE_DIR / "profiles.json", db=shared_db)
+# style samples and delivery lines, keyed on the same names as the profile
+style_store = ProfileStore(_CACHE_DIR / "styles.json", db=shared_db)
+accent_store = ProfileStore(_CACHE_DIR / "accents.json", db=shared_db)
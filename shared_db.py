@@ -0,0 +1,76 @@
+import os, sqlite3, tempfile, threading
+from contextlib import contextmanager
+from pathlib import Path
+
+
+# --- SHARED STATE (multi-worker mode) ----------------------------------------
+# With MULTI_WORKER=1 several worker processes on one node share what used to
+# be per-process state: profile/style/accent entries and the clip index with
+# its session pins live in one SQLite file in WAL mode, so readers never block
+# the single writer and every write is a short BEGIN IMMEDIATE transaction
+# (SQLite's own file lock serializes writers across processes). One worker
+# binds AUDIO_PORT and serves the shared audio folder for everyone; see
+# tts_common.ensure_audio_server and audio_stream's spool files.
+
+MULTI_WORKER = os.getenv("MULTI_WORKER", "0") != "0"
+SHARED_DB_PATH = Path(os.getenv("SHARED_DB") or Path(tempfile.gettempdir()) / "history_agent_cache" / "shared.db")
+BUSY_TIMEOUT = 5.0   # seconds a writer waits for another process's transaction
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    store TEXT NOT NULL, ckey TEXT NOT NULL, value TEXT NOT NULL,
+    ts REAL NOT NULL, atime REAL NOT NULL, names TEXT NOT NULL,
+    PRIMARY KEY (store, ckey));
+CREATE TABLE IF NOT EXISTS aliases (
+    store TEXT NOT NULL, name TEXT NOT NULL, ckey TEXT NOT NULL,
+    PRIMARY KEY (store, name));
+CREATE TABLE IF NOT EXISTS clips (
+    name TEXT PRIMARY KEY, size INTEGER NOT NULL, atime REAL NOT NULL, engine TEXT NOT NULL DEFAULT '');
+CREATE INDEX IF NOT EXISTS clips_atime ON clips (atime);
+CREATE TABLE IF NOT EXISTS pins (
+    session TEXT NOT NULL, name TEXT NOT NULL, seen REAL NOT NULL,
+    PRIMARY KEY (session, name));
+"""
+
+
+class SharedDB:
+    """One SQLite connection per thread on a WAL-mode file; opened on first use."""
+
+    def __init__(self, path: Path = SHARED_DB_PATH):
+        self.path = Path(path)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._ready = False
+
+    def conn(self) -> sqlite3.Connection:
+        c = getattr(self._local, "conn", None)
+        if c is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # autocommit; transactions are explicit (tx below)
+            c = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+            c.execute("PRAGMA journal_mode=WAL")
+            c.execute("PRAGMA synchronous=NORMAL")   # durable at checkpoints; a cache can lose the last write
+            with self._lock:
+                if not self._ready:
+                    c.executescript(_SCHEMA)
+                    self._ready = True
+            self._local.conn = c
+        return c
+
+    @contextmanager
+    def tx(self):
+        """Write transaction; takes the database write lock up front so it can't fail halfway on a busy upgrade."""
+        c = self.conn()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            yield c
+        except BaseException:
+            c.execute("ROLLBACK")
+            raise
+        c.execute("COMMIT")
+
+    def query(self, sql: str, args=()) -> list:
+        return self.conn().execute(sql, args).fetchall()
+
+
+shared_db = SharedDB() if MULTI_WORKER else None
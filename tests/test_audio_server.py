@@ -0,0 +1,56 @@
+import pytest
+
+from ..audio_server import _parse_range
+
+
+# _parse_range(value, size): (start, end) to serve, () to ignore the header, None for a 416
+
+@pytest.mark.parametrize("value, expected", [
+    ("bytes=0-9", (0, 9)),
+    ("bytes=10-10", (10, 10)),
+    (" bytes=0-0 ", (0, 0)),
+    ("bytes=90-1000", (90, 99)),      # end past the last byte is clamped
+])
+def test_closed_range(value, expected):
+    assert _parse_range(value, 100) == expected
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("bytes=-10", (90, 99)),          # the last 10 bytes
+    ("bytes=-1", (99, 99)),
+    ("bytes=-500", (0, 99)),          # longer than the clip: the whole clip
+])
+def test_suffix_range(value, expected):
+    assert _parse_range(value, 100) == expected
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("bytes=0-", (0, 99)),
+    ("bytes=95-", (95, 99)),
+    ("bytes=99-", (99, 99)),
+])
+def test_open_ended_range(value, expected):
+    assert _parse_range(value, 100) == expected
+
+
+@pytest.mark.parametrize("value, size", [
+    ("bytes=100-", 100),              # starts at the size
+    ("bytes=150-200", 100),
+    ("bytes=5-2", 100),               # end before start
+    ("bytes=-0", 100),                # empty suffix
+    ("bytes=-10", 0),                 # nothing to serve
+    ("bytes=0-", 0),
+])
+def test_unsatisfiable(value, size):
+    assert _parse_range(value, size) is None
+
+
+@pytest.mark.parametrize("value", [
+    "bytes=-",
+    "bytes=0-1,5-6",                  # multi-range: served whole
+    "items=0-9",
+    "bytes=a-b",
+    "",
+])
+def test_ignored(value):
+    assert _parse_range(value, 100) == ()
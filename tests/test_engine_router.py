@@ -0,0 +1,94 @@
+import pytest
+
+from .. import engine_router
+from ..engine_router import COOL_DOWN, CONSECUTIVE_OPEN, MIN_SAMPLES, EngineHealth
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(engine_router, "time", clock)
+    return clock
+
+
+def _tripped(clock) -> EngineHealth:
+    """A breaker opened by a failure streak at clock.now."""
+    health = EngineHealth("vendor")
+    for _ in range(CONSECUTIVE_OPEN):
+        health.record(1.0, False)
+    return health
+
+
+def test_failure_streak_opens(clock):
+    health = EngineHealth("vendor")
+    for _ in range(CONSECUTIVE_OPEN - 1):
+        health.record(1.0, False)
+    assert health.allow() and health.is_closed()
+    health.record(1.0, False)
+    assert health.snapshot()["state"] == "open"
+    assert not health.allow()
+
+
+def test_success_resets_streak(clock, monkeypatch):
+    monkeypatch.setattr(engine_router, "MIN_SAMPLES", 100)   # streak only
+    health = EngineHealth("vendor")
+    for _ in range(3):
+        for _ in range(CONSECUTIVE_OPEN - 1):
+            health.record(1.0, False)
+        health.record(1.0, True)
+    assert health.is_closed()
+
+
+def test_error_rate_opens_only_with_enough_samples(clock):
+    health = EngineHealth("vendor")
+    for ok in (False, True, False):
+        health.record(1.0, ok)
+    assert health.is_closed()                       # 2/3 failed, but under MIN_SAMPLES
+    for _ in range(MIN_SAMPLES - 3):
+        health.record(1.0, True)
+    assert health.is_closed()                       # 2/5 failed
+    health.record(1.0, False)
+    assert health.is_closed()                       # 3/6: at the line, not over it
+    health.record(1.0, False)
+    assert health.snapshot()["state"] == "open"     # 4/7, with a streak of only 2
+
+
+def test_half_open_after_cool_down(clock):
+    health = _tripped(clock)
+    clock.now += COOL_DOWN - 1
+    assert not health.allow()
+    clock.now += 1
+    assert health.allow()                           # the probe
+    assert health.snapshot()["state"] == "half-open"
+    assert not health.allow()                       # one probe at a time
+    assert not health.is_closed()                   # not a hedge target either
+
+
+def test_probe_success_closes(clock):
+    health = _tripped(clock)
+    clock.now += COOL_DOWN
+    assert health.allow()
+    health.record(0.5, True)
+    assert health.snapshot()["state"] == "closed"
+    assert health.allow() and health.allow()
+
+
+def test_probe_failure_reopens(clock):
+    health = _tripped(clock)
+    clock.now += COOL_DOWN
+    assert health.allow()
+    health.record(0.5, False)
+    assert health.snapshot()["state"] == "open"
+    assert not health.allow()
+    clock.now += COOL_DOWN - 1                      # the cool-down restarts at the failed probe
+    assert not health.allow()
+    clock.now += 1
+    assert health.allow()
@@ -0,0 +1,85 @@
+import json
+
+import pytest
+
+from ..persona_profile import Breakthrough, Profile, StyleSet, Work
+
+
+def test_coerces_values():
+    profile = Profile.parse(repr({
+        "canonical_name": "  Marie   Curie ",
+        "birth_year": "1867",
+        "death_year": 1934.0,
+        "age_at_death": True,                     # a bool is not a year
+        "nationality": "Polish-French",
+        "era": "",
+        "summary": "Physicist\n and chemist.",
+        "aliases": ["Maria Skłodowska", 3, "", None, "  Madame Curie "],
+    }))
+    assert profile.canonical_name == "Marie Curie"
+    assert (profile.birth_year, profile.death_year, profile.age_at_death) == (1867, 1934, None)
+    assert profile.era is None
+    assert profile.summary == "Physicist and chemist."
+    assert profile.aliases == ["Maria Skłodowska", "Madame Curie"]
+
+
+@pytest.mark.parametrize("year", ["c. 1500", "1500s", 1500.5, "12345", [1500], None])
+def test_unusable_years_become_none(year):
+    assert Profile.parse(repr({"canonical_name": "Leonardo da Vinci", "birth_year": year})).birth_year is None
+
+
+def test_drops_malformed_entries():
+    profile = Profile.parse(json.dumps({
+        "canonical_name": "Marie Curie",
+        "major_breakthroughs": [
+            {"title": "Polonium", "year": "1898"},
+            {"summary": "no title"},
+            {"title": "   ", "year": 1898},
+            "radium",
+        ],
+        "notable_works": [{"title": "Traité de radioactivité", "year": 1910, "type": 3}, None],
+        "key_quotes": "not a list",
+        "roles": ["physicist", {"role": "chemist"}],
+        "favourite_colour": "blue",
+    }))
+    assert profile.major_breakthroughs == [Breakthrough("Polonium", 1898, "")]
+    assert profile.notable_works == [Work("Traité de radioactivité", 1910, "")]
+    assert profile.key_quotes == []
+    assert profile.roles == ["physicist"]
+    assert "favourite_colour" not in profile.to_dict()
+
+
+def test_json_and_dict_literal_agree():
+    data = {"canonical_name": "Ada Lovelace", "birth_year": 1815, "death_year": None, "aliases": ["Ada King"]}
+    fenced = f"```json\n{json.dumps(data)}\n```"
+    assert Profile.parse(json.dumps(data)) == Profile.parse(repr(data)) == Profile.parse(fenced)
+    assert Profile.parse(json.dumps(data)).death_year is None
+
+
+@pytest.mark.parametrize("text", [
+    "",
+    "not a profile",
+    "['Ada Lovelace']",
+    "{'canonical_name': None}",
+    "{'canonical_name': '   '}",
+    "{'birth_year': 1815}",
+    "{'canonical_name': 'Ada Lovelace',",
+])
+def test_rejects_unusable_text(text):
+    assert Profile.parse(text) is None
+
+
+def test_round_trips_through_cache_form():
+    profile = Profile.parse(repr({"canonical_name": "Ada Lovelace", "major_breakthroughs": [{"title": "Note G"}]}))
+    assert Profile.from_dict(profile.to_dict()) == profile
+
+
+def test_style_set_drops_incomplete_samples():
+    styles = StyleSet.parse(repr({"samples": [
+        {"label": "formal-lecture", "purpose": "teaching", "sample": "I shall begin."},
+        {"label": "maxim", "sample": ""},
+        {"purpose": "no label", "sample": "I am here."},
+        "junk",
+    ]}))
+    assert [s.label for s in styles.samples] == ["formal-lecture"]
+    assert StyleSet.parse(repr({"samples": [{"label": "maxim"}]})) is None
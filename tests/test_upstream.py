@@ -0,0 +1,100 @@
+import asyncio, threading, time
+
+import pytest
+
+from ..upstream import SingleFlight
+
+
+class _Boom(Exception):
+    pass
+
+
+def test_joiner_gets_leader_error():
+    flight, started, release = SingleFlight(), threading.Event(), threading.Event()
+    calls, outcomes = [], []
+    error = _Boom("upstream down")
+
+    def fn():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        raise error
+
+    def caller():
+        try:
+            outcomes.append(flight.do("key", fn))
+        except _Boom as e:
+            outcomes.append(e)
+
+    threads = [threading.Thread(target=caller) for _ in range(3)]
+    threads[0].start()
+    assert started.wait(5)
+    for t in threads[1:]:
+        t.start()
+    time.sleep(0.1)   # let the joiners reach the shared call
+    release.set()
+    for t in threads:
+        t.join(5)
+
+    assert len(calls) == 1
+    assert outcomes == [error] * 3
+    assert len(flight) == 0
+
+
+def test_failed_key_runs_again():
+    flight = SingleFlight()
+
+    def fail():
+        raise _Boom()
+
+    with pytest.raises(_Boom):
+        flight.do("key", fail)
+    assert flight.do("key", lambda: 42) == 42   # the failure isn't cached
+
+
+def test_async_joiner_gets_leader_error():
+    async def main():
+        flight, release = SingleFlight(), asyncio.Event()
+        calls = []
+        error = _Boom("upstream down")
+
+        async def fn():
+            calls.append(1)
+            await release.wait()
+            raise error
+
+        callers = [asyncio.ensure_future(flight.do_async("key", fn)) for _ in range(3)]
+        await asyncio.sleep(0)
+        release.set()
+        outcomes = await asyncio.gather(*callers, return_exceptions=True)
+        assert len(calls) == 1
+        assert outcomes == [error] * 3
+        await asyncio.sleep(0)
+        assert len(flight) == 0
+        assert await flight.do_async("key", _answer) == 42   # the failure isn't cached
+
+    asyncio.run(main())
+
+
+def test_async_cancelled_joiner_leaves_call_running():
+    async def main():
+        flight, release = SingleFlight(), asyncio.Event()
+
+        async def fn():
+            await release.wait()
+            raise _Boom()
+
+        first = asyncio.ensure_future(flight.do_async("key", fn))
+        second = asyncio.ensure_future(flight.do_async("key", fn))
+        await asyncio.sleep(0)
+        first.cancel()
+        release.set()
+        with pytest.raises(_Boom):
+            await second
+        assert first.cancelled()
+
+    asyncio.run(main())
+
+
+async def _answer():
+    return 42
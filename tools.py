@@ -1,516 +1,469 @@
-from dotenv import load_dotenv
-from google import genai
 from google.genai import types
-import os
-import io, wave, uuid
-import os, threading, socket, time
-from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from google.adk.tools.tool_context import ToolContext
+import itertools, threading, time
 from pathlib import Path
-import tempfile
-import requests, hashlib
-
-
-def get_details(person_name: str):
-    load_dotenv() 
-    key = os.getenv("GOOGLE_API_KEY")
-    client = genai.Client(api_key=key)
-    response = client.models.generate_content(
-        model="gemini-2.5-flash",
-        contents=
-        f"""You are a factual profiler for historical figures.
-
-                Target person: "{person_name}"
-
-                Your job:
-                - Produce a concise, factual profile about the target.
-                - Prefer widely accepted facts. If multiple candidates match, choose the most likely and note that in "disambiguation".
-                - Keep text snippets short and useful for role-play.
-
-                STRICT OUTPUT RULES
-                - Return ONLY a valid Python dictionary literal (not JSON). No backticks, no prose, no prefixes/suffixes.
-                - Use single quotes for keys and strings.
-                - Use Python types: int, float, bool, None, list, dict.
-                - Years must be ints when known; otherwise use None.
-                - Limits: each text field ≤ 35 words; each quote ≤ 20 words; each summary ≤ 2 sentences.
-                - If unsure about a field, set it to None (or an empty list where appropriate).
-
-                Output EXACTLY the following dictionary (keys in this order):
-
-                {{
-                'canonical_name': <str>,
-                'aliases': <list[str]>,
-                'birth_year': <int|None>,
-                'death_year': <int|None>,
-                'age_at_death': <int|None>,  
-                'nationality': <str|None>,
-                'roles': <list[str]>,        
-                'fields': <list[str]>,       
-                'era': <str|None>,          
-                'summary': <str>,           
-                'major_breakthroughs': [    
-                    {{
-                    'title': <str>,
-                    'year': <int|None>,
-                    'summary': <str>         
-                    }}
-                ],
-                'notable_works': [           
-                    {{
-                    'title': <str>,
-                    'year': <int|None>,
-                    'type': <str>            
-                    }}
-                ],
-                'key_quotes': <list[str]>,   
-                'speaking_style': <list[str]>,  
-                'controversies': <list[str]>,   
-                'disambiguation': <str|None>,          
-                }}
-
-                Example of the required return *style* (not the schema):
-                {{'canonical_name':'Albert Einstein','age_at_death':76}}  # This is only an illustration of Python dict form.
-
-                Return only the dictionary described above, fully populated for "{person_name}".
-                """
-        
-    )
-    final_response = response.text.strip()
-    return final_response
+import requests, requests.adapters, contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
+from .profile_store import style_store, accent_store
+from .persona_profile import Profile, StyleSet
+from .voice_routing import voice_table
+from . import audio_codec
+from .engine_router import NoEngineAvailable
+from .local_tts import local_tts
+from .clients import genai_client
+from .upstream import LIMITS, flight, limited, submit
+from .metrics import inc, span, timed
+from .persona_common import (
+    ACCENT_CONFIG, DETAILS_CONFIG, DETAILS_SYSTEM, PERSONA_DEADLINE, STYLE_CONFIG, STYLE_SYSTEM, accent_prompt,
+    active_persona, cached_profile, collect_bundle, details_prompt, flight_name, remember_persona, store_profile,
+    store_text, style_prompt,
+)
+from .tts_common import (
+    AUDIO_DIR, ELEVEN_RETRIES, ELEVEN_RETRY_STATUS, GEMINI_TTS_MODEL, LOCAL_TTS_DRAFT_AFTER, TTS_ROUTER, TTS_STREAMING,
+    append_clip, audio_result, auto_candidates, cache_key, cached_head, clip_cache, eleven_call, finish_stream,
+    gemini_key, gemini_tts_config, label_fallback, local_key, local_voice, no_engine, pin_clip, publish_clip,
+    retry_after, retry_delay, save_head, split_sentences, stitch, stream_target, strip_id3, wav_bytes, wav_frames,
+    write_atomic,
+)
+from functools import partial
+
+
+@timed()
+def get_details(person_name: str, question: str = ""):
+    """Profile projected for `question` (dict), or the model's raw text if it could not be parsed."""
+    profile = cached_profile(person_name)
+    if profile is None:
+        # sessions asking for the same figure at the same moment share one model call
+        profile = flight.do(f"details:{flight_name(person_name)}", partial(_fetch_details, person_name))
+    return profile.project(question) if isinstance(profile, Profile) else profile
+
+
+@timed()
+def get_voice_style(person_name: str, question: str = ""):
+    """Style samples ranked for `question` (dict, see StyleSet.project), or the model's raw text if unparseable."""
+    text = _cached_text(style_store, "style", person_name, style_prompt, STYLE_SYSTEM, STYLE_CONFIG)
+    styles = StyleSet.parse(text)  # the full set stays cached; each question gets its own pick
+    return styles.project(question) if styles is not None else text
+
+@timed()
+def get_voice_accent(person_name: str):
+    return _cached_text(accent_store, "accent", person_name, accent_prompt, config=ACCENT_CONFIG)
 
 
-def get_voice_style(person_name:str):
-    load_dotenv() 
-    key = os.getenv("GOOGLE_API_KEY")
-    client = genai.Client(api_key=key)
-    schema = """
-    {
-    'samples': [  # 4 to 6 first-person samples in distinct styles
-        { 'label': <str>, 'purpose': <str>, 'sample': <str> }
-    ]
-    }
-    """.strip()
+def _fetch_details(person_name: str) -> "Profile | str":
+    cached = cached_profile(person_name)  # another caller may have just stored it
+    if cached is not None:
+        return cached
+    return store_profile(person_name, _generate_text(details_prompt(person_name), DETAILS_SYSTEM, DETAILS_CONFIG))
+
+
+def _cached_text(store, kind: str, person_name: str, prompt_fn, system: str | None = None,
+                 config: dict | None = None) -> str:
+    cached = store.get(person_name)
+    if cached is not None:
+        return cached
+    return flight.do(f"{kind}:{flight_name(person_name)}",
+                     partial(_fetch_text, store, person_name, prompt_fn, system, config))
 
-    prompt = f"""You create first-person writing samples for historical figures.
 
-    Target person: "{person_name}"
+def _fetch_text(store, person_name: str, prompt_fn, system: str | None = None, config: dict | None = None) -> str:
+    cached = store.get(person_name)
+    if cached is not None:
+        return cached
+    final_response = _generate_text(prompt_fn(person_name), system, config)
+    if final_response:
+        store_text(store, person_name, final_response)
+    return final_response
+
 
-    Goal:
-    - Provide 4–6 SHORT first-person samples in DISTINCT styles
-    - Be historically plausible; avoid modern slang and caricature.
-    - Do not copy long quotes verbatim; paraphrase if needed.
-    - Include at least one sample labeled 'polite-decline' that models a graceful, in-character refusal
-    with a brief context pivot and an inviting follow-up question.
+def _generate_text(prompt: str, system: str | None = None, config: dict | None = None) -> str:
+    with limited("gemini"):
+        response = genai_client().models.generate_content(
+            model="gemini-2.5-flash", contents=prompt,
+            config=types.GenerateContentConfig(system_instruction=system, **(config or {})))
+    return response.text.strip()
 
-    STRICT OUTPUT RULES
-    - Return ONLY a valid Python dictionary literal with a single key 'samples'. No backticks or extra prose.
-    - Use single quotes for keys/strings. Use Python types.
-    - Each 'sample' must be 70–120 words, written in first person ('I').
-    - 'label' names the style (e.g., 'formal-lecture','personal-letter','public-speech','notebook-entry','interview-q&a','maxim').
-    - 'purpose' briefly states when to use that style.
 
-    Required shape:
+# --- PERSONA BUNDLE (profile + style + delivery line in one tool hop) --------
+_PERSONA_POOL = ThreadPoolExecutor(max_workers=12, thread_name_prefix="persona")
 
-    {schema}
 
-    Return only the dictionary for "{person_name}".
+@timed()
+def get_persona(person_name: str, question: str = "", tool_context: ToolContext = None) -> dict:
+    """
+    One-call persona fetch. Runs get_details, get_voice_style and get_voice_accent
+    in parallel and returns them together:
+      - profile: compact profile dict (identity, roles, speaking cues, plus the breakthroughs / works /
+        quotes / controversies most relevant to `question`; 'omitted' lists sections left out)
+      - voice_style: the first-person writing sample (label, purpose, sample) that best fits `question`,
+        plus the 'polite-decline' sample; 'other_labels' lists the styles left out
+      - voice_accent: one-line spoken delivery instruction
+      - missing: parts that failed or missed the deadline (reply without them)
+    question: the user's current question, used to pick profile details and the style sample (may be empty).
+    Follow-up calls for the persona already active in this session return the stored bundle,
+    with the profile and style sample re-focused on the new question.
     """
-    response = client.models.generate_content(
-        model="gemini-2.5-flash",
-        contents=prompt)
+    active = active_persona(tool_context, person_name)
+    if active is not None:
+        if question:
+            active["profile"] = get_details(person_name, question)  # cached: no model call
+            active["voice_style"] = get_voice_style(person_name, question)
+        return active
+
+    parts = {
+        "profile": submit(_PERSONA_POOL, get_details, person_name, question),
+        "voice_style": submit(_PERSONA_POOL, get_voice_style, person_name, question),
+        "voice_accent": submit(_PERSONA_POOL, get_voice_accent, person_name),
+    }
+    wait(parts.values(), timeout=PERSONA_DEADLINE)
+    bundle = collect_bundle(person_name, parts)
+    remember_persona(tool_context, person_name, bundle)
+    return bundle
 
-    final_response = response.text.strip()
 
-    return final_response
+def _choose_gemini_voice(nationality: str, gender: str) -> str:
+    return voice_table.gemini_voice(nationality, gender)
 
-def get_voice_accent(person_name: str):
-    load_dotenv() 
-    key = os.getenv("GOOGLE_API_KEY")
-    client = genai.Client(api_key=key)
-    prompt = f"""
-    You need to generate a single-line TTS delivery instruction for how this person would have spoke, person name: {person_name}.
-    You can use the person's nationality, region and era to decide what kind of voice this person could have.
-    
-    Rules:
-    - Output EXACTLY ONE LINE, no quotes, no extra text.
-    - Write in English, describing HOW to speak: accent, tone, tempo, pitch, enunciation, pausing, formality, rhetoric cues.
-    - Keep it precise and actionable; avoid modern slang unless era-appropriate.
-    - Do not mention these inputs or that this is an instruction; just give the delivery line.
-
-    Return only one line like:
-    "Speak in gently German-accented English with a measured tempo, slightly lowered pitch, precise enunciation, brief reflective pauses, formal register, and evidence-first phrasing."
+# Tool that picks for the model
+@timed()
+def speak_auto(text: str, nationality: str, gender: str) -> dict:
+    voice = _choose_gemini_voice(nationality, gender)
+    return speak(text=text, voice=voice)
+
+
+@timed()
+def speak(text: str, voice: str = "Kore") -> dict:
+    """
+    Gemini TTS (Preview). Input: final user-facing reply text and a prebuilt voice name.
+    Output:
+      - audio_url: http://127.0.0.1:<port>/<hash>.wav  (short URL you can use in <audio>; .mp3/.opus per GEMINI_AUDIO_FORMAT)
+      - audio_tag: '<audio controls src="http://127.0.0.1:<port>/<hash>.wav"></audio>'  (ready to paste)
+      - voice: the voice name used
+    Always insert 'audio_tag' VERBATIM in the final assistant message (do not retype it, no braces).
+    """ 
+    # Content-addressed like ElevenLabs: identical model+voice+text is served from disk
+    fname = f"{gemini_key(voice, text)}.{audio_codec.EXT}"
+    fpath = AUDIO_DIR / fname
+    if clip_cache.lookup(fpath):
+        return audio_result(fname, voice, "gemini(cache)")
+
+    # Convert 24kHz 16-bit mono PCM -> WAV (or MP3/Opus); save atomically and return short URL (no base64 in chat)
+    _fill(fpath, lambda: audio_codec.encode([_gemini_pcm(text, voice)]), "gemini", publish=True)
+    return audio_result(fname, voice, "gemini")
+
+
+def _gemini_pcm(text: str, voice: str) -> bytes:
+    """Raw 24kHz 16-bit mono PCM from Gemini TTS for `text`."""
+    client = genai_client("GEMINI_API_KEY", "GOOGLE_API_KEY")
+
+    with limited("gemini-tts"):
+        resp = client.models.generate_content(
+            model=GEMINI_TTS_MODEL,
+            contents=text,  # IMPORTANT: only the reply text you want spoken
+            config=gemini_tts_config(voice),
+        )
+    return resp.candidates[0].content.parts[0].inline_data.data
+
+
+def _gemini_pcm_stream(text: str, voice: str):
+    """Yield Gemini TTS PCM chunks as they arrive."""
+    client = genai_client("GEMINI_API_KEY", "GOOGLE_API_KEY")
+    with limited("gemini-tts"):
+        for chunk in client.models.generate_content_stream(
+            model=GEMINI_TTS_MODEL,
+            contents=text,
+            config=gemini_tts_config(voice),
+        ):
+            for part in (chunk.candidates[0].content.parts if chunk.candidates and chunk.candidates[0].content else []):
+                if part.inline_data and part.inline_data.data:
+                    yield part.inline_data.data
+
+
+@timed()
+def speak_elevenlabs(text: str, voice_id: str, model_id: str = "eleven_multilingual_v2") -> dict:
+    """
+    Synthesize with ElevenLabs; returns audio_url + audio_tag.
+    Requires ELEVENLABS_API_KEY in env. Writes MP3 into AUDIO_DIR.
     """
-    response = client.models.generate_content(
-        model="gemini-2.5-flash",
-        contents=prompt)
+    fpath, cached = _eleven_clip(text, voice_id, model_id)
+    return audio_result(fpath.name, voice_id, "elevenlabs(cache)" if cached else "elevenlabs")
 
-    final_response = response.text.strip()
 
-    return final_response
+def _eleven_clip(text: str, voice_id: str, model_id: str = "eleven_multilingual_v2",
+                 previous_text: str = "", next_text: str = "") -> tuple[Path, bool]:
+    """Return (mp3 path, was_cached). previous/next_text keep prosody continuous across sentence clips."""
+    if not voice_id:
+        raise RuntimeError("Missing ELEVENLABS_API_KEY or voice_id")
+    fpath = AUDIO_DIR / f"{cache_key(voice_id, text)}.mp3"
+    if clip_cache.lookup(fpath):
+        return fpath, True
 
-def _choose_gemini_voice(nationality: str, gender: str) -> str:
-    nat = (nationality or "").lower()
-    gen = (gender or "").lower()
+    _fill(fpath, lambda: _eleven_request(text, voice_id, model_id, previous_text, next_text).content, "elevenlabs")
+    return fpath, False
 
-    # India / South Asia
-    if any(k in nat for k in ["india","indian","pakistan","bangladesh","sri lanka","nepal"]):
-        return "Puck" if gen in ["male","m","man"] else ("Leda" if gen in ["female","f","woman"] else "Puck")
 
-    # UK / Ireland
-    if any(k in nat for k in ["uk","united kingdom","england","britain","wales","scotland","ireland","irish","british"]):
-        return "Kore"
+def _eleven_request(text: str, voice_id: str, model_id: str, previous_text: str = "",
+                    next_text: str = "", stream: bool = False) -> requests.Response:
+    url_endpoint, headers, payload = eleven_call(text, voice_id, model_id, previous_text, next_text, stream)
+    bucket = LIMITS["elevenlabs"]
+    for attempt in range(ELEVEN_RETRIES + 1):
+        with span("upstream_wait", provider="elevenlabs"):
+            bucket.acquire()
+        try:
+            # for streamed calls this is time to response headers
+            with span("upstream", provider="elevenlabs") as s:
+                r = _ELEVEN_HTTP.post(url_endpoint, headers=headers, json=payload, timeout=_ELEVEN_TIMEOUT,
+                                      stream=stream)
+                s["outcome"] = str(r.status_code)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == ELEVEN_RETRIES:
+                raise
+            inc("upstream_retries_total", provider="elevenlabs")
+            time.sleep(retry_delay(None, attempt))
+            continue
+        if r.status_code == 429:
+            bucket.backoff(retry_after(r))  # hold every other ElevenLabs call too, not just this retry
+        if r.status_code in ELEVEN_RETRY_STATUS and attempt < ELEVEN_RETRIES:
+            inc("upstream_retries_total", provider="elevenlabs")
+            delay = retry_delay(r, attempt)
+            r.close()
+            time.sleep(delay)
+            continue
+        break
+    if r.status_code != 200:
+        raise RuntimeError(f"ElevenLabs error {r.status_code}: {r.text[:200]}")
+    return r
 
-    # USA / Canada
-    if any(k in nat for k in ["united states","usa","american","canada","canadian"]):
-        return "Puck"
 
-    # Western / Central / Eastern Europe, Russia, MENA, East Asia → neutral/continental
-    if any(k in nat for k in ["germany","german","france","french","italy","italian","spain","spanish",
-                              "poland","czech","hungary","balkan","russia","russian",
-                              "egypt","turkey","saudi","iran","arab","japan","korea","china","chinese"]):
-        return "Zephyr"
+# --- ELEVENLABS HTTP CLIENT (pooled keep-alive + jittered retries) -----------
+# One process-wide session so every synthesis reuses warm TCP/TLS connections
+# instead of handshaking per reply. The retry policy is tts_common's, shared
+# with the httpx client in async_tools.
 
-    # Latin America or Sub-Saharan Africa → use Puck as clearer/neutral
-    if any(k in nat for k in ["brazil","argentina","mexico","colombia","peru","chile",
-                              "nigeria","south africa","kenya","ghana","ethiopia"]):
-        return "Puck"
+_ELEVEN_TIMEOUT = (3.05, 30)   # (connect, read-between-bytes) seconds
 
-    # Fallback
-    return "Kore"
+_ELEVEN_HTTP = requests.Session()
+# sized for the sentence pool plus concurrent streaming heads; one host, so few pools
+_ELEVEN_HTTP.mount("https://", requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=32))
 
-# Tool that picks for the model
-def speak_auto(text: str, nationality: str, gender: str) -> dict:
-    voice = _choose_gemini_voice(nationality, gender)
-    return speak(text=text, voice=voice)
 
-_AUDIO_DIR = Path(tempfile.gettempdir()) / "history_agent_audio"
-_AUDIO_DIR.mkdir(parents=True, exist_ok=True)
-_AUDIO_PORT = 8765  # change if needed
+# --- SENTENCE PIPELINE (parallel per-sentence TTS, stitched into one clip) ----
+# Each sentence is synthesized on a bounded pool and cached under the same
+# voice+text key as whole replies, so recurring lines ("the record keeps its
+# counsel...") are hits. A reply then costs roughly its slowest sentence.
 
+_TTS_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="tts")
 
 
-class _AudioHandler(SimpleHTTPRequestHandler):
-    # serve from _AUDIO_DIR and set a good content-type for .wav/.mp3
-    def translate_path(self, path):
-        # serve only from our audio dir
-        rel = path.lstrip("/\\")
-        return str(_AUDIO_DIR / rel)
+def _gemini_clip(text: str, voice: str) -> tuple[Path, bool]:
+    """Return (wav path, was_cached) for one Gemini-synthesized sentence."""
+    fpath = AUDIO_DIR / f"{gemini_key(voice, text)}.wav"
+    if clip_cache.lookup(fpath):
+        return fpath, True
+    _fill(fpath, lambda: wav_bytes(_gemini_pcm(text, voice)), "gemini")
+    return fpath, False
 
-    def end_headers(self):
-        # allow cross-origin loads (audio tag)
-        self.send_header("Access-Control-Allow-Origin", "*")
-        super().end_headers()
 
+def _fill(fpath: Path, make, engine: str, publish: bool = False) -> None:
+    """Write make() to fpath once, however many callers race for the same clip."""
+    def run():
+        if not fpath.exists():
+            (publish_clip if publish else write_atomic)(fpath, make(), engine)
+    flight.do(fpath.name, run)
 
 
-def _port_in_use(port):
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        return s.connect_ex(("127.0.0.1", port)) == 0
+def _speak_sentences(text: str, voice: str, ext: str, clip_fn, engine: str, key: str) -> dict:
+    fname = f"{key}.{ext}"
+    out = AUDIO_DIR / fname
+    if clip_cache.lookup(out):
+        return audio_result(fname, voice, f"{engine}(cache)")
 
+    sentences = split_sentences(text) or [text]
+    futs = [submit(_TTS_POOL, clip_fn, sentences, i) for i in range(len(sentences))]
+    clips = [f.result() for f in futs]  # first failure propagates to the caller's fallback
+    stitch([p for p, _ in clips], out, engine)
 
+    res = audio_result(fname, voice, engine)
+    res["sentences"] = len(clips)
+    res["sentence_cache_hits"] = sum(1 for _, hit in clips if hit)
+    return res
 
-def _start_audio_server():
-    global _AUDIO_PORT
-    # try 8765, then a few fallbacks
-    for p in (_AUDIO_PORT, 8766, 8770, 8888):
-        if not _port_in_use(p):
-            _AUDIO_PORT = p
-            break
-    httpd = ThreadingHTTPServer(("127.0.0.1", _AUDIO_PORT), _AudioHandler)
-    t = threading.Thread(target=httpd.serve_forever, daemon=True)
-    t.start()
-    # tiny wait so it’s listening before first use
-    time.sleep(0.15)
 
-# start once when tools.py is imported
-try:
-    _start_audio_server()
-except Exception:
-    pass
+def _eleven_sentence(voice_id: str, model_id: str, sentences: list[str], i: int) -> tuple[Path, bool]:
+    return _eleven_clip(sentences[i], voice_id, model_id,
+                        previous_text=sentences[i - 1] if i else "",
+                        next_text=sentences[i + 1] if i + 1 < len(sentences) else "")
 
-from google import genai
-from google.genai import types
 
+def _gemini_sentence(voice: str, sentences: list[str], i: int) -> tuple[Path, bool]:
+    return _gemini_clip(sentences[i], voice)
 
 
-def speak(text: str, voice: str = "Kore") -> dict:
-    """
-    Gemini TTS (Preview). Input: final user-facing reply text and a prebuilt voice name.
-    Output:
-      - audio_url: http://127.0.0.1:<port>/<uuid>.wav  (short URL you can use in <audio>)
-      - audio_tag: '<audio controls src="http://127.0.0.1:<port>/<uuid>.wav"></audio>'  (ready to paste)
-      - voice: the voice name used
-    Always insert 'audio_tag' VERBATIM in the final assistant message (do not retype it, no braces).
-    """ 
-    client = genai.Client(api_key=os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY"))
-
-    resp = client.models.generate_content(
-        model="gemini-2.5-flash-preview-tts",
-        contents=text,  # IMPORTANT: only the reply text you want spoken
-        config=types.GenerateContentConfig(
-            response_modalities=["AUDIO"],
-            speech_config=types.SpeechConfig(
-                voice_config=types.VoiceConfig(
-                    prebuilt_voice_config=types.PrebuiltVoiceConfig(voice_name=voice)
-                )
-            ),
-        ),
-    )
-
-    # Convert 24kHz 16-bit mono PCM -> WAV bytes
-    pcm = resp.candidates[0].content.parts[0].inline_data.data
-    buf = io.BytesIO()
-    with wave.open(buf, "wb") as wf:
-        wf.setnchannels(1); wf.setsampwidth(2); wf.setframerate(24000); wf.writeframes(pcm)
-    wav_bytes = buf.getvalue()
-
-    # Save file and return short URL (no base64 in chat)
-    fname = f"{uuid.uuid4().hex}.wav"
-    fpath = _AUDIO_DIR / fname
-    fpath.write_bytes(wav_bytes)
-
-    url = f"http://127.0.0.1:{_AUDIO_PORT}/{fname}"
-    return {
-        "audio_url": url,
-        "audio_tag": f'<audio controls src="{url}"></audio>',
-        "voice": voice,
-    }
+def speak_elevenlabs_sentences(text: str, voice_id: str, model_id: str = "eleven_multilingual_v2") -> dict:
+    """ElevenLabs, synthesized sentence-by-sentence in parallel and stitched into one MP3."""
+    return _speak_sentences(text, voice_id, "mp3", partial(_eleven_sentence, voice_id, model_id), "elevenlabs",
+                            cache_key(voice_id, text))
 
 
-# --- ELEVENLABS VOICE MAP (compact, clearly distinct accent buckets) ---------
-# # Each bucket has male/female so you can respect gender when known.
-
-ELEVEN_VOICE_MAP = {
-    # South Asia
-    "en_in": {  # India/Pakistan/Bangladesh/Sri Lanka/Nepal
-        "male":   "CZdRaSQ51p0onta4eec8",
-        "female": "kL06KYMvPY56NluIQ72m"
-    },
-
-    # UK & Ireland
-    "en_gb": {
-        "male":   "aaorr6ZHIL88gEexu7dC",
-        "female": "jB2lPb5DhAX6l1TLkKXy"
-    },
-
-    # North America (US/Canada)
-    "en_us": {
-        "male":   "sIT4mjQ8vhgwxvsfq5Li",
-        "female": "yM93hbw8Qtvdma2wCnJG"
-    },
-
-    # Australia / New Zealand
-    "en_au": {
-        "male":   "sclx1MZrNqboRcmLWoDb",
-        "female": "w9rPM8AIZle60Nbpw7nl"
-        
-    },
-
-    # Chinese-accented English (distinct from JP/KR)
-    "en_cn": {
-        "male":   "cLCuNe0GeCZkd2MXpQWN",
-        "female": "ykMqqjWs4pQdCIvGPn0z"
-       
-    },
-
-    # East Asia (Japan/Korea) combined for simplicity
-    "en_eastasia": {
-        "male":   "UznIBkKIQe3ZG2tGydre",
-        "female": "B2j2knC2POvVW0XJE6Hi"
-     
-    },
-
-    # Middle East & North Africa (Arabic/Persian/Turkish/Hebrew-accented English)
-    "en_mena": {
-        "male":   "uQPOhlzA94sogqmhGLCI",
-        "female": "aCChyB4P5WEomwRsOKRh"
-        
-    },
-
-    # Continental Europe (German/French/Italian/Spanish/Portuguese/Polish/etc.)
-    "en_eu_cont": {
-        "male":   "PW7PuXtvQ2D7ViYH2zwB",
-        "female": "qomNIe05PS2HOqkLJCkG"
-    
-    },
-
-    # Latin America (Spanish/Portuguese-accented English)
-    "en_latam": {
-        "male":   "IP2syKL31S2JthzSSfZH",
-        "female": "xwH1gVhr2dWKPJkpNQT9"
-        
-    },
-
-    # Sub-Saharan Africa (generic)
-    "en_af": {
-        "male": "nw6EIXCsQ89uJMjytYb8",
-        "female": "BcpjRWrYhDBHmOnetmBl"
-       
-    },
-}
-
-# --- NATIONALITY/REGION RESOLVER (compact) -----------------------------------
-def _region_key_from_nat(nationality: str) -> str:
-    """
-    Map nationality/place strings to the closest compact accent bucket above.
-    Keep this simple on purpose. Falls back to 'en_gb' if no match.
-    """
-    n = (nationality or "").lower()
-
-    # South Asia
-    if any(k in n for k in ["india","indian","pakistan","pakistani","bangladesh","bangladeshi","sri lanka","sri-lanka","lankan","nepal","nepali"]):
-        return "en_in"
-
-    # UK & Ireland
-    if any(k in n for k in ["england","english","britain","british","uk","united kingdom","wales","scotland","ireland","irish"]):
-        return "en_gb"
-
-    # North America
-    if any(k in n for k in ["united states","usa","american","canada","canadian"]):
-        return "en_us"
-
-    # Australia / New Zealand
-    if any(k in n for k in ["australia","australian","new zealand","nz","kiwi","aotearoa"]):
-        return "en_au"
-
-    # China
-    if any(k in n for k in ["china","chinese","prc"]):
-        return "en_cn"
-
-    # East Asia (JP/KR)
-    if any(k in n for k in ["japan","japanese","korea","korean"]):
-        return "en_eastasia"
-
-    # MENA (Arabic/Persian/Turkish/Hebrew)
-    if any(k in n for k in [
-        "uae","saudi","arabia","egypt","morocco","algeria","tunisia","iraq","syria","jordan","lebanon","arab",
-        "iran","persian","iranian","turkey","turkish","israel","israeli","hebrew"
-    ]):
-        return "en_mena"
-
-    # Continental Europe (catch-all)
-    if any(k in n for k in [
-        "germany","german","france","french","italy","italian","spain","spanish","portugal","portuguese",
-        "poland","polish","netherlands","dutch","belgium","austria","switzerland","czech","hungary",
-        "romania","bulgaria","serbia","croatia","bosnia","albania","slovenia","slovakia","greece",
-        "ukraine","belarus","baltic","estonia","latvia","lithuania"
-    ]):
-        return "en_eu_cont"
-
-    # Latin America
-    if any(k in n for k in [
-        "mexico","mexican","brazil","brazilian","argentina","chile","colombia","peru","ecuador","bolivia",
-        "paraguay","uruguay","venezuela","latin america","latam","hispanic"
-    ]):
-        return "en_latam"
-
-    # Sub-Saharan Africa (generic)
-    if any(k in n for k in [
-        "south africa","nigeria","ghana","kenya","uganda","tanzania","ethiopia","rwanda","burundi","somalia",
-        "zambia","zimbabwe","botswana","namibia","angola","cameroon","senegal","mali","ivory coast","côte d'ivoire"
-    ]):
-        return "en_af"
-
-    # Fallback
-    return "en_gb"
-
-
-def _pick_eleven_voice_id(nationality: str, gender: str) -> tuple[str, str]:
-    """
-    Return (voice_id, region_key) for ElevenLabs, with no 'neutral' fallback.
-    Strategy:
-      1) If gender is known, pick that exact voice if present.
-      2) If gender unknown or missing key, prefer 'male', else 'female'.
-      3) Last resort: first value in the mapping (if any).
-    """
-    region = _region_key_from_nat(nationality)
-    bundle = ELEVEN_VOICE_MAP.get(region) or ELEVEN_VOICE_MAP.get("en_gb", {})
+def speak_sentences(text: str, voice: str = "Kore") -> dict:
+    """Gemini TTS, synthesized sentence-by-sentence in parallel and stitched into one clip (GEMINI_AUDIO_FORMAT)."""
+    return _speak_sentences(text, voice, audio_codec.EXT, partial(_gemini_sentence, voice), "gemini", gemini_key(voice, text))
 
-    g = (gender or "").strip().lower()
-    # 1) exact gender match
-    if g in ("male", "man", "m") and "male" in bundle:
-        return bundle["male"], region
-    if g in ("female", "woman", "f") and "female" in bundle:
-        return bundle["female"], region
 
-    # 2) unknown → prefer male, then female
-    if "male" in bundle:
-        return bundle["male"], region
-    if "female" in bundle:
-        return bundle["female"], region
+# --- STREAMING DELIVERY (URL first, bytes as they arrive) ---------------------
+# The first sentence is piped straight from the vendor's streaming API into a
+# LiveClip; the remaining sentences are synthesized in parallel meanwhile and
+# appended in order. Sentences and the whole reply still land in the cache.
 
-    # 3) last resort: any value
-    return (next(iter(bundle.values()), ""), region)
 
+def _opened(chunks, engine: str):
+    """Start a lazy chunk stream now: request errors raise here; returns the stream with its first chunk back in front."""
+    chunks = iter(chunks)
+    first = next(chunks, None)
+    if first is None:
+        raise RuntimeError(f"{engine}: stream ended before any audio")
+    return itertools.chain((first,), chunks)
 
-def speak_elevenlabs(text: str, voice_id: str, model_id: str = "eleven_multilingual_v2") -> dict:
+
+def _produce_stream(live, sentences, head_path, head_chunks, head_file, clip_fn, body_of, transform=None, engine=""):
+    rest = [submit(_TTS_POOL, clip_fn, sentences, i) for i in range(1, len(sentences))]
+    try:
+        head = bytearray()
+        for chunk in head_chunks:
+            head += chunk
+            live.write(chunk)
+        save_head(head_path, bytes(head), head_file, engine)
+        for fut in rest:
+            append_clip(live, body_of, fut.result()[0])
+        finish_stream(live, transform, engine)
+    except Exception as e:
+        for fut in rest:
+            fut.cancel()
+        live.fail(e)
+
+
+def speak_elevenlabs_stream(text: str, voice_id: str, model_id: str = "eleven_multilingual_v2") -> dict:
+    """ElevenLabs with streaming delivery: the returned URL plays as soon as the first bytes arrive."""
+    fname = f"{cache_key(voice_id, text)}.mp3"
+    res, live = stream_target(fname, "audio/mpeg", voice_id, "elevenlabs")
+    if res is not None:
+        return res
+
+    sentences = split_sentences(text) or [text]
+    head_path = AUDIO_DIR / f"{cache_key(voice_id, sentences[0])}.mp3"
+    try:
+        head = cached_head(head_path, Path.read_bytes)
+        if head is not None:
+            head = [head]
+        else:
+            # opened here, not in the producer, so HTTP errors still reach the caller's fallback
+            head = _eleven_request(sentences[0], voice_id, model_id,
+                                   next_text=sentences[1] if len(sentences) > 1 else "",
+                                   stream=True).iter_content(chunk_size=4096)
+    except Exception as e:
+        live.fail(e)
+        raise
+    threading.Thread(
+        target=contextvars.copy_context().run, daemon=True,
+        args=(_produce_stream, live, sentences, head_path, head, bytes, partial(_eleven_sentence, voice_id, model_id),
+              lambda p: strip_id3(p.read_bytes())),
+        kwargs={"engine": "elevenlabs"},
+    ).start()
+    return audio_result(fname, voice_id, "elevenlabs(stream)")
+
+
+def speak_stream(text: str, voice: str = "Kore") -> dict:
+    """Gemini TTS with streaming delivery (WAV with an open-ended header until the clip is complete, or MP3/Opus)."""
+    fname = f"{gemini_key(voice, text)}.{audio_codec.EXT}"
+    res, live = stream_target(fname, audio_codec.CONTENT_TYPE, voice, "gemini")
+    if res is not None:
+        return res
+
+    sentences = split_sentences(text) or [text]
+    head_path = AUDIO_DIR / f"{gemini_key(voice, sentences[0])}.wav"
+    try:
+        head = cached_head(head_path, wav_frames)
+        if head is not None:
+            head = [head]
+        else:
+            # first chunk pulled here, not in the producer, so a failed request reaches the caller's fallback
+            head = _opened(_gemini_pcm_stream(sentences[0], voice), "gemini")
+    except Exception as e:
+        live.fail(e)
+        raise
+    threading.Thread(
+        target=contextvars.copy_context().run, daemon=True,
+        args=(_produce_stream, audio_codec.stream_to(live), sentences, head_path, head, wav_bytes,
+              partial(_gemini_sentence, voice), wav_frames, audio_codec.finish_transform()),
+        kwargs={"engine": "gemini"},
+    ).start()
+    return audio_result(fname, voice, "gemini(stream)")
+
+
+# --- LOCAL TTS (offline last resort, optional draft voice) -------------------
+# speak_local() runs Piper / eSpeak NG on this machine (see local_tts). It is
+# the last engine speak_elevenlabs_auto tries, and with LOCAL_TTS_DRAFT_AFTER
+# set it also answers with a local draft clip when no vendor clip is ready in
+# that many seconds; the vendor clip keeps rendering into the cache.
+
+_DRAFT_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="tts-draft")
+
+
+@timed()
+def speak_local(text: str, nationality: str = "", gender: str = "") -> dict:
     """
-    Synthesize with ElevenLabs; returns audio_url + audio_tag.
-    Requires ELEVENLABS_API_KEY in env. Writes MP3 into _AUDIO_DIR.
+    Offline CPU TTS (Piper or eSpeak NG) with the same result as speak(); the voice follows the
+    nationality's accent region like speak_elevenlabs_auto. Raises when no local engine is installed.
     """
-    api_key = os.getenv("ELEVENLABS_API_KEY")
-    if not api_key or not voice_id:
-        raise RuntimeError("Missing ELEVENLABS_API_KEY or voice_id")
+    voice = local_voice(nationality, gender)
+    fname = f"{local_key(voice, text)}.{audio_codec.EXT}"
+    fpath = AUDIO_DIR / fname
+    if clip_cache.lookup(fpath):
+        return audio_result(fname, f"{local_tts.name}:{voice}", "local(cache)")
+    _fill(fpath, partial(_local_clip, text, voice), "local", publish=True)
+    return audio_result(fname, f"{local_tts.name}:{voice}", "local")
 
-    # Caching to save quota: hash voice+text
-    cache_key = hashlib.sha256((voice_id + "|" + text).encode("utf-8")).hexdigest()[:20]
-    fname = f"{cache_key}.mp3"
-    fpath = _AUDIO_DIR / fname
-    if fpath.exists():
-        url = f"http://127.0.0.1:{_AUDIO_PORT}/{fname}"
-        return {"audio_url": url, "audio_tag": f'<audio controls src="{url}"></audio>', "voice": voice_id, "engine": "elevenlabs(cache)"}
-
-    url_endpoint = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
-    headers = {
-        "xi-api-key": api_key,
-        "accept": "audio/mpeg",
-        "Content-Type": "application/json",
-    }
-    payload = {
-        "text": text,
-        "model_id": model_id,
-        # Optional fine-tuning per voice:
-        "voice_settings": {
-            "stability": 0.5,
-            "similarity_boost": 0.8,
-            "style": 0.0,
-            "use_speaker_boost": True
-        }
-    }
 
-    r = requests.post(url_endpoint, headers=headers, json=payload, timeout=60)
-    print(f"[TTS] Eleven HTTP {r.status_code} for voice_id={voice_id}")
-    if r.status_code != 200:
-        raise RuntimeError(f"ElevenLabs error {r.status_code}: {r.text[:200]}")
+def _local_clip(text: str, voice: str) -> bytes:
+    pcm, rate = local_tts.synthesize(text, voice)   # Piper / eSpeak rates (16-22.05 kHz), not Gemini's 24 kHz
+    return audio_codec.encode([pcm], rate)
 
-    fpath.write_bytes(r.content)
-    url = f"http://127.0.0.1:{_AUDIO_PORT}/{fname}"
-    return {"audio_url": url, "audio_tag": f'<audio controls src="{url}"></audio>', "voice": voice_id, "engine": "elevenlabs"}
 
-def speak_elevenlabs_auto(text: str, nationality: str, gender: str) -> dict:
+def _route_or_draft(candidates: list, local) -> tuple[str, dict, list[str]]:
+    """TTS_ROUTER.run, but a local draft clip answers if no engine has a clip after LOCAL_TTS_DRAFT_AFTER."""
+    routed = submit(_DRAFT_POOL, TTS_ROUTER.run, candidates)
+    try:
+        return routed.result(timeout=LOCAL_TTS_DRAFT_AFTER)
+    except FutureTimeout:
+        pass
+    try:
+        res = local()
+    except Exception:
+        return routed.result()   # no draft after all; wait for the real clip
+    inc("tts_drafts_total")
+    return "local-draft", res, [f"no clip after {LOCAL_TTS_DRAFT_AFTER:g}s; the full voice is still rendering"]
+
+
+@timed()
+def speak_elevenlabs_auto(text: str, nationality: str, gender: str, tool_context: ToolContext = None) -> dict:
     """
-    Try ElevenLabs first; on any error OR missing mapping, fall back to Gemini TTS (speak()).
+    Try ElevenLabs first; on any error OR missing mapping, fall back to Gemini TTS (speak()),
+    then to the local CPU voice (speak_local()) when both vendors fail.
+    nationality/gender may be left empty on follow-up turns: the active persona's voice is reused.
     """
+    candidates, notes = auto_candidates(
+        text, nationality, gender, tool_context,
+        speak_elevenlabs_stream if TTS_STREAMING else speak_elevenlabs_sentences,
+        speak_stream if TTS_STREAMING else speak_sentences, speak_local)
+    eleven, _, local = (fn for _, fn in candidates)
     try:
-        voice_id, region = _pick_eleven_voice_id(nationality, gender)
-        # If we couldn't map a usable voice, bail to fallback immediately
-        if not voice_id:
-            raise RuntimeError("No usable ElevenLabs voice_id for this account/region/gender.")
+        if local and LOCAL_TTS_DRAFT_AFTER > 0:
+            engine, res, route_notes = _route_or_draft(candidates, local)
+        else:
+            engine, res, route_notes = TTS_ROUTER.run(candidates)
+    except NoEngineAvailable as e:
+        return no_engine(notes, e)
+    notes += route_notes
+    return pin_clip(tool_context, label_fallback(engine, eleven, res, notes))
 
-        # Happy path: synth with ElevenLabs
-        return speak_elevenlabs(text=text, voice_id=voice_id)
 
-    except Exception as e:
-        # Clean fallback to Gemini
-        try:
-            res = speak(text=text, voice="Kore")
-            res["engine"] = "gemini-fallback"
-            res["note"] = f"[ElevenLabs fallback: {e}]"
-            return res
-        except Exception as e2:
-            return {
-                "audio_url": "",
-                "audio_tag": "",
-                "voice": "",
-                "engine": "none",
-                "error": f"[ElevenLabs fallback: {e}]; Gemini failed: {e2}"
-            }
@@ -0,0 +1,402 @@
+import hashlib, os, random, re, tempfile, threading, time, unicodedata, wave
+from email.utils import parsedate_to_datetime
+from functools import partial
+from pathlib import Path
+
+from google.genai import types
+
+from . import audio_codec, audio_stream
+from .audio_cache import ClipCache, SharedClipCache
+from .audio_server import AudioServer
+from .clients import getenv
+from .engine_router import EngineRouter, NoEngineAvailable
+from .local_tts import local_tts
+from .metrics import REGISTRY, inc
+from .persona_common import persona_voice, remember_voice
+from .shared_db import MULTI_WORKER, shared_db
+from .voice_routing import voice_table
+
+
+# --- TTS PLUMBING (shared by tools.py and async_tools.py) ---------------------
+# The audio folder and its host, clip names, vendor request building and
+# retry policy, sentence splitting and stitching, the streaming producer's
+# disk steps and engine routing. Nothing here waits on a vendor: tools.py
+# calls it directly, async_tools.py through asyncio.to_thread where it
+# touches disk, SQLite or the encoder.
+
+# --- AUDIO FOLDER + HOST ------------------------------------------------------
+AUDIO_DIR = Path(os.getenv("AUDIO_DIR") or Path(tempfile.gettempdir()) / "history_agent_audio")
+AUDIO_DIR.mkdir(parents=True, exist_ok=True)
+AUDIO_PORT = int(os.getenv("AUDIO_PORT", "8765"))
+
+# bounded LRU over AUDIO_DIR; clips handed to a live session are never evicted
+clip_cache = SharedClipCache(AUDIO_DIR, shared_db) if MULTI_WORKER else ClipCache(AUDIO_DIR)
+
+# Multi-worker mode: exactly one process listens on AUDIO_PORT, and every
+# worker's URLs point there. The bind itself is the election: whoever holds
+# the port is the host (and runs the sweeper); the rest re-try the bind every
+# _HOST_RETRY seconds, so a new host takes over if the old one exits.
+# AUDIO_HOST_EXTERNAL=1 leaves it to `python -m <agent_package>.audio_server`.
+AUDIO_HOST_EXTERNAL = os.getenv("AUDIO_HOST_EXTERNAL", "0") != "0"
+_HOST_RETRY = 10.0
+
+_AUDIO_SERVER = None
+_AUDIO_STARTED = False
+_AUDIO_LOCK = threading.Lock()
+_HOST_CHECKED = 0.0
+
+
+def _start_audio_server():
+    global AUDIO_PORT, _AUDIO_SERVER
+    # try 8765, then a few fallbacks; a failed bind means the port is taken
+    for p in (AUDIO_PORT, 8766, 8770, 8888):
+        server = AudioServer(AUDIO_DIR, "127.0.0.1", p, cache=clip_cache)
+        try:
+            server.start()
+        except OSError:
+            continue
+        AUDIO_PORT, _AUDIO_SERVER = p, server
+        return
+
+
+def _claim_audio_host() -> None:
+    global _AUDIO_SERVER
+    server = AudioServer(AUDIO_DIR, "127.0.0.1", AUDIO_PORT, cache=clip_cache)
+    try:
+        server.start()
+    except OSError:
+        return  # another worker is the host
+    _AUDIO_SERVER = server
+    clip_cache.start()
+
+
+def ensure_audio_server() -> int:
+    """Start the audio host and cache sweeper on first use (not at import); returns the port."""
+    global _AUDIO_STARTED, _HOST_CHECKED
+    if MULTI_WORKER:
+        if not AUDIO_HOST_EXTERNAL and _AUDIO_SERVER is None and time.monotonic() - _HOST_CHECKED > _HOST_RETRY:
+            with _AUDIO_LOCK:
+                if _AUDIO_SERVER is None and time.monotonic() - _HOST_CHECKED > _HOST_RETRY:
+                    _HOST_CHECKED = time.monotonic()
+                    _claim_audio_host()
+        return AUDIO_PORT
+    if not _AUDIO_STARTED:
+        with _AUDIO_LOCK:
+            if not _AUDIO_STARTED:
+                try:
+                    _start_audio_server()
+                except Exception:
+                    pass
+                clip_cache.start()
+                _AUDIO_STARTED = True
+    return AUDIO_PORT
+
+
+# --- CLIP KEYS + GEMINI TTS REQUESTS ------------------------------------------
+GEMINI_TTS_MODEL = "gemini-2.5-flash-preview-tts"
+
+
+def gemini_key(voice: str, text: str) -> str:
+    # model + voice + whitespace/Unicode-normalized text, same hash scheme as cache_key
+    norm = " ".join(unicodedata.normalize("NFC", text or "").split())
+    return cache_key(f"{GEMINI_TTS_MODEL}|{voice}", norm)
+
+
+def gemini_tts_config(voice: str) -> types.GenerateContentConfig:
+    return types.GenerateContentConfig(
+        response_modalities=["AUDIO"],
+        speech_config=types.SpeechConfig(
+            voice_config=types.VoiceConfig(
+                prebuilt_voice_config=types.PrebuiltVoiceConfig(voice_name=voice)
+            )
+        ),
+    )
+
+
+def wav_bytes(pcm: bytes) -> bytes:
+    return audio_stream.wav_header(len(pcm)) + pcm
+
+
+# --- ELEVENLABS VOICE MAP (compact, clearly distinct accent buckets) ---------
+# # Each bucket has male/female so you can respect gender when known.
+
+# region -> {"male": voice_id, "female": voice_id}; edit voices.json (or VOICE_CONFIG), not this file
+ELEVEN_VOICE_MAP = voice_table.eleven
+
+
+def _region_key_from_nat(nationality: str) -> str:
+    """Closest accent region for a nationality/place string (see voice_routing); 'en_gb' by default."""
+    return voice_table.region(nationality)
+
+
+def _pick_eleven_voice_id(nationality: str, gender: str) -> tuple[str, str]:
+    """
+    Return (voice_id, region_key) for ElevenLabs, with no 'neutral' fallback.
+    Strategy:
+      1) If gender is known, pick that exact voice if present.
+      2) If gender unknown or missing key, prefer 'male', else 'female'.
+      3) Last resort: first value in the mapping (if any).
+    """
+    region = _region_key_from_nat(nationality)
+    bundle = ELEVEN_VOICE_MAP.get(region) or ELEVEN_VOICE_MAP.get(voice_table.default_region, {})
+
+    g = (gender or "").strip().lower()
+    # 1) exact gender match
+    if g in ("male", "man", "m") and "male" in bundle:
+        return bundle["male"], region
+    if g in ("female", "woman", "f") and "female" in bundle:
+        return bundle["female"], region
+
+    # 2) unknown → prefer male, then female
+    if "male" in bundle:
+        return bundle["male"], region
+    if "female" in bundle:
+        return bundle["female"], region
+
+    # 3) last resort: any value
+    return (next(iter(bundle.values()), ""), region)
+
+
+# --- CLIP NAMES + RESULTS -----------------------------------------------------
+def cache_key(voice: str, text: str) -> str:
+    # Caching to save quota: hash voice+text
+    return hashlib.sha256((voice + "|" + text).encode("utf-8")).hexdigest()[:20]
+
+
+def audio_result(fname: str, voice: str, engine: str) -> dict:
+    url = f"http://127.0.0.1:{ensure_audio_server()}/{fname}"
+    return {"audio_url": url, "audio_tag": f'<audio controls src="{url}"></audio>', "voice": voice, "engine": engine}
+
+
+# --- ELEVENLABS REQUESTS (payload + retry policy for both HTTP clients) -------
+def eleven_call(text: str, voice_id: str, model_id: str, previous_text: str = "",
+                next_text: str = "", stream: bool = False) -> tuple[str, dict, dict]:
+    """(url, headers, payload) for one ElevenLabs TTS request; shared by the sync and async clients."""
+    api_key = getenv("ELEVENLABS_API_KEY")
+    if not api_key or not voice_id:
+        raise RuntimeError("Missing ELEVENLABS_API_KEY or voice_id")
+
+    base = getenv("ELEVENLABS_BASE_URL") or "https://api.elevenlabs.io"   # overridable for the offline bench
+    url_endpoint = f"{base}/v1/text-to-speech/{voice_id}" + ("/stream" if stream else "")
+    headers = {
+        "xi-api-key": api_key,
+        "accept": "audio/mpeg",
+        "Content-Type": "application/json",
+    }
+    payload = {
+        "text": text,
+        "model_id": model_id,
+        # Optional fine-tuning per voice:
+        "voice_settings": {
+            "stability": 0.5,
+            "similarity_boost": 0.8,
+            "style": 0.0,
+            "use_speaker_boost": True
+        }
+    }
+    if previous_text:
+        payload["previous_text"] = previous_text
+    if next_text:
+        payload["next_text"] = next_text
+    return url_endpoint, headers, payload
+
+
+# jittered retries on connect errors, timeouts and these statuses; a 429 also
+# backs off the whole ElevenLabs bucket (see upstream.TokenBucket.backoff)
+ELEVEN_RETRIES = 2
+ELEVEN_RETRY_STATUS = {429, 500, 502, 503, 504}
+_ELEVEN_MAX_BACKOFF = 8.0
+
+
+def retry_delay(r, attempt: int) -> float:
+    """Honor Retry-After (seconds or HTTP date) when given, else full-jitter exponential backoff."""
+    after = retry_after(r)
+    if after is not None:
+        return after
+    return random.uniform(0, min(_ELEVEN_MAX_BACKOFF, 0.5 * 2 ** attempt))
+
+
+def retry_after(r) -> float | None:
+    retry_after = r.headers.get("Retry-After") if r is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), _ELEVEN_MAX_BACKOFF)
+        except ValueError:
+            try:
+                when = parsedate_to_datetime(retry_after).timestamp()
+                return min(max(when - time.time(), 0.0), _ELEVEN_MAX_BACKOFF)
+            except (TypeError, ValueError):
+                pass
+    return None
+
+
+# --- SENTENCES + CLIP FILES ---------------------------------------------------
+_SENTENCE_RE = re.compile(r'.+?(?:[.!?…]+["”’)\]]*(?=\s|$)|$)', re.S)
+_MIN_SENTENCE_CHARS = 25  # shorter fragments ("Dr.", "Yes!") ride along with a neighbour
+
+
+def split_sentences(text: str) -> list[str]:
+    chunks = []
+    for piece in _SENTENCE_RE.findall(text or ""):
+        piece = piece.strip()
+        if not piece:
+            continue
+        if chunks and len(chunks[-1]) < _MIN_SENTENCE_CHARS:
+            chunks[-1] += " " + piece
+        else:
+            chunks.append(piece)
+    if len(chunks) > 1 and len(chunks[-1]) < _MIN_SENTENCE_CHARS:
+        tail = chunks.pop()
+        chunks[-1] += " " + tail
+    return chunks
+
+
+def write_atomic(fpath: Path, data: bytes, engine: str = "") -> None:
+    # readers (the audio server, other sessions and workers) never see a half-written clip
+    audio_stream.write_atomic(fpath, data)
+    clip_cache.record(fpath.name, len(data), engine)
+
+
+def publish_clip(fpath: Path, data: bytes, engine: str = "") -> None:
+    """Write a clip we are about to hand out and keep it in the server's hot set."""
+    write_atomic(fpath, data, engine)
+    audio_stream.remember(fpath.name, data)
+
+
+def pin_clip(tool_context, res: dict) -> dict:
+    """Keep the returned clip on disk for as long as this session is active."""
+    session = getattr(tool_context, "session", None) if tool_context is not None else None
+    if session is not None and res.get("audio_url"):
+        clip_cache.pin(session.id, res["audio_url"].rsplit("/", 1)[-1])
+    return res
+
+
+def strip_id3(data: bytes) -> bytes:
+    # ID3v2 header: 'ID3', ver(2), flags(1), syncsafe size(4) [+ 10-byte footer if flagged]
+    if data[:3] != b"ID3" or len(data) < 10:
+        return data
+    size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+    return data[10 + size + (10 if data[5] & 0x10 else 0):]
+
+
+def stitch(paths: list[Path], out: Path, engine: str = "") -> None:
+    if paths[0].suffix == ".wav":
+        # Gemini sentences are PCM WAV; the reply is encoded once, sentence by sentence
+        publish_clip(out, audio_codec.encode(wav_frames(p) for p in paths), engine)
+    else:
+        # MPEG frames are self-delimiting; concatenated streams play as one
+        publish_clip(out, b"".join(strip_id3(p.read_bytes()) for p in paths), engine)
+
+
+def wav_frames(path: Path) -> bytes:
+    with wave.open(str(path), "rb") as rf:
+        return rf.readframes(rf.getnframes())
+
+
+# --- STREAMING DELIVERY (see speak_stream) ------------------------------------
+TTS_STREAMING = os.getenv("TTS_STREAMING", "1") != "0"
+
+
+# the producer's disk / encoder steps, shared with the async producer (which runs them off the loop)
+def save_head(head_path: Path, head: bytes, head_file, engine: str) -> None:
+    if not head_path.exists():
+        write_atomic(head_path, head_file(head), engine)
+
+
+def append_clip(live, body_of, path: Path) -> None:
+    live.write(body_of(path))
+
+
+def finish_stream(live, transform, engine: str) -> None:
+    clip_cache.record(live.fpath.name, live.finish(transform), engine)
+
+
+def stream_target(fname: str, content_type: str, voice: str, engine: str) -> tuple[dict | None, object]:
+    """(result, None) when the clip is cached or already streaming, else (None, the new LiveClip to produce into)."""
+    if clip_cache.lookup(AUDIO_DIR / fname):
+        return audio_result(fname, voice, f"{engine}(cache)"), None
+    live, created = audio_stream.open_clip(AUDIO_DIR / fname, content_type)
+    if not created:
+        return audio_result(fname, voice, f"{engine}(stream)"), None
+    return None, live
+
+
+def cached_head(head_path: Path, read):
+    """read(head_path) if the first sentence is already cached, else None."""
+    return read(head_path) if clip_cache.lookup(head_path) else None
+
+
+# --- LOCAL TTS (see speak_local) ----------------------------------------------
+LOCAL_TTS_DRAFT_AFTER = float(os.getenv("LOCAL_TTS_DRAFT_AFTER", "0"))   # seconds; 0 = never draft
+_NO_LOCAL_TTS = "no local TTS engine (install espeak-ng, or piper with voices in PIPER_VOICES)"
+
+
+def local_voice(nationality: str, gender: str) -> str:
+    if local_tts is None:
+        raise RuntimeError(_NO_LOCAL_TTS)
+    return local_tts.voice(voice_table.local.get(_region_key_from_nat(nationality)), gender)
+
+
+def local_key(voice: str, text: str) -> str:
+    norm = " ".join(unicodedata.normalize("NFC", text or "").split())
+    return cache_key(f"{local_tts.name}|{voice}", norm)
+
+
+# --- ENGINE ROUTING (speak_elevenlabs_auto) -----------------------------------
+# ElevenLabs preferred, Gemini as fallback/hedge, the local voice last; see engine_router for the policy
+TTS_ROUTER = EngineRouter(last_resort=("local",))
+REGISTRY.collect(TTS_ROUTER.metrics)
+REGISTRY.collect(lambda: ((f"clip_cache_{k}", {}, v) for k, v in clip_cache.stats().items()
+                          if k not in ("hits", "misses")))   # those are cache_*_total{cache="clip"}
+
+
+def _count_fallback(eleven, notes: list[str], engine: str = "gemini") -> None:
+    text = " ".join(notes)
+    reason = ("no_voice" if eleven is None else "hedge" if "hedged to" in text
+              else "circuit_open" if "circuit open" in text else "error")
+    inc("tts_fallbacks_total", reason=reason, engine=engine)
+
+
+def label_fallback(engine: str, eleven, res: dict, notes: list[str]) -> dict:
+    """Mark a clip that didn't come from ElevenLabs (error, open circuit, hedge, last resort or draft)."""
+    if engine == "local-draft":
+        res["engine"] = engine
+        res["note"] = f"[Draft voice: {'; '.join(notes)}]"
+    elif engine != "elevenlabs":
+        _count_fallback(eleven, notes, engine)
+        res["engine"] = f"{engine}-fallback"
+        res["note"] = f"[ElevenLabs fallback: {'; '.join(notes)}]"
+    return res
+
+
+def auto_candidates(text: str, nationality: str, gender: str, tool_context, eleven_fn, gemini_fn,
+                    local_fn) -> tuple[list, list[str]]:
+    """speak_elevenlabs_auto's (candidates, notes) for the router, built from tools' or async_tools' speak_* functions."""
+    notes, eleven = [], None
+    try:
+        nationality, gender, voice_id = persona_voice(tool_context, nationality, gender)
+        region = ""
+        if not voice_id:
+            voice_id, region = _pick_eleven_voice_id(nationality, gender)
+        # If we couldn't map a usable voice, bail to fallback immediately
+        if not voice_id:
+            raise RuntimeError("No usable ElevenLabs voice_id for this account/region/gender.")
+        if region:
+            remember_voice(tool_context, nationality, gender, voice_id, region)
+        eleven = partial(eleven_fn, text=text, voice_id=voice_id)
+    except Exception as e:
+        notes.append(f"elevenlabs: {e}")
+    gemini = partial(gemini_fn, text=text, voice="Kore")
+    local = partial(local_fn, text=text, nationality=nationality, gender=gender) if local_tts else None
+    return [("elevenlabs", eleven), ("gemini", gemini), ("local", local)], notes
+
+
+def no_engine(notes: list[str], error: NoEngineAvailable) -> dict:
+    inc("tts_failures_total")
+    return {
+        "audio_url": "",
+        "audio_tag": "",
+        "voice": "",
+        "engine": "none",
+        "error": "; ".join(notes + [str(error)])
+    }
@@ -0,0 +1,397 @@
+import asyncio, contextvars, heapq, itertools, os, threading, time
+from contextlib import asynccontextmanager, contextmanager
+
+from .metrics import REGISTRY, span
+
+
+# --- UPSTREAM GUARDS (singleflight + per-provider token buckets) -------------
+# Identical in-flight requests (same profile, same clip) share one upstream
+# call: the first caller does the work, everyone else waits for its result.
+# Every call that does reach a provider first takes a token from that
+# provider's bucket; waiters are served by priority, so a user's reply is
+# synthesized before background prefetch, and a 429 pauses the whole bucket
+# instead of letting every worker retry into the same wall.
+# Speculative work (see prefetch) runs at background priority too, and a
+# speculative call is dropped once nobody is waiting for its result. When a
+# real caller joins one, it is promoted: its queued tickets move up to
+# interactive priority, and so do the requests it makes from then on.
+# Time spent queued for a token is our own doing, not the provider's: a
+# QueueClock (see engine_router) measures it so it can be left out of an
+# engine's latency.
+
+INTERACTIVE = 0
+BACKGROUND = 10
+DEFAULT_BACKOFF = 5.0     # seconds a bucket pauses after a 429 that carried no Retry-After
+_ASYNC_POLL = 0.05        # async waiters re-check at least this often (they can't block on the condition)
+
+_PRIORITY = contextvars.ContextVar("upstream_priority", default=INTERACTIVE)
+_SPECULATIVE = contextvars.ContextVar("upstream_speculative", default=False)
+_QUEUE_CLOCK = contextvars.ContextVar("upstream_queue_clock", default=None)
+_FLIGHT = contextvars.ContextVar("upstream_speculative_flight", default=None)
+
+
+class RateLimited(RuntimeError):
+    pass
+
+
+@contextmanager
+def background():
+    """Upstream calls made inside this block (and tasks it spawns) queue behind interactive ones."""
+    token = _PRIORITY.set(BACKGROUND)
+    try:
+        yield
+    finally:
+        _PRIORITY.reset(token)
+
+
+@contextmanager
+def speculative():
+    """background(), and calls started inside are cancelled when their last waiter gives up on them."""
+    token = _SPECULATIVE.set(True)
+    try:
+        with background():
+            yield
+    finally:
+        _SPECULATIVE.reset(token)
+
+
+class QueueClock:
+    """
+    Wall time the calls made inside `with clock:` (and the threads / tasks they spawn) spent waiting for
+    bucket tokens. Parallel waits overlap, so it counts time during which at least one call was queued.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._since = 0.0
+        self._total = 0.0
+        self._token = None
+
+    def __enter__(self) -> "QueueClock":
+        self._token = _QUEUE_CLOCK.set(self)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        _QUEUE_CLOCK.reset(self._token)
+
+    def queued(self) -> float:
+        """Seconds queued so far, including a wait still in progress."""
+        with self._lock:
+            return self._total + (time.monotonic() - self._since if self._waiting else 0.0)
+
+    def _start(self) -> None:
+        with self._lock:
+            if not self._waiting:
+                self._since = time.monotonic()
+            self._waiting += 1
+
+    def _stop(self) -> None:
+        with self._lock:
+            self._waiting -= 1
+            if not self._waiting:
+                self._total += time.monotonic() - self._since
+
+
+@contextmanager
+def _queueing():
+    clock = _QUEUE_CLOCK.get()
+    if clock is None:
+        yield
+        return
+    clock._start()
+    try:
+        yield
+    finally:
+        clock._stop()
+
+
+class _Speculation:
+    """The bucket tickets one speculative flight has queued, so a real caller joining it can promote them."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.promoted = False
+        self._tickets: list = []   # (bucket, ticket)
+
+    def queued(self, bucket, ticket) -> None:
+        with self._lock:
+            self._tickets.append((bucket, ticket))
+
+    def promote(self) -> None:
+        with self._lock:
+            self.promoted, tickets, self._tickets = True, self._tickets, []
+        for bucket, ticket in tickets:
+            bucket._promote(ticket)
+
+
+def _speculating() -> bool:
+    spec = _FLIGHT.get()
+    return _SPECULATIVE.get() and not (spec is not None and spec.promoted)
+
+
+def submit(pool, fn, *args):
+    """pool.submit that carries the caller's priority into the worker thread."""
+    return pool.submit(contextvars.copy_context().run, fn, *args)
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict = {}    # key -> _Call (threads)
+        self._tasks: dict = {}    # (loop, key) -> asyncio.Future
+        self._waiters: dict = {}  # asyncio.Future -> callers awaiting it
+        self._speculative: dict = {}     # futures started under speculative() -> their _Speculation
+
+    def do(self, key, fn):
+        """Run fn() unless the same key is already running; then wait for and share that result."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def do_async(self, key, fn):
+        """
+        do() for a coroutine function; one waiter being cancelled does not cancel the shared call.
+        A speculative call is the exception: it is cancelled once every waiter has been.
+        """
+        loop = asyncio.get_running_loop()
+        fut = self._tasks.get((loop, key))
+        if fut is None:
+            spec = _Speculation() if _speculating() else None
+            token = _FLIGHT.set(spec)   # the task's context: its bucket tickets register with `spec`
+            try:
+                fut = self._tasks[(loop, key)] = asyncio.ensure_future(fn())
+            finally:
+                _FLIGHT.reset(token)
+            self._waiters[fut] = 0
+            if spec is not None:
+                self._speculative[fut] = spec
+            fut.add_done_callback(lambda f: self._tasks.pop((loop, key), None))
+            fut.add_done_callback(lambda f: (self._waiters.pop(f, None), self._speculative.pop(f, None)))
+            fut.add_done_callback(lambda f: f.cancelled() or f.exception())  # nobody left waiting: don't warn
+        self._waiters[fut] += 1
+        if not _speculating() and fut in self._speculative:
+            # a real caller wants it now: no longer droppable, and no longer queued behind interactive calls
+            self._speculative.pop(fut).promote()
+        try:
+            return await asyncio.shield(fut)
+        except asyncio.CancelledError:
+            if fut in self._speculative and self._waiters.get(fut) == 1:
+                fut.cancel()
+            raise
+        finally:
+            if fut in self._waiters:   # dropped once the call is done
+                self._waiters[fut] -= 1
+
+    def __len__(self):
+        return len(self._calls) + len(self._tasks)
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class TokenBucket:
+    def __init__(self, name: str, rate: float, burst: float):
+        self.name = name
+        self.rate = rate                     # tokens per second; <= 0 disables the limit
+        self.burst = max(1.0, burst)
+        self.waits = 0                       # acquisitions that had to queue
+        self._tokens = self.burst
+        self._stamp = time.monotonic()
+        self._paused_until = 0.0
+        self._cond = threading.Condition()
+        self._queue: list = []               # heap of [priority, seq] tickets
+        self._seq = itertools.count()
+
+    def acquire(self, priority: int | None = None, timeout: float | None = None) -> None:
+        """Block until a token is granted; raises RateLimited after `timeout` seconds."""
+        if self.rate <= 0:
+            return
+        deadline = None if timeout is None else time.monotonic() + timeout
+        queued = False
+        with _queueing(), self._cond:
+            ticket = self._enqueue(priority)
+            try:
+                while True:
+                    delay = self._grant(ticket)
+                    if delay == 0.0:
+                        return
+                    self.waits += queued is False
+                    queued = True
+                    self._cond.wait(self._bounded(delay, deadline))
+            except BaseException:
+                self._drop(ticket)
+                raise
+
+    async def acquire_async(self, priority: int | None = None, timeout: float | None = None) -> None:
+        if self.rate <= 0:
+            return
+        deadline = None if timeout is None else time.monotonic() + timeout
+        queued = False
+        with self._cond:
+            ticket = self._enqueue(priority)
+        try:
+            with _queueing():
+                while True:
+                    with self._cond:
+                        delay = self._grant(ticket)
+                        if delay == 0.0:
+                            return
+                        self.waits += queued is False
+                    queued = True
+                    await asyncio.sleep(min(self._bounded(delay, deadline), _ASYNC_POLL))
+        except BaseException:
+            with self._cond:
+                self._drop(ticket)
+            raise
+
+    def backoff(self, delay: float | None = None) -> None:
+        """The provider pushed back (429): hold every waiter for `delay` seconds and drain the burst."""
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + (delay or DEFAULT_BACKOFF))
+            self._tokens = min(self._tokens, 0.0)
+            self._stamp = self._paused_until  # nothing accrues during the pause
+
+    def spare(self) -> float:
+        """Tokens free right now with nobody queued (inf when unlimited): what speculative work may take."""
+        if self.rate <= 0:
+            return float("inf")
+        with self._cond:
+            now = time.monotonic()
+            self._refill(now)
+            return 0.0 if self._queue or now < self._paused_until else self._tokens
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            self._refill(time.monotonic())
+            return {"tokens": round(self._tokens, 2), "queued": len(self._queue), "waits": self.waits,
+                    "paused_for": round(max(self._paused_until - time.monotonic(), 0.0), 2)}
+
+    # -- internals (lock held) ---------------------------------------------
+    def _enqueue(self, priority):
+        spec = _FLIGHT.get()
+        if priority is None:
+            priority = INTERACTIVE if spec is not None and spec.promoted else _PRIORITY.get()
+        ticket = [priority, next(self._seq)]   # a list: promotion re-prioritises it in place
+        heapq.heappush(self._queue, ticket)
+        if spec is not None:
+            spec.queued(self, ticket)
+        return ticket
+
+    def _promote(self, ticket) -> None:
+        with self._cond:
+            if ticket in self._queue and ticket[0] > INTERACTIVE:
+                ticket[0] = INTERACTIVE
+                heapq.heapify(self._queue)
+                self._cond.notify_all()
+
+    def _drop(self, ticket) -> None:
+        if ticket in self._queue:
+            self._queue.remove(ticket)
+            heapq.heapify(self._queue)
+            self._cond.notify_all()
+
+    def _refill(self, now: float) -> None:
+        if now > self._stamp:   # _stamp sits in the future while paused
+            self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+            self._stamp = now
+
+    def _grant(self, ticket) -> float:
+        """0.0 if `ticket` got its token, else seconds until it is worth checking again."""
+        now = time.monotonic()
+        self._refill(now)
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self._queue[0] == ticket and self._tokens >= 1.0:
+            self._tokens -= 1.0
+            heapq.heappop(self._queue)
+            self._cond.notify_all()
+            return 0.0
+        if self._queue[0] == ticket:
+            return (1.0 - self._tokens) / self.rate
+        return 1.0 / self.rate   # someone ahead; woken early when they are served
+
+    @staticmethod
+    def _bounded(delay: float, deadline: float | None) -> float:
+        if deadline is None:
+            return delay
+        left = deadline - time.monotonic()
+        if left <= 0:
+            raise RateLimited("upstream rate limit: gave up waiting for a token")
+        return min(delay, left)
+
+
+def _bucket(name: str, env: str, rate: float, burst: float) -> TokenBucket:
+    return TokenBucket(name, float(os.getenv(f"{env}_RPS", rate)), float(os.getenv(f"{env}_BURST", burst)))
+
+
+# Requests/second and burst per provider; override with e.g. ELEVEN_RPS=2 ELEVEN_BURST=4 (RPS=0 disables).
+# ElevenLabs gets one request per sentence (a reply is typically 5-10), so its burst covers two whole replies.
+LIMITS = {
+    "gemini": _bucket("gemini", "GEMINI", 5, 10),
+    "gemini-tts": _bucket("gemini-tts", "GEMINI_TTS", 2, 4),
+    "elevenlabs": _bucket("elevenlabs", "ELEVEN", 10, 20),
+}
+
+flight = SingleFlight()
+REGISTRY.collect(lambda: ((f"ratelimit_{k}", {"provider": name}, v)
+                          for name, b in LIMITS.items() for k, v in b.snapshot().items()))
+
+
+@contextmanager
+def limited(provider: str):
+    """Take a token from `provider`'s bucket for one call; an HTTP 429 raised inside pauses the bucket."""
+    bucket = LIMITS[provider]
+    with span("upstream_wait", provider=provider):
+        bucket.acquire()
+    with span("upstream", provider=provider) as s:
+        try:
+            yield bucket
+        except Exception as e:
+            if _is_429(e):
+                s["outcome"] = "rate_limited"
+                bucket.backoff()
+            raise
+
+
+@asynccontextmanager
+async def limited_async(provider: str):
+    bucket = LIMITS[provider]
+    with span("upstream_wait", provider=provider):
+        await bucket.acquire_async()
+    with span("upstream", provider=provider) as s:
+        try:
+            yield bucket
+        except Exception as e:
+            if _is_429(e):
+                s["outcome"] = "rate_limited"
+                bucket.backoff()
+            raise
+
+
+def _is_429(e: Exception) -> bool:
+    # google-genai APIError carries .code; HTTP client errors carry .status_code
+    return getattr(e, "code", None) == 429 or getattr(e, "status_code", None) == 429
@@ -0,0 +1,60 @@
+import json, os, re
+from functools import lru_cache
+from pathlib import Path
+
+from .profile_store import normalize_name
+
+
+# --- VOICE ROUTING (data-driven nationality -> accent region -> voice) -------
+# voices.json lists each accent region with its ElevenLabs / Gemini / local
+# voices and the nationality words that select it. At load time every word is compiled
+# into ONE word-boundary regex (longest alternatives first), so "uk" no longer
+# fires inside "Ukrainian" and "South African" beats "African". The leftmost
+# mention wins ("Greek (Alexandrian)" -> Europe); lookups are LRU-memoized, so
+# a persona's repeat TTS calls resolve with a dict hit. Point VOICE_CONFIG at
+# another file to re-route voices without touching code.
+
+VOICE_CONFIG = Path(os.getenv("VOICE_CONFIG") or Path(__file__).with_name("voices.json"))
+_MALE = frozenset(("male", "m", "man"))
+_FEMALE = frozenset(("female", "f", "woman"))
+
+
+class VoiceTable:
+    def __init__(self, config: dict):
+        self.regions: dict[str, dict] = config["regions"]
+        self.default_region: str = config.get("default_region") or next(iter(self.regions))
+        if self.default_region not in self.regions:
+            raise ValueError(f"default_region {self.default_region!r} is not a configured region")
+        self.eleven: dict[str, dict] = {k: dict(r.get("elevenlabs") or {}) for k, r in self.regions.items()}
+        self.local: dict[str, dict] = {k: dict(r.get("local") or {}) for k, r in self.regions.items()}
+
+        self._term_region: dict[str, str] = {}
+        for key, region in self.regions.items():
+            for term in region.get("match") or ():
+                # first region to claim a term keeps it
+                self._term_region.setdefault(normalize_name(term), key)
+        terms = sorted((t for t in self._term_region if t), key=len, reverse=True)
+        self._pattern = re.compile(r"(?<!\w)(?:" + "|".join(re.escape(t) for t in terms) + r")(?!\w)") \
+            if terms else None
+        # per-instance memo (a reloaded table starts cold)
+        self.region = lru_cache(maxsize=2048)(self._region)
+        self.gemini_voice = lru_cache(maxsize=2048)(self._gemini_voice)
+
+    @classmethod
+    def load(cls, path: Path = VOICE_CONFIG) -> "VoiceTable":
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def _region(self, nationality: str) -> str:
+        """Accent region key for a nationality/place string; the default region if nothing matches."""
+        m = self._pattern.search(normalize_name(nationality)) if self._pattern else None
+        return self._term_region[m.group(0)] if m else self.default_region
+
+    def _gemini_voice(self, nationality: str, gender: str) -> str:
+        voices = self.regions[self.region(nationality)].get("gemini") or {}
+        g = (gender or "").strip().lower()
+        sex = "male" if g in _MALE else ("female" if g in _FEMALE else "")
+        return voices.get(sex) or voices.get("default") or "Kore"
+
+
+voice_table = VoiceTable.load()
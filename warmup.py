@@ -0,0 +1,93 @@
+import argparse, sys, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import tools
+from .clients import getenv
+from .upstream import background
+from .voice_routing import voice_table
+
+
+# --- WARM-UP (fill persona caches before traffic) ---------------------------
+# The opening message always suggests the same handful of figures, so the
+# first visitor to pick one shouldn't pay for a cold profile, style set and
+# delivery line. No audio is rendered: clips are keyed by the exact reply
+# text, which no warm-up can predict, so a pre-rendered clip would never be
+# hit and would only spend TTS quota. Run it once per deploy (CLI) or let the
+# agent kick it off at import (WARMUP_ON_START=1). Calls run at background
+# priority, so real sessions arriving mid-warm-up are served first.
+#
+#   python -m <agent_package>.warmup                        # the suggested figures
+#   python -m <agent_package>.warmup "Ada Lovelace:female" "Nikola Tesla:male" -j 3
+
+# same list the opening script in agent.py suggests
+DEFAULT_FIGURES = [
+    "Marie Curie:female", "Ibn Sīnā:male", "Cleopatra:female",
+    "Alan Turing:male", "Hypatia:female", "Leonardo da Vinci:male",
+]
+WARMUP_CONCURRENCY = 2   # figures in flight at once (each runs its three lookups in parallel)
+
+
+def warm_figure(spec: str) -> dict:
+    """Warm one 'Name[:gender]' entry (gender is only used by speech, so ignored here). Never raises."""
+    name = spec.partition(":")[0].strip()
+    report = {"figure": name, "missing": [], "region": "", "error": ""}
+    t0 = time.perf_counter()
+    with background():
+        try:
+            bundle = tools.get_persona(name)
+            report["missing"] = bundle.get("missing", [])
+            profile = bundle["profile"] if isinstance(bundle.get("profile"), dict) else {}
+            # the accent region speak_elevenlabs_auto will pick: a wrong one shows up here, before traffic
+            report["region"] = voice_table.region(profile.get("nationality") or "")
+            if "profile" in report["missing"]:
+                report["error"] = "profile missing"
+        except Exception as e:
+            report["error"] = str(e)
+    report["seconds"] = round(time.perf_counter() - t0, 2)
+    return report
+
+
+def warm(figures: list[str] | None = None, concurrency: int = WARMUP_CONCURRENCY) -> list[dict]:
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="warmup") as pool:
+        return list(pool.map(warm_figure, figures or DEFAULT_FIGURES))
+
+
+def start_warmup(figures: list[str] | None = None, concurrency: int = WARMUP_CONCURRENCY) -> threading.Thread:
+    """Run warm() on a daemon thread and return immediately."""
+    t = threading.Thread(target=warm, args=(figures, concurrency), name="warmup", daemon=True)
+    t.start()
+    return t
+
+
+def start_from_env():
+    """Startup hook: WARMUP_ON_START=1 warms the defaults; WARMUP_FIGURES='Name:gender, ...' picks the list."""
+    figures = [f.strip() for f in (getenv("WARMUP_FIGURES") or "").split(",") if f.strip()]
+    if not figures and (getenv("WARMUP_ON_START") or "0") == "0":
+        return None
+    return start_warmup(figures or None, int(getenv("WARMUP_CONCURRENCY") or WARMUP_CONCURRENCY))
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Pre-warm persona profiles, style samples and delivery lines.")
+    ap.add_argument("figures", nargs="*", help="'Name' or 'Name:gender' (default: the figures the agent suggests)")
+    ap.add_argument("-f", "--file", help="read figures from a file, one per line")
+    ap.add_argument("-j", "--concurrency", type=int, default=WARMUP_CONCURRENCY)
+    args = ap.parse_args(argv)
+
+    figures = list(args.figures)
+    if args.file:
+        with open(args.file, encoding="utf-8") as fh:
+            figures += [line.strip() for line in fh if line.strip() and not line.startswith("#")]
+
+    failed = 0
+    for r in warm(figures or None, args.concurrency):
+        status = "FAIL" if r["error"] else "ok"
+        failed += bool(r["error"])
+        extra = f" missing={','.join(r['missing'])}" if r["missing"] else ""
+        print(f"[{status}] {r['figure']:<24} {r['seconds']:>6.2f}s region={r['region'] or '-'}{extra}"
+              + (f" error={r['error']}" if r["error"] else ""))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())